@@ -0,0 +1,119 @@
+import atexit
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+from metrics import METRICS
+
+
+class AccessLog:
+    """
+    A redirect log written as JSON lines by a background thread.
+
+    log() only puts a tuple on a bounded queue, so serving a request never waits on the
+    output. The thread serializes and writes whatever is queued in batches of up to
+    batch_size records. Records are dropped, and counted in access_log_dropped_total, when
+    the queue is full; with a sample_rate below 1 only that fraction of requests is logged.
+    """
+
+    def __init__(self, path="-", sample_rate=1.0, queue_size=10000, batch_size=256):
+        self.path = path
+        self.sample_rate = float(sample_rate)
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self._thread = None
+        self._lock = threading.Lock()
+        atexit.register(self.drain)
+
+    def log(self, host, path, query_string, resolution, started, cached):
+        """
+        Queues a record for a resolved request that started at time.perf_counter() started.
+        """
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+
+        record = (time.time(), host, path, query_string, resolution, time.perf_counter() - started, cached)
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            METRICS.increment("access_log_dropped_total")
+            return
+
+        self.ensure_running()
+
+    def ensure_running(self):
+        if self._thread is not None:
+            return
+
+        self._thread = threading.Thread(target=self._run, name="access-log", daemon=True)
+        self._thread.start()
+        os.register_at_fork(after_in_child=self._forget_thread)
+
+    def _forget_thread(self):
+        self._thread = None
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.write(batch)
+
+    def drain(self):
+        """
+        Writes out everything still queued, from the calling thread.
+        """
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self.write(batch)
+
+    def write(self, batch):
+        lines = "".join(json.dumps(format_record(*record), separators=(",", ":")) + "\n" for record in batch)
+        with self._lock:
+            if self.path == "-":
+                sys.stdout.write(lines)
+                sys.stdout.flush()
+                return
+
+            # A single append per batch, so the lines of different workers don't interleave
+            with open(self.path, "a") as f:
+                f.write(lines)
+
+
+def format_record(timestamp, host, path, query_string, resolution, duration, cached):
+    return {
+        "time": round(timestamp, 3),
+        "host": host,
+        "path": "/" + path,
+        "query": query_string,
+        "branch": resolution.branch,
+        "key": resolution.matched,
+        "status": resolution.status,
+        "location": resolution.location,
+        "cached": cached,
+        "duration_ms": round(duration * 1000, 3),
+    }
+
+
+def create_access_log(config):
+    """
+    Returns the AccessLog for ACCESS_LOG, or for stdout when DEBUG is on, None if neither is set.
+    """
+    path = config["ACCESS_LOG"] or ("-" if config["DEBUG"] else None)
+    if not path:
+        return None
+    return AccessLog(path, config["ACCESS_LOG_SAMPLE_RATE"], int(config["ACCESS_LOG_QUEUE_SIZE"]))
@@ -0,0 +1,120 @@
+import functools
+import threading
+import time
+
+from werkzeug.exceptions import ServiceUnavailable
+
+from metrics import METRICS
+
+SHED_STATUS = "503 SERVICE UNAVAILABLE"
+SHED_BODY = ServiceUnavailable().get_body().encode("utf-8")
+
+
+def request_queue_time(request_start, now):
+    """
+    Returns how many seconds before now the router received a request, from its X-Request-Start
+    header: milliseconds since the epoch from Heroku's router, or "t=" and seconds or
+    microseconds from nginx. Returns None when the header is missing or unusable.
+    """
+    if not request_start:
+        return None
+    try:
+        started = float(request_start.strip().removeprefix("t="))
+    except ValueError:
+        return None
+
+    # Seconds since the epoch are around 1e9, milliseconds 1e12 and microseconds 1e15
+    if started > 1e14:
+        started /= 1e6
+    elif started > 1e11:
+        started /= 1e3
+    return max(now - started, 0.0)
+
+
+class AdmissionControl:
+    """
+    Sheds the requests of a worker with a cheap 503 and a Retry-After header before they are
+    resolved, when ADMISSION_MAX_IN_FLIGHT requests are already in progress or the request
+    spent more than ADMISSION_MAX_QUEUE_TIME seconds in the router and the backlog. Turning
+    them away early keeps the latency of the requests that are served bounded, rather than
+    every request waiting out the backlog until the router times it out.
+
+    Requests is_priority(environ) doesn't favor, those for hosts that aren't served here and
+    for assets, only get ADMISSION_LOW_PRIORITY_SHARE of either limit so they are shed first.
+    """
+
+    def __init__(self, config, is_priority):
+        self.is_priority = is_priority
+        self.max_in_flight = int(config["ADMISSION_MAX_IN_FLIGHT"])
+        self.max_queue_time = float(config["ADMISSION_MAX_QUEUE_TIME"])
+        self.enabled = bool(self.max_in_flight or self.max_queue_time)
+
+        share = float(config["ADMISSION_LOW_PRIORITY_SHARE"])
+        self.low_priority_max_in_flight = max(int(self.max_in_flight * share), 1)
+        self.low_priority_max_queue_time = self.max_queue_time * share
+
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+        # Built once, a shed request shouldn't cost more than the 400 of an unknown host
+        self.shed_headers = [
+            ("Content-Type", "text/html; charset=utf-8"),
+            ("Content-Length", str(len(SHED_BODY))),
+            ("Retry-After", str(int(config["ADMISSION_RETRY_AFTER"]))),
+            ("Cache-Control", "no-store"),
+            ("Server", "MoFo Redirector"),
+        ]
+
+    def admit(self, environ, priority):
+        """
+        Returns why a request is shed, or None when it is admitted and counted as in flight
+        until release() is called.
+        """
+        if self.max_queue_time:
+            queue_time = request_queue_time(environ.get("HTTP_X_REQUEST_START"), time.time())
+            max_queue_time = self.max_queue_time if priority else self.low_priority_max_queue_time
+            if queue_time is not None and queue_time > max_queue_time:
+                return "queue_time"
+
+        with self._lock:
+            max_in_flight = self.max_in_flight if priority else self.low_priority_max_in_flight
+            if self.max_in_flight and self.in_flight >= max_in_flight:
+                return "in_flight"
+            self.in_flight += 1
+        return None
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def shed(self, environ, start_response, priority, reason):
+        """
+        Answers a request admit() turned away, as a WSGI application would.
+        """
+        labels = (("priority", "high" if priority else "low"), ("reason", reason))
+        METRICS.increment("requests_shed_total", labels)
+        start_response(SHED_STATUS, self.shed_headers)
+        return [b"" if environ.get("REQUEST_METHOD") == "HEAD" else SHED_BODY]
+
+    def wsgi(self, application):
+        """
+        Wraps a WSGI application so its requests go through admission control. A request is in
+        flight while the application runs, which is all the time a WSGI server spends on it;
+        AsgiApp, whose event loop holds requests longer than that, admits them itself.
+        """
+        if not self.enabled:
+            return application
+
+        @functools.wraps(application)
+        def admitted_application(environ, start_response):
+            priority = self.is_priority(environ)
+            reason = self.admit(environ, priority)
+            if reason is not None:
+                return self.shed(environ, start_response, priority, reason)
+
+            try:
+                return application(environ, start_response)
+            finally:
+                self.release()
+
+        return admitted_application
@@ -1,36 +1,308 @@
+import gc
+import hmac
 import json
+import os
 import re
-from urllib.parse import ParseResult, urlencode, urlparse, urlunparse
+import threading
+import time
+from typing import NamedTuple
+from urllib.parse import unquote, urlsplit
+
+from flask import Config as FlaskConfig
+from flask import Flask, Response, abort, jsonify, make_response, redirect, request
+from werkzeug.exceptions import BadRequest, Gone
+
+from access_log import create_access_log
+from admission import AdmissionControl
+from rate_limit import RateLimiter
+from cache_policy import CachePolicy, etag_matches
+from config import Config
+from key_usage import KEY_USAGE, key_usage_report
+from metrics import METRICS, render_prometheus
+from profiler import Profiler, start_stack_sampler, timed
+from redirect_map import (
+    LocaleIndex,
+    MappedRedirectMap,
+    RedirectMapStore,
+    canonical_key,
+    canonical_path,
+    canonical_query,
+    compiled_path_for,
+    delta_path_for,
+)
+from reloader import FileWatcher
+from response_cache import ResponseCache, render_redirect
+from patterns import compile_pattern_rules
+from rules import (
+    ASSET,
+    DONATE,
+    KEYVALUE,
+    PATTERN,
+    ROBOTS,
+    RULE,
+    UNMATCHED,
+    build_host_dispatch,
+    compile_rules,
+    normalize_host,
+)
+
+REDIRECT_MAP = LocaleIndex(canonical=True)
+
+# Resources such as JS, CSS and images are not redirected
+ASSET_EXTENSIONS = (".js", ".css", ".png", ".svg", ".ico", ".txt")
+
+# Rendered once, scanners send a lot of traffic for hosts we don't serve
+BAD_REQUEST_BODY = BadRequest().get_body()
+
+
+# Outcome of the redirect map (re)loads in this process
+RELOAD_STATS = {
+    "reloads": 0,
+    "failures": 0,
+    "deltas": 0,
+    "entries": 0,
+    "last_duration_seconds": 0.0,
+    "last_reload": None,
+    "last_error": None,
+}
+
+_reload_lock = threading.Lock()
+
+
+def build_redirect_map(path):
+    """
+    Builds the key/value redirect map for a Wagtail export without installing it.
+
+    If the export has been compiled (see compile_redirect_map.py) and the compiled file is
+    at least as new as the export, it is memory-mapped instead of parsing the JSON.
+    """
+    compiled_path = compiled_path_for(path)
+    try:
+        if not os.path.exists(path) or os.path.getmtime(compiled_path) >= os.path.getmtime(path):
+            return MappedRedirectMap(compiled_path)
+    except FileNotFoundError:
+        pass
+    except ValueError:
+        # Compiled by an older version, the export still works
+        if not os.path.exists(path):
+            raise
+
+    with open(path) as f:
+        return LocaleIndex(json.load(f), canonical=True)
 
-from flask import Flask, abort, make_response, redirect, request
 
-REDIRECT_MAP = {}
+def validate_redirect_map(redirect_map):
+    """
+    Raises ValueError if any entry of a freshly built redirect map is unusable.
+    """
+    for key in redirect_map:
+        redirect_to = redirect_map[key]["redirect_to"]
+        if not key.startswith("/"):
+            raise ValueError(f"redirect key {key!r} doesn't start with a slash")
+        if not redirect_to.startswith(("https://", "http://")):
+            raise ValueError(f"redirect target {redirect_to!r} for {key!r} isn't an absolute URL")
+
+
+def apply_pending_delta(redirect_map, path):
+    """
+    Applies the delta written next to a Wagtail export (see diff_redirect_exports.py) to its
+    redirect map, if there is one and it was made from that map. Raises ValueError if the
+    delta is unusable or doesn't add up to its checksum. Returns whether it was applied.
+    """
+    try:
+        with open(delta_path_for(path)) as f:
+            delta = json.load(f)
+    except FileNotFoundError:
+        return False
+
+    # Made from another export, or the export already has it
+    if delta["base"] != redirect_map.checksum:
+        return False
+
+    validate_redirect_map(delta["set"])
+    redirect_map.apply_delta(delta)
+    RELOAD_STATS["deltas"] += 1
+    return True
 
 
 def load_redirect_map(path="foundation.mozilla.org_wagtail_redirects.json"):
     """
     Load the foundation.mozilla.org redirects into memory.
     Not necessary to offload to some external resource like Redis yet.
+    Locale-prefixed entries are factored into a LocaleIndex to keep each worker small.
     """
 
     global REDIRECT_MAP
     try:
-        with open(path) as f:
-            REDIRECT_MAP = json.load(f)
+        REDIRECT_MAP = build_redirect_map(path)
     except FileNotFoundError:
-        REDIRECT_MAP = {}
+        REDIRECT_MAP = LocaleIndex(canonical=True)
 
+    try:
+        apply_pending_delta(REDIRECT_MAP, path)
+    except (OSError, ValueError, KeyError) as error:
+        RELOAD_STATS["failures"] += 1
+        RELOAD_STATS["last_error"] = f"{delta_path_for(path)}: {type(error).__name__}: {error}"
+    RELOAD_STATS["entries"] = len(REDIRECT_MAP)
 
-load_redirect_map()
 
+def reload_redirect_map(path="foundation.mozilla.org_wagtail_redirects.json"):
+    """
+    Builds and validates a new redirect map, then swaps it in with a single assignment so
+    in-flight lookups see either the old map or the new one. A map that fails to build or
+    validate is discarded and the current one stays. Returns whether the reload succeeded.
+    """
 
-def get_keyvalue_redirect(path, query_string, redirect_map, debug=False):
+    global REDIRECT_MAP
+    with _reload_lock:
+        started = time.monotonic()
+        try:
+            redirect_map = build_redirect_map(path)
+            validate_redirect_map(redirect_map)
+            apply_pending_delta(redirect_map, path)
+        except (OSError, ValueError, KeyError) as error:
+            RELOAD_STATS["failures"] += 1
+            RELOAD_STATS["last_error"] = f"{type(error).__name__}: {error}"
+            return False
+
+        REDIRECT_MAP = redirect_map
+        # The maps of the other hosts are loaded again on their next request
+        KEYVALUE_MAPS.clear()
+
+        RELOAD_STATS["reloads"] += 1
+        RELOAD_STATS["entries"] = len(redirect_map)
+        RELOAD_STATS["last_duration_seconds"] = time.monotonic() - started
+        RELOAD_STATS["last_reload"] = time.time()
+        RELOAD_STATS["last_error"] = None
+        return True
+
+
+def apply_redirect_map_delta(path="foundation.mozilla.org_wagtail_redirects.json"):
     """
-    Checks the in-memory key/value redirect map and returns a redirect response
+    Applies a new delta of the Wagtail export to the installed redirect map in place, in time
+    proportional to the size of the delta; lookups made meanwhile see each entry either
+    before or after it changed. Falls back to reload_redirect_map() if the delta wasn't made
+    from the installed map. Returns whether the map is up to date.
+    """
+
+    with _reload_lock:
+        started = time.monotonic()
+        try:
+            applied = apply_pending_delta(REDIRECT_MAP, path)
+        except (OSError, ValueError, KeyError) as error:
+            RELOAD_STATS["failures"] += 1
+            RELOAD_STATS["last_error"] = f"{delta_path_for(path)}: {type(error).__name__}: {error}"
+            return False
+
+        if applied:
+            RELOAD_STATS["entries"] = len(REDIRECT_MAP)
+            RELOAD_STATS["last_duration_seconds"] = time.monotonic() - started
+            RELOAD_STATS["last_reload"] = time.time()
+            RELOAD_STATS["last_error"] = None
+            return True
+
+    # Removed, or made from another export: rebuild the map from the export
+    return reload_redirect_map(path)
+
+
+def load_host_redirect_map(path):
+    """
+    Builds and validates the key/value redirect map of a host from KEYVALUE_MAPS. A map that
+    fails to build or validate is counted as a reload failure and replaced with an empty one.
+    """
+    try:
+        redirect_map = build_redirect_map(path)
+        validate_redirect_map(redirect_map)
+        apply_pending_delta(redirect_map, path)
+    except (OSError, ValueError, KeyError) as error:
+        RELOAD_STATS["failures"] += 1
+        RELOAD_STATS["last_error"] = f"{path}: {type(error).__name__}: {error}"
+        return LocaleIndex(canonical=True)
+    return redirect_map
+
+
+# Key/value redirect maps of the hosts in KEYVALUE_MAPS, loaded on their first request
+KEYVALUE_MAPS = RedirectMapStore(load_host_redirect_map, Config.KEYVALUE_MAPS_BUDGET)
+
+
+def reload_requested(authorization, config):
+    """
+    Checks the Authorization header of a reload request against ADMIN_TOKEN. The reload
+    endpoint doesn't exist unless ADMIN_TOKEN is set.
+    """
+    admin_token = config["ADMIN_TOKEN"]
+    if not admin_token:
+        return None
+    return hmac.compare_digest(authorization or "", f"Bearer {admin_token}")
+
+
+def watch_redirect_map(config):
+    """
+    Returns the FileWatcher that reloads the redirect maps when one of their exports, compiled
+    files or deltas changes, polling every REDIRECT_MAP_POLL_INTERVAL seconds (0 disables
+    polling). A change to the delta of REDIRECT_MAP_PATH alone is applied in place.
+    """
+    path = config["REDIRECT_MAP_PATH"]
+    watched = [path, *config["KEYVALUE_MAPS"].values()]
+
+    def on_change(changed):
+        if changed == [delta_path_for(path)]:
+            apply_redirect_map_delta(path)
+        else:
+            reload_redirect_map(path)
+
+    return FileWatcher(
+        [*watched, *map(compiled_path_for, watched), *map(delta_path_for, watched)],
+        float(config["REDIRECT_MAP_POLL_INTERVAL"]),
+        on_change,
+    )
+
+
+load_redirect_map(Config.REDIRECT_MAP_PATH)
+
+
+def prepare_for_fork():
+    """
+    Loads the key/value maps of every host, compacts them and moves everything allocated so
+    far out of the cyclic GC's reach, so forked workers keep sharing those pages with the
+    master instead of copying them the first time a collection touches them. Called by
+    gunicorn_config.py once the app is preloaded.
+    """
+    for path in Config.KEYVALUE_MAPS.values():
+        KEYVALUE_MAPS.get(path)
+    KEYVALUE_MAPS.compact()
+    REDIRECT_MAP.compact()
+    gc.collect()
+    gc.freeze()
+
+
+class Resolution(NamedTuple):
+    """
+    Where a request ends up: the status code, the redirect location (None for 400/410),
+    the branch that answered it and the rule host or key/value key that matched.
+    """
+
+    status: int
+    location: str
+    branch: str
+    matched: str
+
+
+def lookup_keyvalue_redirect(path, query_string, redirect_map):
+    """
+    Checks the in-memory key/value redirect map and returns (redirect_url, status_code, matched_key)
     if a match is found. Returns None otherwise.
     """
     full_path = "/" + path
 
+    if getattr(redirect_map, "canonical", False):
+        return lookup_canonical_redirect(full_path, query_string, redirect_map)
+
+    # Most requests aren't in the map, turn them away before building the candidates
+    key_filter = getattr(redirect_map, "key_filter", None)
+    if key_filter is not None and canonical_path(full_path) not in key_filter:
+        return None
+
     # Normalize: try as-is and strip trailing slash
     candidates = [full_path]
     if full_path.endswith("/"):
@@ -55,27 +327,379 @@ def get_keyvalue_redirect(path, query_string, redirect_map, debug=False):
 
             status_code = 301 if redirect_entry.get("is_permanent") else 302
 
-            if debug:
-                print(f"[kv redirect] {candidate} → {redirect_url} ({status_code})")
+            return redirect_url, status_code, candidate
+
+    return None
+
+
+def lookup_canonical_redirect(full_path, query_string, redirect_map):
+    """
+    lookup_keyvalue_redirect() for maps whose keys are canonical: the request is canonicalized
+    once and looked up with a single probe, plus one for its query string when the map has
+    keys with that query string.
+    """
+    key = canonical_key(full_path)
+
+    # A canonical key is its own canonical path
+    key_filter = redirect_map.key_filter
+    if key not in key_filter:
+        return None
+
+    if query_string:
+        query_key = f"{key}?{canonical_query(query_string)}"
+        if query_key in key_filter:
+            redirect_entry = redirect_map.get(query_key)
+            if redirect_entry:
+                status_code = 301 if redirect_entry.get("is_permanent") else 302
+                return redirect_entry["redirect_to"], status_code, query_key
+
+    redirect_entry = redirect_map.get(key)
+    if not redirect_entry:
+        return None
+
+    redirect_url = redirect_entry["redirect_to"]
+    if query_string:
+        separator = "&" if "?" in redirect_url else "?"
+        redirect_url = f"{redirect_url}{separator}{query_string}"
+
+    status_code = 301 if redirect_entry.get("is_permanent") else 302
+    return redirect_url, status_code, key
+
+
+def get_keyvalue_redirect(path, query_string, redirect_map):
+    """
+    Checks the in-memory key/value redirect map and returns a redirect response
+    if a match is found. Returns None otherwise.
+    """
+    match = lookup_keyvalue_redirect(path, query_string, redirect_map)
+    if match is None:
+        return None
+
+    redirect_url, status_code, candidate = match
+    return redirect(redirect_url, code=status_code)
+
+
+# Regex pattern to identify language codes (EX: /en-US/, /fr/)
+LANGUAGE_CODE_REGEX = re.compile(r"^[a-z]{2}(-[A-Z]{2}|-[A-Z][a-z])?/?$")
+# The default donate path
+DONATE_PATH = "/donate/"
+# Donate subpaths that exist on foundation.mozilla.org
+DONATE_SUBPATHS = ("faq", "help", "ways-to-give")
+
+
+def handle_donate_mozilla_org(path):
+    """
+    Strips language codes from the URL path, redirecting to '/donate/' or its approved subpaths if specified.
+    """
+    donate_path = DONATE_PATH
+
+    if path:
+        # Strip language codes from the path and reconstruct it,
+        path_segments = path.strip("/").split("/")
+        filtered_segments = [segment for segment in path_segments if not LANGUAGE_CODE_REGEX.match(segment)]
+        cleaned_path = "/".join(filtered_segments)
+
+        if cleaned_path in DONATE_SUBPATHS:
+            donate_path += cleaned_path
+
+    return donate_path
+
+
+def resolve_redirect(handler, path, query_string, redirect_map, timings=None):
+    """
+    Resolves a request for a host's HostHandler (None when the host isn't served), its path
+    (without leading slash) and its raw query string into a Resolution. Stage times are added
+    to timings when the request is being profiled; the stages are only wrapped in timed()
+    then, an extra call on every request roughly doubles the cost of the rule branch.
+    """
+    if handler is None:
+        if path.endswith(ASSET_EXTENSIONS):
+            return Resolution(410, None, ASSET, None)
+        return Resolution(400, None, UNMATCHED, None)
+
+    # Special handling for donate.mozilla.org requests
+    if handler.branch == DONATE:
+        if timings is None:
+            path = handle_donate_mozilla_org(path)
+        else:
+            path = timed(timings, "donate", handle_donate_mozilla_org, path)
+
+    # Prevent redirect for resources such as JS, CSS and images and return HTTP 410 Gone
+    if path.endswith(ASSET_EXTENSIONS):
+        return Resolution(410, None, ASSET, None)
+
+    # Use key/value redirects to short-circuit the redirect rule of the hosts that have them
+    if handler.branch == KEYVALUE:
+        if handler.keyvalue_path is not None:
+            redirect_map = KEYVALUE_MAPS.get(handler.keyvalue_path)
+        if timings is None:
+            match = lookup_keyvalue_redirect(path, query_string, redirect_map)
+        else:
+            match = timed(timings, "keyvalue", lookup_keyvalue_redirect, path, query_string, redirect_map)
+        if match:
+            redirect_url, status_code, candidate = match
+            return Resolution(status_code, redirect_url, KEYVALUE, candidate)
+
+    # Pattern rules take the paths the key/value map doesn't have before the host's rule
+    if handler.patterns is not None:
+        if timings is None:
+            match = handler.patterns.match("/" + path)
+        else:
+            match = timed(timings, "pattern", handler.patterns.match, "/" + path)
+        if match:
+            pattern_rule, captures = match
+            return Resolution(
+                pattern_rule.status_code, pattern_rule.build(captures, query_string), PATTERN, pattern_rule.pattern
+            )
+
+    rule = handler.rule
+    if rule:
+        branch = DONATE if handler.branch == DONATE else RULE
+        if timings is None:
+            location = rule.build(path, query_string)
+        else:
+            location = timed(timings, "rule_build", rule.build, path, query_string)
+        return Resolution(rule.status_code, location, branch, rule.host)
+
+    return Resolution(400, None, UNMATCHED, None)
+
+
+class RedirectLoop(ValueError):
+    """
+    Raised when following a redirect chain comes back to a URL it already visited.
+    """
+
+
+def is_permanent(status):
+    return status in (301, 308)
+
+
+class Resolver:
+    """
+    Resolves requests for a configuration: its host dispatch table and, when FLATTEN_REDIRECTS
+    is on, collapsing redirect chains through hosts this app serves into a single hop.
+    """
+
+    def __init__(self, config):
+        self.host_dispatch = build_host_dispatch(
+            compile_rules(config["REDIRECT_RULES"]),
+            keyvalue_hosts=config["KEYVALUE_HOSTS"],
+            donate_hosts=config["DONATE_HOSTS"],
+            pattern_matchers=compile_pattern_rules(config["PATTERN_RULES"]),
+            keyvalue_maps=config["KEYVALUE_MAPS"],
+        )
+        self.flatten = config["FLATTEN_REDIRECTS"]
+        self.max_hops = int(config["MAX_REDIRECT_HOPS"])
+
+    def resolve(self, host, path, query_string, redirect_map, timings=None):
+        """
+        Resolves a request for a normalized host into a Resolution.
+        """
+        resolution = resolve_redirect(self.host_dispatch.get(host), path, query_string, redirect_map, timings)
+
+        if self.flatten and resolution.location is not None:
+            try:
+                return self.follow(resolution, redirect_map, [(host, path, query_string)])
+            except RedirectLoop:
+                return resolution
 
-            return redirect(redirect_url, code=status_code)
+        return resolution
 
+    def follow(self, resolution, redirect_map, visited=()):
+        """
+        Follows a redirect through the hosts this app serves until it leaves them, and returns
+        a single Resolution for the whole chain. The chain is permanent only if every hop is,
+        otherwise it takes the status of its first temporary hop. Chains that end in a 400 or
+        410 here are not flattened. Raises RedirectLoop for cycles.
+        """
+        visited = list(visited)
+        final = resolution
+        status = resolution.status
+
+        for _ in range(self.max_hops):
+            target = urlsplit(final.location)
+            host = normalize_host(target.netloc)
+            handler = self.host_dispatch.get(host)
+            if handler is None or target.scheme not in ("http", "https"):
+                break
+
+            request_key = (host, unquote(target.path).lstrip("/"), target.query)
+            if request_key in visited:
+                raise RedirectLoop(" -> ".join(f"{host}/{path}" for host, path, _ in [*visited, request_key]))
+            visited.append(request_key)
+
+            hop = resolve_redirect(handler, *request_key[1:], redirect_map)
+            if hop.location is None:
+                return resolution
+
+            if is_permanent(status) and not is_permanent(hop.status):
+                status = hop.status
+            final = hop
+
+        return resolution._replace(status=status, location=final.location)
+
+
+def check_redirect_loops(resolver, redirect_map):
+    """
+    Follows the redirect of every host's root path, raising RedirectLoop if one cycles.
+    """
+    for host in resolver.host_dispatch:
+        resolution = resolve_redirect(resolver.host_dispatch[host], "", "", redirect_map)
+        if resolution.location is not None:
+            resolver.follow(resolution, redirect_map, [(host, "", "")])
+
+
+def predict_branch(resolver, environ):
+    """
+    Tells from the host and path of a request alone, before resolving it, whether it will get
+    robots.txt (ROBOTS), the 410 of an asset (ASSET), the 400 of a host that isn't served here
+    (UNMATCHED) or a redirect (None).
+    """
+    path = environ.get("PATH_INFO", "")
+    if path == "/robots.txt":
+        return ROBOTS
+
+    # Same order as resolve_redirect(): donate paths are rewritten to /donate/ before the
+    # asset check, so an asset path on a donate host is still redirected
+    host = normalize_host(environ.get("HTTP_X_FORWARDED_HOST") or environ.get("HTTP_HOST"))
+    handler = resolver.host_dispatch.get(host)
+    if handler is not None and handler.branch == DONATE:
+        return None
+    if path.endswith(ASSET_EXTENSIONS):
+        return ASSET
+    if handler is None:
+        return UNMATCHED
     return None
 
 
+def is_priority_request(resolver, environ):
+    """
+    Whether admission control favors a request: one for /robots.txt, which crawlers should
+    always get, or one that will be redirected rather than get a 400 or 410.
+    """
+    return predict_branch(resolver, environ) in (None, ROBOTS)
+
+
+def metrics_requested(authorization, config):
+    """
+    Checks a metrics request: None when metrics are disabled, otherwise whether the
+    Authorization header carries ADMIN_TOKEN, if one is set.
+    """
+    if not config["METRICS_ENABLED"]:
+        return None
+    if not config["ADMIN_TOKEN"]:
+        return True
+    return reload_requested(authorization, config)
+
+
+def key_usage_requested(authorization, config):
+    """
+    Same as metrics_requested(), for the key usage report.
+    """
+    if not config["KEY_USAGE_ENABLED"]:
+        return None
+    if not config["ADMIN_TOKEN"]:
+        return True
+    return reload_requested(authorization, config)
+
+
+def record_key_usage(resolver, host, resolution):
+    """
+    Counts a request answered by a key of REDIRECT_MAP; the maps of KEYVALUE_MAPS aren't counted.
+    """
+    handler = resolver.host_dispatch.get(host)
+    if handler is not None and handler.keyvalue_path is None:
+        KEY_USAGE.record(resolution.matched)
+        KEY_USAGE.ensure_flushing()
+
+
+def render_key_usage():
+    """
+    Renders the key usage report of REDIRECT_MAP, for the counts of every worker, as JSON.
+    """
+    return json.dumps(key_usage_report(KEY_USAGE.snapshot(), REDIRECT_MAP), indent=2, ensure_ascii=False) + "\n"
+
+
+def record_request_metrics(resolver, host, resolution, started, response_cache, cached):
+    """
+    Records a resolved request. Hosts that aren't served here are counted together so
+    scanners can't grow the number of series.
+    """
+    handler = resolver.host_dispatch.get(host)
+    host_label = host if handler is not None else ""
+
+    METRICS.record_request(host_label, resolution, time.perf_counter() - started)
+    if handler is not None and handler.branch == KEYVALUE and resolution.branch != ASSET:
+        METRICS.record_keyvalue_lookup(host_label, resolution.branch == KEYVALUE)
+    if response_cache.maxsize:
+        METRICS.increment("response_cache_lookups_total", (("result", "hit" if cached else "miss"),))
+    METRICS.ensure_flushing()
+
+
+def render_metrics(response_cache):
+    """
+    Renders the metrics of every worker, and the redirect map and response cache state of
+    this one, in the Prometheus text format.
+    """
+    counters, histograms = METRICS.snapshot()
+    gauges = [
+        ("redirect_map_entries", (), RELOAD_STATS["entries"]),
+        ("redirect_map_reloads", (), RELOAD_STATS["reloads"]),
+        ("redirect_map_reload_failures", (), RELOAD_STATS["failures"]),
+        ("redirect_map_deltas", (), RELOAD_STATS["deltas"]),
+        ("redirect_map_last_reload_duration_seconds", (), RELOAD_STATS["last_duration_seconds"]),
+        ("response_cache_entries", (), len(response_cache)),
+        ("keyvalue_maps_loaded", (), len(KEYVALUE_MAPS)),
+        ("keyvalue_map_loads", (), KEYVALUE_MAPS.loads),
+        ("keyvalue_map_evictions", (), KEYVALUE_MAPS.evictions),
+    ]
+    return render_prometheus(counters, histograms, gauges)
+
+
+def load_config(test_config=None):
+    """
+    Returns the configuration create_app() uses, for entry points that don't build a Flask app.
+    """
+    config = FlaskConfig(os.path.dirname(os.path.abspath(__file__)))
+    config.from_object("config.Config")
+    if test_config is not None:
+        config.update(test_config)
+    return config
+
+
 def create_app(test_config=None):
     app = Flask(__name__, static_folder=None)
 
-    if test_config is None:
-        app.config.from_object("config.Config")
-    else:
-        app.config.update(test_config)
+    app.config.update(load_config(test_config))
 
-    redirect_rules = app.config["REDIRECT_RULES"]
+    KEYVALUE_MAPS.budget = int(app.config["KEYVALUE_MAPS_BUDGET"])
+    resolver = Resolver(app.config)
+    if resolver.flatten:
+        check_redirect_loops(resolver, REDIRECT_MAP)
     force_ssl = app.config["FORCE_SSL"]
-    debug = app.config["DEBUG"]
+    access_log = create_access_log(app.config)
+    app.extensions["access_log"] = access_log
+
+    response_cache = ResponseCache(int(app.config["RESPONSE_CACHE_SIZE"]))
+    app.extensions["response_cache"] = response_cache
+    cache_policy = CachePolicy(app.config)
+
+    redirect_map_watcher = watch_redirect_map(app.config)
+
+    admission = AdmissionControl(app.config, lambda environ: is_priority_request(resolver, environ))
+    rate_limiter = RateLimiter(app.config, lambda environ: predict_branch(resolver, environ))
+    profiler = Profiler(app.config["PROFILE_SAMPLE_RATE"])
+    app.wsgi_app = profiler.wsgi(admission.wsgi(rate_limiter.wsgi(app.wsgi_app)))
+
+    metrics_enabled = app.config["METRICS_ENABLED"]
+    if metrics_enabled:
+        METRICS.configure(app.config["METRICS_DIR"], float(app.config["METRICS_FLUSH_INTERVAL"]))
+    key_usage_enabled = app.config["KEY_USAGE_ENABLED"]
+    if key_usage_enabled:
+        KEY_USAGE.configure(app.config["KEY_USAGE_DIR"], float(app.config["KEY_USAGE_FLUSH_INTERVAL"]))
 
     @app.before_request
+    @profiler.stage("enforce_ssl")
     def enforce_ssl():
         if not force_ssl:
             return None
@@ -92,33 +716,61 @@ def create_app(test_config=None):
     def send_robots_txt():
         response = make_response("User-agent: *\n")
         response.headers["Content-Type"] = "text/plain; charset=utf-8"
+        response.headers.extend(cache_policy.robots_headers)
         return response
 
-    def handle_donate_mozilla_org(path):
+    @app.route("/__reload", methods=["GET", "POST"])
+    def reload_map():
         """
-        Strips language codes from the URL path, redirecting to '/donate/' or its approved subpaths if specified.
+        Reloads the redirect map in the worker serving the request, and touches the export so
+        the watchers of the other workers pick it up too. Only a POST reloads, any other request
+        for the path is redirected like the rest.
         """
-        # Regex pattern to identify language codes (EX: /en-US/, /fr/)
-        language_code_regex = re.compile(r"^[a-z]{2}(-[A-Z]{2}|-[A-Z][a-z])?/?$")
-        # The default donate path
-        donate_path = "/donate/"
-        # Donate subpaths that exist on foundation.mozilla.org
-        donate_subpaths = ["faq", "help", "ways-to-give"]
+        if request.method != "POST":
+            return redirector("__reload")
+
+        authorized = reload_requested(request.headers.get("Authorization"), app.config)
+        if authorized is None:
+            return abort(404)
+        if not authorized:
+            return abort(403)
+
+        path = app.config["REDIRECT_MAP_PATH"]
+        reloaded = reload_redirect_map(path)
+        if reloaded and os.path.exists(path):
+            os.utime(path)
+
+        return jsonify(RELOAD_STATS), 200 if reloaded else 500
+
+    if metrics_enabled:
 
-        if path:
-            # Strip language codes from the path and reconstruct it,
-            path_segments = path.strip("/").split("/")
-            filtered_segments = [segment for segment in path_segments if not language_code_regex.match(segment)]
-            cleaned_path = "/".join(filtered_segments)
+        @app.route("/__metrics")
+        def send_metrics():
+            if not metrics_requested(request.headers.get("Authorization"), app.config):
+                return abort(403)
 
-            if cleaned_path in donate_subpaths:
-                donate_path += cleaned_path
+            response = make_response(render_metrics(response_cache))
+            response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+            return response
 
-        return donate_path
+    if key_usage_enabled:
+
+        @app.route("/__key_usage")
+        def send_key_usage():
+            if not key_usage_requested(request.headers.get("Authorization"), app.config):
+                return abort(403)
+
+            response = make_response(render_key_usage())
+            response.headers["Content-Type"] = "application/json"
+            return response
 
     @app.route("/", defaults={"path": ""})
     @app.route("/<path:path>")
     def redirector(path):
+        started = time.perf_counter()
+        redirect_map_watcher.ensure_running()
+        redirect_map = REDIRECT_MAP
+
         x_forwarded_host = request.headers.get("X-Forwarded-Host", None)
 
         if x_forwarded_host:
@@ -126,62 +778,43 @@ def create_app(test_config=None):
         else:
             host = request.headers.get("Host", None)
 
-        if debug:
-            print("received request from {}".format(host))
+        host = normalize_host(host)
+        query_string = request.query_string.decode("utf-8")
+        cache_key = (host, path, query_string)
 
-        # Special handling for donate.mozilla.org requests
-        if "donate.mozilla.org" in host:
-            path = handle_donate_mozilla_org(path)
-
-        # Prevent redirect for resources such as JS, CSS and images and return HTTP 410 Gone
-        if path.endswith((".js", ".css", ".png", ".svg", ".ico", ".txt")):
-            return abort(410)
-
-        # Use key/value redirects to short-circuit foundation.mozilla.org's redirect rule only
-        # Note foundation.mozilla.org for testing until domain switch is live.
-        if "foundation.mozilla.org" in host:
-            keyvalue_response = get_keyvalue_redirect(path, request.query_string.decode("utf-8"), REDIRECT_MAP, debug)
-            if keyvalue_response:
-                return keyvalue_response
-
-        if host in redirect_rules:
-            redirect_target, redirect_code, preserves = redirect_rules[host]
-            preserve_path, preserve_query = preserves
-
-            redirect_path = ""
-            redirect_query = ""
-
-            target_url = urlparse(redirect_target)
-
-            if preserve_path:
-                redirect_path = path
-            else:
-                redirect_path = target_url.path
-
-            if preserve_query:
-                redirect_query = urlencode(request.args, doseq=True)
-            else:
-                redirect_query = target_url.query
-
-            redirect_parse = ParseResult(
-                scheme=target_url.scheme,
-                netloc=target_url.netloc,
-                path=redirect_path,
-                query=redirect_query,
-                params="",
-                fragment="",
-            )
-
-            final_redirect = urlunparse(redirect_parse)
-
-            if debug:
-                print("redirecting to {} with a {}".format(final_redirect, redirect_code.value))
-
-            return redirect(final_redirect, code=redirect_code.value)
-
-        return abort(400)
+        rendered = response_cache.get(cache_key, redirect_map)
+        cached = rendered is not None
+        if cached:
+            resolution = rendered.resolution
+        else:
+            resolution = resolver.resolve(host, path, query_string, redirect_map, profiler.current())
+            if resolution.location is not None:
+                rendered = render_redirect(resolution.location, resolution.status, resolution)
+                response_cache.put(cache_key, rendered, redirect_map)
+
+        if metrics_enabled:
+            record_request_metrics(resolver, host, resolution, started, response_cache, cached)
+        if key_usage_enabled and resolution.branch == KEYVALUE:
+            record_key_usage(resolver, host, resolution)
+        if access_log is not None:
+            access_log.log(host, path, query_string, resolution, started, cached)
+
+        if resolution.status == 400:
+            return Response(BAD_REQUEST_BODY, status=400, mimetype="text/html")
+        if resolution.status == 410:
+            response = Gone().get_response()
+            response.headers.extend(cache_policy.headers(410, host))
+            return response
+
+        headers = [("ETag", rendered.etag), *cache_policy.headers(rendered.status, host)]
+        if etag_matches(request.headers.get("If-None-Match"), rendered.etag):
+            return Response(status=304, headers=headers)
+
+        headers.append(("Location", rendered.location))
+        return Response(rendered.body, status=rendered.status, headers=headers, mimetype="text/html")
 
     @app.after_request
+    @profiler.stage("response_headers")
     def response_headers(response):
         response.headers["Server"] = "MoFo Redirector"
         return response
@@ -190,4 +823,5 @@ def create_app(test_config=None):
 
 
 if __name__ == "__main__":
+    start_stack_sampler(load_config())
     create_app().run()
@@ -0,0 +1,130 @@
+"""
+ASGI entry point, for event loop servers:
+
+    uvicorn --factory asgi:create_asgi_app
+    hypercorn "asgi:create_asgi_app()"
+    gunicorn -k uvicorn.workers.UvicornWorker -c gunicorn_config.py "asgi:create_asgi_app()"
+"""
+
+import asyncio
+import functools
+import io
+import sys
+
+import app
+from admission import AdmissionControl
+from fast_app import FastApp
+
+# Requests that touch the disk run in a thread so they don't block the event loop
+BLOCKING_PATHS = ("/__reload", "/__metrics", "/__key_usage")
+
+
+def build_environ(scope):
+    """
+    Returns the WSGI environ for an ASGI HTTP scope, without a request body.
+    """
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin1"),
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+
+    for name, value in scope["headers"]:
+        name = name.decode("latin1").upper().replace("-", "_")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = "HTTP_" + name
+        value = value.decode("latin1")
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+
+    return environ
+
+
+class AsgiApp:
+    """
+    Serves FastApp over ASGI, so its answers are exactly those of create_app().
+
+    Resolving a redirect never waits on anything, so requests are answered directly on the
+    event loop; only the endpoints that read files are handed to a thread.
+
+    Admission control counts a request as in flight from when it reaches the app until its
+    response is sent, rather than only while FastApp resolves it, so ADMISSION_MAX_IN_FLIGHT
+    bounds the requests the event loop holds, waiting on a thread or on a slow client.
+    """
+
+    def __init__(self, config):
+        self.fast_app = FastApp(config, admission=False)
+        resolver = self.fast_app.resolver
+        self.admission = AdmissionControl(config, lambda environ: app.is_priority_request(resolver, environ))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] != "http":
+            raise ValueError(f"unsupported ASGI scope type {scope['type']!r}")
+
+        environ = build_environ(scope)
+        admission = self.admission
+        if not admission.enabled:
+            return await self.serve(scope, environ, send)
+
+        priority = admission.is_priority(environ)
+        reason = admission.admit(environ, priority)
+        if reason is not None:
+            shed = functools.partial(admission.shed, priority=priority, reason=reason)
+            return await self.send_response(send, *self.respond(environ, shed))
+
+        try:
+            await self.serve(scope, environ, send)
+        finally:
+            admission.release()
+
+    async def serve(self, scope, environ, send):
+        if scope["path"] in BLOCKING_PATHS:
+            response = await asyncio.get_running_loop().run_in_executor(None, self.respond, environ)
+        else:
+            response = self.respond(environ)
+        await self.send_response(send, *response)
+
+    async def send_response(self, send, status, headers, body):
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    def respond(self, environ, application=None):
+        response = []
+
+        def start_response(status, headers, exc_info=None):
+            response.append(int(status.split(" ", 1)[0]))
+            response.append([(name.lower().encode("latin1"), value.encode("latin1")) for name, value in headers])
+
+        body = b"".join((application or self.fast_app)(environ, start_response))
+        return response[0], response[1], body
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+def create_asgi_app(test_config=None):
+    """
+    Builds the AsgiApp for the same configuration create_app() would use.
+    """
+    return AsgiApp(app.load_config(test_config))
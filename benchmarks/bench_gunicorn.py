@@ -0,0 +1,124 @@
+"""
+Boots gunicorn locally and drives it with a multi-process HTTP load generator replaying a
+router log or a synthetic request mix, reporting end-to-end latency and throughput.
+
+    python benchmarks/bench_gunicorn.py [--workers 4] [--clients 8] [--duration 10]
+        [--app "app:create_app()"] [--config gunicorn_config.py] [--log router.log] [--output results.json]
+"""
+
+import argparse
+import http.client
+import multiprocessing
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+from common import ROOT, free_port, load_requests, summarize, write_results
+
+
+def wait_until_serving(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/robots.txt", timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("gunicorn didn't start in time")
+
+
+def client(port, requests, offset, deadline, results):
+    """
+    Sends requests one after another until the deadline, on a new connection each time
+    like the Heroku router does, and reports the latency of each one.
+    """
+    samples = []
+    errors = 0
+    index = offset
+    while time.time() < deadline:
+        method, host, path, query_string = requests[index % len(requests)]
+        index += 1
+        target = f"{path}?{query_string}" if query_string else path
+
+        started = time.perf_counter()
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            connection.request(method, target, headers={"Host": host})
+            connection.getresponse().read()
+            connection.close()
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            continue
+        samples.append(time.perf_counter() - started)
+
+    results.put((samples, errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--app", default="app:create_app()")
+    parser.add_argument("--config", help="gunicorn config module, e.g. gunicorn_config.py")
+    parser.add_argument("--log", help="Heroku router log to replay, a synthetic mix is generated otherwise")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    requests = load_requests(args.log)
+    port = free_port()
+    command = [sys.executable, "-m", "gunicorn", "--workers", str(args.workers), "--bind", f"127.0.0.1:{port}"]
+    if args.config:
+        command += ["--config", args.config]
+    command.append(args.app)
+
+    server = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_serving(port)
+
+        results = multiprocessing.Queue()
+        started = time.time()
+        deadline = started + args.duration
+        clients = [
+            multiprocessing.Process(
+                target=client, args=(port, requests, index * len(requests) // args.clients, deadline, results)
+            )
+            for index in range(args.clients)
+        ]
+        for process in clients:
+            process.start()
+
+        samples, errors = [], 0
+        for _ in clients:
+            client_samples, client_errors = results.get()
+            samples += client_samples
+            errors += client_errors
+        for process in clients:
+            process.join()
+        elapsed = time.time() - started
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+    write_results(
+        "gunicorn",
+        [
+            summarize(
+                "gunicorn",
+                samples,
+                elapsed,
+                errors=errors,
+                workers=args.workers,
+                clients=args.clients,
+                app=args.app,
+                config=args.config,
+            )
+        ],
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Compare the plain dict redirect map against the LocaleIndex.
+
+Reports the memory held by each structure, by the LocaleIndex once every entry has been
+looked up too, the raw lookup latency for the first hit of a key (when the LocaleIndex builds
+its entry), later hits and misses, and the latency of lookup_keyvalue_redirect() when backed
+by each of them, and by a canonical LocaleIndex as load_redirect_map() builds it.
+
+    python benchmarks/bench_kv_index.py
+"""
+
+import json
+import os
+import random
+import sys
+import time
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app import lookup_keyvalue_redirect  # noqa: E402
+from redirect_map import LocaleIndex  # noqa: E402
+
+EXPORT = os.path.join(os.path.dirname(__file__), "..", "foundation.mozilla.org_wagtail_redirects.json")
+
+
+def measure(build):
+    tracemalloc.start()
+    structure = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return structure, size
+
+
+def look_up_every_entry(index):
+    for key in index:
+        index.get(key)
+    return index
+
+
+def time_first_lookups(build, keys, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        lookup = build().get
+        started = time.perf_counter()
+        for key in keys:
+            lookup(key)
+        timings.append(time.perf_counter() - started)
+    return min(timings) / len(keys)
+
+
+def time_lookups(structure, keys, number=20):
+    lookup = structure.get
+    timer = timeit.Timer(lambda: [lookup(key) for key in keys])
+    return min(timer.repeat(repeat=5, number=number)) / (number * len(keys))
+
+
+def time_redirects(structure, keys, number=5):
+    paths = [key[1:] for key in keys]
+    timer = timeit.Timer(lambda: [lookup_keyvalue_redirect(path, "", structure) for path in paths])
+    return min(timer.repeat(repeat=5, number=number)) / (number * len(keys))
+
+
+def main():
+    with open(EXPORT) as f:
+        raw = f.read()
+
+    plain, plain_size = measure(lambda: json.loads(raw))
+    index, index_size = measure(lambda: LocaleIndex(json.loads(raw)))
+    _, built_size = measure(lambda: look_up_every_entry(LocaleIndex(json.loads(raw))))
+    canonical_index = LocaleIndex(json.loads(raw), canonical=True)
+
+    random.seed(0)
+    hits = random.sample(list(plain), 2000)
+    misses = [key + "-missing" for key in hits]
+
+    print(f"entries: {len(plain)}")
+    print(
+        f"memory: dict {plain_size / 1024:.0f} KiB, LocaleIndex {index_size / 1024:.0f} KiB, "
+        f"{built_size / 1024:.0f} KiB with every entry looked up"
+    )
+    print(
+        f"first hit: dict {time_first_lookups(lambda: json.loads(raw), hits) * 1e9:.0f} ns, "
+        f"LocaleIndex {time_first_lookups(lambda: LocaleIndex(json.loads(raw)), hits) * 1e9:.0f} ns"
+    )
+    for label, keys in (("hit", hits), ("miss", misses)):
+        print(
+            f"{label}: dict {time_lookups(plain, keys) * 1e9:.0f} ns, "
+            f"LocaleIndex {time_lookups(index, keys) * 1e9:.0f} ns"
+        )
+        print(
+            f"lookup_keyvalue_redirect {label}: dict {time_redirects(plain, keys) * 1e6:.2f} us, "
+            f"LocaleIndex {time_redirects(index, keys) * 1e6:.2f} us, "
+            f"canonical LocaleIndex {time_redirects(canonical_index, keys) * 1e6:.2f} us"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Microbenchmarks for the redirector hot path: key/value lookups, alone and resolved as a
+request, donate path handling and the host-rule branch.
+
+    python benchmarks/bench_micro.py [--output results.json]
+"""
+
+import argparse
+import random
+import time
+
+from common import EXPORT, summarize, write_results
+
+from app import (
+    Resolver,
+    build_redirect_map,
+    handle_donate_mozilla_org,
+    load_config,
+    lookup_keyvalue_redirect,
+    resolve_redirect,
+)
+from config import Config
+
+
+def time_each(operation, inputs, repeat):
+    """
+    Times operation on every input, repeat times, and returns the per-call latencies.
+    """
+    clock = time.perf_counter
+    samples = []
+    for _ in range(repeat):
+        for value in inputs:
+            started = clock()
+            operation(value)
+            samples.append(clock() - started)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    # Built like load_redirect_map() does: canonical, or memory-mapped when compiled
+    redirect_map = build_redirect_map(EXPORT)
+
+    rng = random.Random(0)
+    hits = [key[1:] for key in rng.sample(list(redirect_map), 1000)]
+    misses = [f"en/not-a-redirect-{index}/" for index in range(1000)]
+    donate_paths = ["", "en-US/help", "fr/unapproved-path", "en-US/es-MX/faq", "ways-to-give/", "custom-en-section"]
+
+    resolver = Resolver(load_config({"REDIRECT_RULES": Config.REDIRECT_RULES}))
+    rule_handlers = [resolver.host_dispatch[host] for host in Config.REDIRECT_RULES]
+    rule_requests = [
+        (handler, f"legacy/path-{index}", "utm_source=a&b=c") for index, handler in enumerate(rule_handlers)
+    ]
+
+    keyvalue_host = Config.KEYVALUE_HOSTS[0]
+
+    def resolve_keyvalue(path):
+        return resolver.resolve(keyvalue_host, path, "", redirect_map)
+
+    results = [
+        summarize(
+            "lookup_keyvalue_redirect_hit",
+            time_each(lambda path: lookup_keyvalue_redirect(path, "", redirect_map), hits, args.repeat),
+        ),
+        summarize(
+            "lookup_keyvalue_redirect_miss",
+            time_each(lambda path: lookup_keyvalue_redirect(path, "", redirect_map), misses, args.repeat),
+        ),
+        summarize("resolve_keyvalue_hit", time_each(resolve_keyvalue, hits, args.repeat)),
+        summarize("resolve_keyvalue_miss", time_each(resolve_keyvalue, misses, args.repeat)),
+        summarize("handle_donate_mozilla_org", time_each(handle_donate_mozilla_org, donate_paths * 100, args.repeat)),
+        summarize(
+            "host_rule_branch",
+            time_each(lambda request: resolve_redirect(*request, redirect_map), rule_requests * 20, args.repeat),
+        ),
+    ]
+
+    write_results("micro", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
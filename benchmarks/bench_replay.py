@@ -0,0 +1,59 @@
+"""
+Replays a Heroku router log, or a synthetic request mix shaped like production traffic,
+against the WSGI app in-process and reports per-request latency and throughput.
+
+    python benchmarks/bench_replay.py [--log router.log] [--app flask|fast] [--output results.json]
+"""
+
+import argparse
+import time
+from collections import Counter
+
+from common import load_requests, summarize, write_results
+from werkzeug.test import EnvironBuilder
+
+from app import create_app
+from fast_app import create_fast_app
+
+APPS = {"flask": create_app, "fast": create_fast_app}
+
+
+def replay(wsgi_app, environs):
+    statuses = Counter()
+
+    def start_response(status, headers):
+        statuses[status.split(" ", 1)[0]] += 1
+
+    clock = time.perf_counter
+    samples = []
+    started = clock()
+    for environ in environs:
+        request_started = clock()
+        b"".join(wsgi_app(dict(environ), start_response))
+        samples.append(clock() - request_started)
+    return samples, clock() - started, dict(statuses)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log", help="Heroku router log to replay, a synthetic mix is generated otherwise")
+    parser.add_argument("--requests", type=int, default=20000, help="size of the synthetic mix")
+    parser.add_argument("--app", choices=sorted(APPS), action="append", help="defaults to both")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    environs = [
+        EnvironBuilder(method=method, path=path, query_string=query_string, headers=[("Host", host)]).get_environ()
+        for method, host, path, query_string in load_requests(args.log, args.requests)
+    ]
+
+    results = []
+    for name in args.app or sorted(APPS):
+        samples, elapsed, statuses = replay(APPS[name](), environs)
+        results.append(summarize(f"replay_{name}", samples, elapsed, statuses=statuses))
+
+    write_results("replay", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Helpers shared by the benchmarks: timing summaries, machine-readable results and request
+mixes replayed from Heroku router logs or generated from the real redirect export.
+"""
+
+import json
+import os
+import platform
+import random
+import re
+import shlex
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+EXPORT = os.path.join(ROOT, "foundation.mozilla.org_wagtail_redirects.json")
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# at=info method=GET path="/fr/about/" host=foundation.mozilla.org request_id=... status=301 ...
+ROUTER_LOG_FIELD = re.compile(r'(\w+)=("[^"]*"|\S+)')
+
+
+def percentile(sorted_samples, fraction):
+    if not sorted_samples:
+        return None
+    index = min(len(sorted_samples) - 1, int(round(fraction * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+def summarize(name, samples, elapsed=None, **extra):
+    """
+    Summarizes per-operation latencies in seconds. Throughput is computed from the wall
+    clock time the run took when given, otherwise from the sum of the samples.
+    """
+    samples = sorted(samples)
+    total = elapsed if elapsed is not None else sum(samples)
+    return {
+        "name": name,
+        "operations": len(samples),
+        "p50_us": round(percentile(samples, 0.50) * 1e6, 3),
+        "p99_us": round(percentile(samples, 0.99) * 1e6, 3),
+        "rps": round(len(samples) / total, 1) if total else None,
+        **extra,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(benchmark, results, output=None):
+    """
+    Writes a benchmark run as JSON to output, or stdout, so runs can be compared over time.
+    """
+    document = {
+        "benchmark": benchmark,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "command": " ".join(shlex.quote(arg) for arg in sys.argv),
+        "results": results,
+    }
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(document, f, indent=2)
+    else:
+        json.dump(document, sys.stdout, indent=2)
+        print()
+
+
+def parse_router_log(lines):
+    """
+    Yields (method, host, path, query string) for each Heroku router log line.
+    """
+    for line in lines:
+        fields = {key: value.strip('"') for key, value in ROUTER_LOG_FIELD.findall(line)}
+        if "path" not in fields or "host" not in fields:
+            continue
+
+        path, _, query_string = fields["path"].partition("?")
+        yield fields.get("method", "GET"), fields["host"], path, query_string
+
+
+def synthetic_requests(count, seed=0):
+    """
+    Generates a request mix shaped like production traffic: a few hundred hot legacy URLs
+    taking most hits, a long tail of the export and the host rules, and scanner junk.
+    """
+    from config import Config
+
+    with open(EXPORT) as f:
+        keys = list(json.load(f))
+
+    rng = random.Random(seed)
+    hot_keys = rng.sample(keys, 300)
+    rule_hosts = list(Config.REDIRECT_RULES)
+    junk_paths = ["/wp-admin/", "/wp-login.php", "/.env", "/static/app.js", "/favicon.ico"]
+
+    requests = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.45:
+            requests.append(("GET", "foundation.mozilla.org", hot_keys[int(rng.paretovariate(1.2)) % 300], ""))
+        elif roll < 0.55:
+            requests.append(("GET", "foundation.mozilla.org", rng.choice(keys), ""))
+        elif roll < 0.65:
+            requests.append(("GET", "foundation.mozilla.org", f"/en/page-{rng.randrange(10000)}/", "utm_source=x"))
+        elif roll < 0.85:
+            requests.append(("GET", rng.choice(rule_hosts), f"/some/legacy/path-{rng.randrange(50)}", ""))
+        elif roll < 0.95:
+            requests.append(("GET", rng.choice(rule_hosts), rng.choice(junk_paths), ""))
+        else:
+            requests.append(("GET", f"scanner-{rng.randrange(1000)}.example", rng.choice(junk_paths), ""))
+    return requests
+
+
+def load_requests(log_path=None, count=20000):
+    if log_path:
+        with open(log_path) as f:
+            return list(parse_router_log(f))
+    return synthetic_requests(count)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
@@ -0,0 +1,28 @@
+"""
+Compares two benchmark result files written by the benchmarks in this directory.
+
+    python benchmarks/compare.py before.json after.json
+"""
+
+import json
+import sys
+
+
+def main(argv):
+    with open(argv[1]) as f:
+        before = {result["name"]: result for result in json.load(f)["results"]}
+    with open(argv[2]) as f:
+        after = {result["name"]: result for result in json.load(f)["results"]}
+
+    print(f"{'benchmark':<32} {'p50 us':>21} {'p99 us':>21} {'rps':>23}")
+    for name in sorted(before.keys() & after.keys()):
+        columns = []
+        for metric in ("p50_us", "p99_us", "rps"):
+            old, new = before[name][metric], after[name][metric]
+            change = (new - old) / old * 100 if old else 0
+            columns.append(f"{old:>8} -> {new:<8} {change:+6.1f}%")
+        print(f"{name:<32} " + " ".join(columns))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
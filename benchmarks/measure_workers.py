@@ -0,0 +1,96 @@
+"""
+Boot gunicorn and report its boot time and the proportional set size (PSS) of the master and
+of each worker, read from /proc/<pid>/smaps_rollup (Linux only).
+
+    python benchmarks/measure_workers.py --workers 4
+    python benchmarks/measure_workers.py --workers 4 --config gunicorn_config.py
+
+Without --config the workers load the app themselves, as with the Procfile today. PSS splits
+shared pages between the processes sharing them, so it shows how much each worker really costs.
+"""
+
+import argparse
+import http.client
+import json
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+from common import ROOT, free_port
+
+
+def children(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def pss_kib(pid):
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Pss:"):
+                return int(line.split()[1])
+    return None
+
+
+def wait_until_serving(port, workers, master, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/robots.txt", timeout=1)
+            if len(children(master)) >= workers:
+                return
+        except OSError:
+            pass
+        time.sleep(0.05)
+    raise RuntimeError("gunicorn didn't start in time")
+
+
+def measure(workers, config, app):
+    port = free_port()
+    command = [sys.executable, "-m", "gunicorn", "--workers", str(workers), "--bind", f"127.0.0.1:{port}"]
+    if config:
+        command += ["--config", config]
+    command.append(app)
+
+    started = time.monotonic()
+    master = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_serving(port, workers, master.pid)
+        boot_time = time.monotonic() - started
+
+        # Let the workers serve some key/value lookups so the pages they touch show up
+        for _ in range(workers * 25):
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/fr/about/", headers={"Host": "foundation.mozilla.org"})
+            connection.getresponse().read()
+            connection.close()
+
+        worker_pss = [pss_kib(pid) for pid in children(master.pid)]
+        return {
+            "workers": workers,
+            "config": config,
+            "app": app,
+            "boot_time_s": round(boot_time, 3),
+            "master_pss_kib": pss_kib(master.pid),
+            "worker_pss_kib": worker_pss,
+            "total_pss_kib": pss_kib(master.pid) + sum(worker_pss),
+        }
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--config", help="gunicorn config module, e.g. gunicorn_config.py")
+    parser.add_argument("--app", default="app:create_app()")
+    args = parser.parse_args()
+
+    print(json.dumps(measure(args.workers, args.config, args.app), indent=2))
+
+
+if __name__ == "__main__":
+    main()
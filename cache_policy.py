@@ -0,0 +1,69 @@
+import hashlib
+
+from rules import normalize_host
+
+PERMANENT_STATUSES = (301, 308)
+TEMPORARY_STATUSES = (302, 303, 307)
+
+
+def redirect_etag(status, location):
+    """
+    Returns the strong ETag of a redirect, which only changes when its status or location does.
+    """
+    digest = hashlib.blake2b(f"{status} {location}".encode("utf-8"), digest_size=8).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Whether an If-None-Match header matches an ETag, with the weak comparison RFC 9110 asks for.
+    """
+    if not if_none_match or etag is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+class CachePolicy:
+    """
+    The caching headers of the responses browsers and CDNs may reuse: redirects, the 410s for
+    assets and /robots.txt.
+
+    The headers are built once for each status and each host in CACHE_HOST_MAX_AGES, so a
+    response only pays for a dict lookup. A max-age of 0 sends no-cache, a negative one no
+    Cache-Control header at all.
+    """
+
+    def __init__(self, config):
+        self.vary = config["CACHE_VARY"]
+
+        max_ages = {status: int(config["CACHE_PERMANENT_MAX_AGE"]) for status in PERMANENT_STATUSES}
+        max_ages.update({status: int(config["CACHE_TEMPORARY_MAX_AGE"]) for status in TEMPORARY_STATUSES})
+        max_ages[410] = int(config["CACHE_GONE_MAX_AGE"])
+
+        self.status_headers = {status: self.build(max_age) for status, max_age in max_ages.items()}
+        self.host_headers = {
+            normalize_host(host): self.build(int(max_age)) for host, max_age in config["CACHE_HOST_MAX_AGES"].items()
+        }
+        # robots.txt is the same for every host
+        self.robots_headers = self.build(int(config["CACHE_ROBOTS_MAX_AGE"]), vary=False)
+
+    def build(self, max_age, vary=True):
+        headers = []
+        if max_age > 0:
+            headers.append(("Cache-Control", f"public, max-age={max_age}"))
+        elif max_age == 0:
+            headers.append(("Cache-Control", "no-cache"))
+        if vary and self.vary:
+            headers.append(("Vary", self.vary))
+        return tuple(headers)
+
+    def headers(self, status, host):
+        """
+        Returns the caching headers of a response with a status for a normalized host.
+        """
+        headers = self.host_headers.get(host)
+        if headers is None:
+            return self.status_headers.get(status, ())
+        return headers
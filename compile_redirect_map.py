@@ -0,0 +1,27 @@
+"""
+Compiles a Wagtail redirect export into the memory-mapped format load_redirect_map() prefers.
+
+    python compile_redirect_map.py [foundation.mozilla.org_wagtail_redirects.json] [output.bin]
+"""
+
+import json
+import sys
+
+from redirect_map import compile_redirect_map, compiled_path_for
+
+DEFAULT_EXPORT = "foundation.mozilla.org_wagtail_redirects.json"
+
+
+def main(argv):
+    export_path = argv[1] if len(argv) > 1 else DEFAULT_EXPORT
+    compiled_path = argv[2] if len(argv) > 2 else compiled_path_for(export_path)
+
+    with open(export_path) as f:
+        entries = json.load(f)
+
+    compile_redirect_map(entries, compiled_path)
+    print(f"compiled {len(entries)} redirects from {export_path} into {compiled_path}")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
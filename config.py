@@ -37,6 +37,107 @@ class Config(object):
     DEBUG = env_var('DEBUG', default=False)
     FORCE_SSL = env_var('FORCE_SSL', default=False)
 
+    # Wagtail redirect export for the key/value redirect map
+    REDIRECT_MAP_PATH = env_var('REDIRECT_MAP_PATH', default='foundation.mozilla.org_wagtail_redirects.json')
+    # Seconds between checks for a changed export, 0 disables hot reloading
+    REDIRECT_MAP_POLL_INTERVAL = float(env_var('REDIRECT_MAP_POLL_INTERVAL', default=0))
+    # Bearer token for POST /__reload, the endpoint is disabled when unset
+    ADMIN_TOKEN = env_var('ADMIN_TOKEN', default=None)
+
+    # Per-worker admission control: a request gets a 503 with Retry-After (seconds) when the worker already has
+    # ADMISSION_MAX_IN_FLIGHT requests in progress, or when it waited more than ADMISSION_MAX_QUEUE_TIME seconds
+    # since the router's X-Request-Start header (0 disables either check). Requests for hosts that aren't served
+    # here and for assets only get ADMISSION_LOW_PRIORITY_SHARE of either limit
+    ADMISSION_MAX_IN_FLIGHT = int(env_var('ADMISSION_MAX_IN_FLIGHT', default=0))
+    ADMISSION_MAX_QUEUE_TIME = float(env_var('ADMISSION_MAX_QUEUE_TIME', default=0))
+    ADMISSION_LOW_PRIORITY_SHARE = float(env_var('ADMISSION_LOW_PRIORITY_SHARE', default=0.5))
+    ADMISSION_RETRY_AFTER = int(env_var('ADMISSION_RETRY_AFTER', default=5))
+
+    # Per-client rate limits: the requests a client may make in a sliding window of RATE_LIMIT_WINDOW seconds before
+    # it gets a 429, budgeted by what they will get: a redirect, the 410 of an asset or the 400 of a host that isn't
+    # served here (0 is no limit). robots.txt isn't budgeted, crawlers refused it may treat the site as disallowed, but
+    # can be given a 'robots' budget. Clients are told apart by the X-Forwarded-For entry of the outermost of the
+    # RATE_LIMIT_TRUSTED_PROXIES in front of the app (Heroku's router is one), or their address when there are none
+    RATE_LIMIT_ENABLED = env_var('RATE_LIMIT_ENABLED', default=False)
+    RATE_LIMIT_WINDOW = float(env_var('RATE_LIMIT_WINDOW', default=60))
+    RATE_LIMIT_BUDGETS = {'redirect': 600, 'asset': 30, 'unmatched': 30}
+    RATE_LIMIT_TRUSTED_PROXIES = int(env_var('RATE_LIMIT_TRUSTED_PROXIES', default=1))
+    # Clients and budgets each worker keeps counts for, the least recently seen are forgotten first
+    RATE_LIMIT_MAX_KEYS = int(env_var('RATE_LIMIT_MAX_KEYS', default=10000))
+    # Redis server, or rate_limit_backend.py, where the workers add up their counts every RATE_LIMIT_SYNC_INTERVAL
+    # seconds (redis://host:port); each worker counts on its own when unset
+    RATE_LIMIT_BACKEND = env_var('RATE_LIMIT_BACKEND', default=None)
+    RATE_LIMIT_SYNC_INTERVAL = float(env_var('RATE_LIMIT_SYNC_INTERVAL', default=1))
+
+    # Number of rendered redirects each worker keeps for repeated requests, 0 disables the cache
+    RESPONSE_CACHE_SIZE = int(env_var('RESPONSE_CACHE_SIZE', default=1024))
+
+    # Cache-Control max-age, in seconds, of permanent (301/308) and temporary (302/307) redirects, of the 410s
+    # for assets and of /robots.txt, so browsers and CDNs answer repeated requests: 0 sends no-cache and a
+    # negative value leaves the header out
+    CACHE_PERMANENT_MAX_AGE = int(env_var('CACHE_PERMANENT_MAX_AGE', default=86400))
+    CACHE_TEMPORARY_MAX_AGE = int(env_var('CACHE_TEMPORARY_MAX_AGE', default=300))
+    CACHE_GONE_MAX_AGE = int(env_var('CACHE_GONE_MAX_AGE', default=86400))
+    CACHE_ROBOTS_MAX_AGE = int(env_var('CACHE_ROBOTS_MAX_AGE', default=86400))
+    # Max-age of every response for particular hosts, overriding the above: the key is the host header to match
+    CACHE_HOST_MAX_AGES = {}
+    # Vary header of redirects and 410s, which depend on the host they were requested for
+    CACHE_VARY = env_var('CACHE_VARY', default='Host, X-Forwarded-Host')
+
+    # Serve request counters and latency histograms at GET /__metrics, behind ADMIN_TOKEN when it is set
+    METRICS_ENABLED = env_var('METRICS_ENABLED', default=False)
+    # Directory where each gunicorn worker writes its metrics so any worker can report the totals
+    METRICS_DIR = env_var('METRICS_DIR', default=None)
+    METRICS_FLUSH_INTERVAL = float(env_var('METRICS_FLUSH_INTERVAL', default=10))
+
+    # Count the hits on each key/value redirect in a fixed-size sketch, reported at GET /__key_usage (behind
+    # ADMIN_TOKEN when it is set) and by key_usage_report.py
+    KEY_USAGE_ENABLED = env_var('KEY_USAGE_ENABLED', default=False)
+    # Directory where each gunicorn worker writes its counts so any worker can report the totals
+    KEY_USAGE_DIR = env_var('KEY_USAGE_DIR', default=None)
+    KEY_USAGE_FLUSH_INTERVAL = float(env_var('KEY_USAGE_FLUSH_INTERVAL', default=60))
+
+    # JSON lines redirect log, a file path or - for stdout; DEBUG logs to stdout when unset
+    ACCESS_LOG = env_var('ACCESS_LOG', default=None)
+    # Fraction of requests logged, and how many records can wait for the log writer before new ones are dropped
+    ACCESS_LOG_SAMPLE_RATE = float(env_var('ACCESS_LOG_SAMPLE_RATE', default=1))
+    ACCESS_LOG_QUEUE_SIZE = int(env_var('ACCESS_LOG_QUEUE_SIZE', default=10000))
+
+    # Fraction of requests whose stages are timed into the stage_duration_seconds metric, 0 disables profiling
+    PROFILE_SAMPLE_RATE = float(env_var('PROFILE_SAMPLE_RATE', default=0))
+    # Where each worker writes flamegraph stack samples (as <file>.<pid>) under gunicorn_config.py
+    PROFILE_STACKS_FILE = env_var('PROFILE_STACKS_FILE', default=None)
+    PROFILE_STACK_INTERVAL = float(env_var('PROFILE_STACK_INTERVAL', default=0.01))
+    PROFILE_FLUSH_INTERVAL = float(env_var('PROFILE_FLUSH_INTERVAL', default=10))
+
+    # Collapse redirects that lead to another host served here into a single hop
+    FLATTEN_REDIRECTS = env_var('FLATTEN_REDIRECTS', default=False)
+    MAX_REDIRECT_HOPS = int(env_var('MAX_REDIRECT_HOPS', default=5))
+
+    # Hosts whose paths are looked up in the key/value redirect map before their redirect rule
+    KEYVALUE_HOSTS = ('foundation.mozilla.org',)
+
+    # Hosts with their own key/value redirect map: the key is the host header to match, the value the
+    # path of its Wagtail-style export. Each map is loaded on its host's first request, or up front when
+    # preloading with gunicorn_config.py, and reloaded along with REDIRECT_MAP_PATH.
+    KEYVALUE_MAPS = {}
+    # Bytes of exports the KEYVALUE_MAPS in memory may add up to before the least recently used are
+    # dropped, 0 keeps them all
+    KEYVALUE_MAPS_BUDGET = int(env_var('KEYVALUE_MAPS_BUDGET', default=0))
+
+    # Hosts whose paths are stripped of language codes and mapped onto /donate/ before their redirect rule
+    DONATE_HOSTS = ('donate.mozilla.org',)
+
+    # Pattern rules, tried after the key/value redirects and before the host's redirect rule
+    # The key is the host header to match, its value maps path patterns to their redirect:
+    # At [0]: the redirect target, where {name} and * are replaced with what they matched
+    # At [1]: the HTTP status code to return - use the ReturnCodes enum
+    # At [2]: whether the query is to be preserved
+    # In a pattern, {name} matches one path segment and * any single segment, or the rest of the path
+    # at its end: '/{locale}/campaigns/*' matches /en/campaigns, /en/campaigns/ and /en/campaigns/a/b.
+    # Patterns starting with re: are regular expressions matching the whole path, use named groups.
+    PATTERN_RULES = {}
+
     # Redirect Rules
     # The key is the host header to match
     # At [0]: the redirect target, without trailing slash, prefixed by https
@@ -0,0 +1,44 @@
+"""
+Writes the delta between two Wagtail redirect exports, for a running redirector to apply in
+place instead of reloading the whole map.
+
+    python diff_redirect_exports.py old.json new.json [--output old.delta.json]
+
+The delta lists the canonical keys to set and remove, and the checksums of both exports. It
+is written next to the old export by default, where the redirector watches for it: it is
+only applied to a map with the old checksum, and only if the result has the new one.
+"""
+
+import argparse
+import json
+import sys
+
+from redirect_map import delta_path_for, diff_redirect_maps
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("old", help="the export the redirector has loaded")
+    parser.add_argument("new", help="the export to bring it up to date with")
+    parser.add_argument("--output", help="where to write the delta, next to the old export by default")
+    args = parser.parse_args(argv)
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    delta = diff_redirect_maps(old, new)
+    output = args.output or delta_path_for(args.old)
+    with open(output, "w") as f:
+        json.dump(delta, f, indent=2, ensure_ascii=False)
+
+    print(
+        f"wrote {len(delta['set'])} set and {len(delta['remove'])} removed redirects to {output}"
+        f" ({delta['base']} -> {delta['checksum']})"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
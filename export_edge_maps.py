@@ -0,0 +1,635 @@
+"""
+Exports the redirects this app serves as maps a proxy or CDN can answer from, so the static
+majority of requests never reach the redirector, and checks the exports don't lose or change any
+of its redirects.
+
+    python export_edge_maps.py [output directory] [--format nginx|haproxy|cdn] [--verify-readback]
+
+Formats, all written by default:
+
+    nginx      mofo_redirects.maps.conf for the http block, mofo_redirects.server.conf for the server block
+    haproxy    mofo_hosts.map, mofo_routes.map (a map_reg file) and mofo_keyvalue.map
+    cdn        mofo_redirects.edge.json, for an edge worker or key/value store
+
+Requests an export can't answer exactly the way the app would are left to the origin: key/value
+misses, paths with keys for their query strings, hosts with pattern rules, and redirects that
+FLATTEN_REDIRECTS would follow. With --verify-readback every key of every key/value map, the root
+of every host and the donate subpaths are requested from create_app() and from each export read
+back, and the script exits with status 1 if any answer differs.
+
+The readback answers with EdgeTable.resolve(), this script's model of how nginx maps, HAProxy map
+files and the edge worker match, not with the proxies themselves: passing it says nothing about
+how a proxy will answer. Load the exports into the proxy, with nginx -t or haproxy -c at least,
+and try them there before deploying them.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+from urllib.parse import quote, unquote, urlsplit
+
+from werkzeug.test import Client
+
+import app
+from app import (
+    ASSET_EXTENSIONS,
+    DONATE_PATH,
+    DONATE_SUBPATHS,
+    KEYVALUE_MAPS,
+    Resolver,
+    create_app,
+    load_config,
+    load_redirect_map,
+    resolve_redirect,
+)
+from redirect_map import REPEATED_SLASHES_REGEX
+from response_cache import render_redirect
+from rules import DONATE, KEYVALUE, normalize_host
+
+# The status of an edge answer that leaves the request to the redirector
+ORIGIN = 0
+# Flags of an edge redirect: add the request path, add the request's query string, answer 410 for assets
+PRESERVE_PATH = "P"
+APPEND_QUERY = "Q"
+GONE_ASSETS = "G"
+# LANGUAGE_CODE_REGEX as one segment of a path
+LOCALE_SEGMENT = r"[a-z]{2}(?:-[A-Z]{2}|-[A-Z][a-z])?"
+# Added to every verification request once more, to check query strings are carried over
+VERIFY_QUERY = "utm_source=edge"
+# How nginx hashes the exact keys of a map, on a 64-bit build: see nginx_hash_builds()
+NGINX_POINTER_SIZE = 8
+NGINX_HASH_MASK = (1 << 64) - 1
+NGINX_MIN_BUCKET_SIZE = 64
+NGINX_DEFAULT_MAX_SIZE = 2048
+NGINX_SIZES_CHECKED = 100
+
+
+def edge_key(host, path):
+    """
+    Returns the key of a decoded request path in EdgeTable.keys: its host and path, lowercased and
+    without repeated or trailing slashes. Every canonical key/value key has a distinct edge key.
+    """
+    return host + REPEATED_SLASHES_REGEX.sub("/", path).rstrip("/").lower()
+
+
+def append_query(location, flags, query_string):
+    if APPEND_QUERY not in flags or not query_string:
+        return location
+    separator = "&" if "?" in location else "?"
+    return f"{location}{separator}{query_string}"
+
+
+class EdgeTable:
+    """
+    The redirects of every host the way an edge answers them, before they are written in a format.
+
+    hosts maps a host to (status, prefix, flags, suffix): its redirect is the prefix, the request
+    path if flags has PRESERVE_PATH, the suffix and the query string if flags has APPEND_QUERY.
+    routes lists the (regex, status, location, flags) matched first against host + decoded path,
+    and keys maps the edge_key() of each key/value redirect to (status, location), which always
+    gets the request's query string.
+    """
+
+    def __init__(self):
+        self.hosts = {}
+        self.routes = []
+        self.keys = {}
+
+    def resolve(self, host, raw_path, raw_query):
+        """
+        Returns the (status, location) an edge answers a request with, location None for a 410,
+        or None when the request goes to the origin.
+        """
+        host = normalize_host(host)
+        entry = self.hosts.get(host)
+        if entry is None:
+            return None
+
+        path = unquote(raw_path)
+        for regex, status, location, flags in self.routes:
+            if re.fullmatch(regex, host + path):
+                return status, append_query(location, flags, raw_query)
+
+        status, prefix, flags, suffix = entry
+        if GONE_ASSETS in flags and path.endswith(ASSET_EXTENSIONS):
+            return 410, None
+
+        key_entry = self.keys.get(edge_key(host, path))
+        if key_entry is not None:
+            if key_entry[0] == ORIGIN:
+                return None
+            return key_entry[0], append_query(key_entry[1], APPEND_QUERY, raw_query)
+
+        if status == ORIGIN:
+            return None
+        location = prefix
+        if PRESERVE_PATH in flags and raw_path != "/":
+            location += raw_path
+        return status, append_query(location + suffix, flags, raw_query)
+
+
+def uri(location, status):
+    """
+    Returns a location the way the redirector sends it in its Location header.
+    """
+    return render_redirect(location, status).location
+
+
+def host_entry(handler, leaves):
+    rule = handler.rule
+    if handler.branch == DONATE:
+        location = rule.build(DONATE_PATH, "") if rule is not None else None
+        if location is None or not leaves(location):
+            return ORIGIN, "", "", ""
+        flags = APPEND_QUERY if rule.preserve_query else ""
+        return rule.status_code, uri(location, rule.status_code), flags, ""
+
+    # Key/value misses and pattern rules are left to the redirector
+    if handler.branch == KEYVALUE or handler.patterns is not None or rule is None or not leaves(rule.location):
+        return ORIGIN, "", GONE_ASSETS, ""
+
+    if not rule.preserve_path and not rule.preserve_query:
+        return rule.status_code, uri(rule.location, rule.status_code), GONE_ASSETS, ""
+
+    flags = GONE_ASSETS
+    prefix = rule.origin
+    if rule.preserve_path:
+        flags += PRESERVE_PATH
+    else:
+        prefix += rule.path
+
+    suffix = ""
+    if rule.preserve_query:
+        flags += APPEND_QUERY
+    elif rule.query:
+        suffix = "?" + rule.query
+    return rule.status_code, uri(prefix, rule.status_code), flags, suffix
+
+
+def donate_routes(host, rule, leaves):
+    """
+    Returns the routes of a donate host: its subpaths, with language code segments around them.
+    """
+    routes = []
+    for subpath in DONATE_SUBPATHS:
+        regex = rf"{re.escape(host)}/*(?:{LOCALE_SEGMENT}/)*{re.escape(subpath)}(?:/{LOCALE_SEGMENT})*/*"
+        location = rule.build(DONATE_PATH + subpath, "")
+        if leaves(location):
+            flags = APPEND_QUERY if rule.preserve_query else ""
+            routes.append((regex, rule.status_code, uri(location, rule.status_code), flags))
+    return routes
+
+
+def keyvalue_map_for(handler, redirect_map):
+    if handler.keyvalue_path is not None:
+        return KEYVALUE_MAPS.get(handler.keyvalue_path)
+    return redirect_map
+
+
+def build_edge_table(config, redirect_map):
+    """
+    Builds the EdgeTable of a configuration and its main key/value redirect map.
+    """
+    resolver = Resolver(config)
+
+    def leaves(location):
+        # A redirect the redirector would follow to another of its hosts has to reach it
+        return not resolver.flatten or normalize_host(urlsplit(location).netloc) not in resolver.host_dispatch
+
+    table = EdgeTable()
+    for host, handler in resolver.host_dispatch.items():
+        table.hosts[host] = host_entry(handler, leaves)
+        if handler.branch == DONATE and handler.rule is not None:
+            table.routes.extend(donate_routes(host, handler.rule, leaves))
+        if handler.branch != KEYVALUE:
+            continue
+
+        keyvalue_map = keyvalue_map_for(handler, redirect_map)
+        for key in keyvalue_map:
+            path, _, query = key.partition("?")
+            if query:
+                # Whether the key applies depends on the whole query string
+                table.keys[edge_key(host, path)] = (ORIGIN, None)
+                continue
+
+            resolution = resolve_redirect(handler, path[1:], "", keyvalue_map)
+            if resolution.branch != KEYVALUE:
+                continue
+            if not leaves(resolution.location):
+                table.keys[edge_key(host, path)] = (ORIGIN, None)
+                continue
+            location = uri(resolution.location, resolution.status)
+            table.keys.setdefault(edge_key(host, path), (resolution.status, location))
+
+    return table
+
+
+def nginx_string(value):
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def nginx_value(status, prefix, flags, suffix=""):
+    """
+    Returns the value of a redirect in the nginx maps, None if nginx can't send it as it is.
+    """
+    if status == ORIGIN:
+        return "origin"
+    if "$" in prefix or "$" in suffix:
+        return None
+
+    value = f"{status} {prefix}"
+    if PRESERVE_PATH in flags:
+        value += "$mofo_raw_path"
+    value += suffix
+    if APPEND_QUERY in flags:
+        value += "$mofo_and_query" if "?" in prefix + suffix else "$mofo_query"
+    return value
+
+
+def nginx_map(source, variable, entries, comment=None):
+    lines = [f"# {comment}"] if comment else []
+    lines.append(f"map {source} ${variable} {{")
+    # Entries without a value can't be written for nginx and are left to the origin
+    lines.extend(f"    {nginx_string(key)} {nginx_string(value)};" for key, value in entries if value is not None)
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def nginx_hash_element_size(key):
+    # NGX_HASH_ELT_SIZE(): the value pointer, then the key length and the key, aligned to a pointer
+    return NGINX_POINTER_SIZE + -(-(len(key) + 2) // NGINX_POINTER_SIZE) * NGINX_POINTER_SIZE
+
+
+def nginx_hash_elements(keys):
+    """
+    Returns (hash, size) of each exact key of a map, lowercased and hashed as ngx_hash_add_key() does.
+    """
+    elements = []
+    for key in keys:
+        key = key.encode("utf-8").lower()
+        key_hash = 0
+        for byte in key:
+            key_hash = (key_hash * 31 + byte) & NGINX_HASH_MASK
+        elements.append((key_hash, nginx_hash_element_size(key)))
+    return elements
+
+
+def nginx_hash_builds(elements, bucket_size, max_size):
+    """
+    Whether ngx_hash_init() finds a hash size for the elements of a map with map_hash_bucket_size
+    and map_hash_max_size: one in the range it searches, up to max_size, where no bucket outgrows
+    bucket_size. When it doesn't, nginx warns, or refuses the configuration if a key doesn't fit
+    in a bucket at all. Only the NGINX_SIZES_CHECKED largest sizes are tried, so it can answer
+    False where nginx would find a smaller size, never True where nginx wouldn't.
+    """
+    if any(size + NGINX_POINTER_SIZE > bucket_size for _, size in elements):
+        return False
+
+    # Each bucket ends with a null pointer
+    bucket_size -= NGINX_POINTER_SIZE
+    start = len(elements) // (bucket_size // (2 * NGINX_POINTER_SIZE)) or 1
+    if max_size > 10000 and elements and max_size // len(elements) < 100:
+        start = max_size - 1000
+
+    for size in range(max_size, start - 1, -1)[:NGINX_SIZES_CHECKED]:
+        filled = {}
+        for key_hash, element_size in elements:
+            bucket = key_hash % size
+            filled[bucket] = filled.get(bucket, 0) + element_size
+            if filled[bucket] > bucket_size:
+                break
+        else:
+            return True
+    return False
+
+
+def nginx_map_hash_sizes(maps):
+    """
+    Returns the map_hash_bucket_size and map_hash_max_size that let nginx hash the exact keys of
+    all maps, each a list of keys. The defaults fit keys of up to 46 bytes and a couple of thousand
+    of them, while the key/value map has thousands of keys of up to 200 bytes. The maximum size is
+    the power of two that fits twice the largest map, and the bucket size starts at the one that
+    fits the longest key and is doubled until ngx_hash_init() would find a size.
+    """
+    elements = [nginx_hash_elements(keys) for keys in maps]
+    longest = max((size for map_elements in elements for _, size in map_elements), default=0)
+    bucket_size = NGINX_MIN_BUCKET_SIZE
+    while bucket_size < longest + NGINX_POINTER_SIZE:
+        bucket_size *= 2
+    max_size = NGINX_DEFAULT_MAX_SIZE
+    while max_size < 2 * max(map(len, elements), default=0):
+        max_size *= 2
+
+    while not all(nginx_hash_builds(map_elements, bucket_size, max_size) for map_elements in elements):
+        bucket_size *= 2
+    return bucket_size, max_size
+
+
+def render_nginx(table):
+    """
+    Returns {file name: contents} of the nginx configuration for an EdgeTable.
+    """
+    assets = "|".join(re.escape(extension[1:]) for extension in ASSET_EXTENSIONS)
+    hosts = [(host, nginx_value(*entry)) for host, entry in sorted(table.hosts.items())]
+    routes = [(f"~^{regex}$", nginx_value(status, location, flags)) for regex, status, location, flags in table.routes]
+    keys = [(key, nginx_value(status, location or "", APPEND_QUERY)) for key, (status, location) in table.keys.items()]
+    gone_hosts = [(host, "1") for host, entry in sorted(table.hosts.items()) if GONE_ASSETS in entry[2]]
+
+    maps = [
+        (
+            "$request_uri",
+            "mofo_raw_path",
+            [("~^(?<mofo_path>/[^?]+)", "$mofo_path")],
+            "The request path as sent, empty for /",
+        ),
+        ("$args", "mofo_query", [("", ""), ("default", "?$args")], None),
+        ("$args", "mofo_and_query", [("", ""), ("default", "&$args")], None),
+        (
+            "$uri",
+            "mofo_key_path",
+            [("~^(?<mofo_trimmed>.*?)/*$", "$mofo_trimmed")],
+            "Key/value paths: merge_slashes collapses repeated slashes and maps compare strings case-insensitively",
+        ),
+        ("$host", "mofo_host", hosts, None),
+        ("$host", "mofo_gone_assets", gone_hosts, None),
+        ('"$mofo_gone_assets$uri"', "mofo_gone", [(f"~^1.*\\.(?:{assets})$", "1")], None),
+        ('"$host$uri"', "mofo_route", routes, None),
+        ('"$host$mofo_key_path"', "mofo_keyvalue", sorted(keys), None),
+    ]
+    # Regular expressions and default aren't hashed
+    bucket_size, max_size = nginx_map_hash_sizes(
+        [
+            [key for key, value in entries if value is not None and key != "default" and not key.startswith("~")]
+            for _, _, entries, _ in maps
+        ]
+    )
+
+    header = (
+        "# Exported by export_edge_maps.py, include in the http block and mofo_redirects.server.conf\n"
+        "# in the server block that proxies to the redirector.\n"
+        "\n"
+        "# Sized for the longest key and the largest map, see nginx_map_hash_sizes()\n"
+        f"map_hash_bucket_size {bucket_size};\n"
+        f"map_hash_max_size {max_size};\n"
+    )
+
+    statuses = {entry[0] for entry in table.hosts.values()} | {route[1] for route in table.routes}
+    statuses = sorted((statuses | {status for status, _ in table.keys.values()}) - {ORIGIN})
+
+    def returns(variable):
+        # return only takes a literal status code
+        return [f'if (${variable} ~ "^{status} (.*)$") {{ return {status} $1; }}' for status in statuses]
+
+    server = [
+        "# Exported by export_edge_maps.py, include in the server block that proxies to the redirector",
+        *returns("mofo_route"),
+        "if ($mofo_gone) { return 410; }",
+        *returns("mofo_keyvalue"),
+        *returns("mofo_host"),
+    ]
+
+    return {
+        "mofo_redirects.maps.conf": "\n".join([header, *(nginx_map(*spec) for spec in maps)]),
+        "mofo_redirects.server.conf": "\n".join(server) + "\n",
+    }
+
+
+NGINX_MAP_REGEX = re.compile(r"^map \S+ \$(\w+) \{$")
+NGINX_ENTRY_REGEX = re.compile(r'^\s+"((?:[^"\\]|\\.)*)" "((?:[^"\\]|\\.)*)";$')
+NGINX_ESCAPE_REGEX = re.compile(r"\\(.)")
+
+
+def parse_nginx_value(value):
+    if value == "origin":
+        return ORIGIN, "", "", ""
+
+    status, _, location = value.partition(" ")
+    flags = ""
+    for variable in ("$mofo_query", "$mofo_and_query"):
+        if location.endswith(variable):
+            location = location[: -len(variable)]
+            flags += APPEND_QUERY
+    prefix, found, suffix = location.partition("$mofo_raw_path")
+    if found:
+        flags += PRESERVE_PATH
+    return int(status), prefix, flags, suffix
+
+
+def parse_nginx(files):
+    """
+    Reads the nginx configuration of render_nginx() back into an EdgeTable.
+    """
+    maps = {}
+    variable = None
+    for line in files["mofo_redirects.maps.conf"].splitlines():
+        match = NGINX_MAP_REGEX.match(line)
+        if match:
+            variable = maps.setdefault(match.group(1), {})
+            continue
+        match = NGINX_ENTRY_REGEX.match(line)
+        if match and variable is not None:
+            key, value = (NGINX_ESCAPE_REGEX.sub(r"\1", group) for group in match.groups())
+            variable[key] = value
+
+    table = EdgeTable()
+    for host, value in maps["mofo_host"].items():
+        status, prefix, flags, suffix = parse_nginx_value(value)
+        if host in maps["mofo_gone_assets"]:
+            flags += GONE_ASSETS
+        table.hosts[host] = (status, prefix, flags, suffix)
+    for key, value in maps["mofo_route"].items():
+        status, location, flags, _ = parse_nginx_value(value)
+        table.routes.append((key[2:-1], status, location, flags))
+    for key, value in maps["mofo_keyvalue"].items():
+        status, location, _, _ = parse_nginx_value(value)
+        table.keys[key] = (status, location or None)
+    return table
+
+
+def haproxy_fields(*fields):
+    """
+    Returns a map file line, None if a field has whitespace HAProxy would split it on.
+    """
+    fields = [str(field) if field not in ("", None) else "-" for field in fields]
+    if any(len(field.split()) != 1 for field in fields):
+        return None
+    return " ".join(fields)
+
+
+def render_haproxy(table):
+    """
+    Returns {file name: contents} of the HAProxy map files for an EdgeTable.
+    """
+    header = "# Exported by export_edge_maps.py, {}, - stands for an empty field\n"
+
+    def status_of(status):
+        return "origin" if status == ORIGIN else status
+
+    hosts = (
+        haproxy_fields(host, status_of(status), flags, prefix, suffix)
+        for host, (status, prefix, flags, suffix) in sorted(table.hosts.items())
+    )
+    routes = (haproxy_fields(f"^{regex}$", status, flags, location) for regex, status, location, flags in table.routes)
+    keys = (haproxy_fields(key, status_of(status), location) for key, (status, location) in sorted(table.keys.items()))
+
+    return {
+        "mofo_hosts.map": header.format("<host> <status> <flags> <prefix> <suffix>")
+        + "".join(line + "\n" for line in hosts if line),
+        "mofo_routes.map": header.format("map_reg on <host><decoded path>: <regex> <status> <flags> <location>")
+        + "".join(line + "\n" for line in routes if line),
+        "mofo_keyvalue.map": header.format("<host><lowercased decoded path> <status> <location>")
+        + "".join(line + "\n" for line in keys if line),
+    }
+
+
+def parse_haproxy(files):
+    """
+    Reads the map files of render_haproxy() back into an EdgeTable.
+    """
+
+    def lines(name):
+        for line in files[name].splitlines():
+            if line and not line.startswith("#"):
+                yield [None if field == "-" else field for field in line.split(" ")]
+
+    def status_of(field):
+        return ORIGIN if field == "origin" else int(field)
+
+    table = EdgeTable()
+    for host, status, flags, prefix, suffix in lines("mofo_hosts.map"):
+        table.hosts[host] = (status_of(status), prefix or "", flags or "", suffix or "")
+    for regex, status, flags, location in lines("mofo_routes.map"):
+        table.routes.append((regex[1:-1], int(status), location, flags or ""))
+    for key, status, *location in lines("mofo_keyvalue.map"):
+        table.keys[key] = (status_of(status), location[0] if location else None)
+    return table
+
+
+def render_cdn(table):
+    """
+    Returns {file name: contents} of the JSON an edge worker answers from, see EdgeTable for its layout.
+    """
+    document = {
+        "version": 1,
+        "assets": list(ASSET_EXTENSIONS),
+        "hosts": table.hosts,
+        "routes": table.routes,
+        "keys": table.keys,
+    }
+    return {"mofo_redirects.edge.json": json.dumps(document, indent=1, ensure_ascii=False, sort_keys=True) + "\n"}
+
+
+def parse_cdn(files):
+    """
+    Reads the JSON of render_cdn() back into an EdgeTable.
+    """
+    document = json.loads(files["mofo_redirects.edge.json"])
+    table = EdgeTable()
+    table.hosts = {host: tuple(entry) for host, entry in document["hosts"].items()}
+    table.routes = [tuple(route) for route in document["routes"]]
+    table.keys = {key: tuple(entry) for key, entry in document["keys"].items()}
+    return table
+
+
+FORMATS = {
+    "nginx": (render_nginx, parse_nginx),
+    "haproxy": (render_haproxy, parse_haproxy),
+    "cdn": (render_cdn, parse_cdn),
+}
+
+
+def raw_path(path):
+    return quote(path, safe="/:@!$&'()*+,;=~")
+
+
+def verification_requests(config, redirect_map):
+    """
+    Yields the (host, raw path, raw query string) requests verify_readback() checks: every key of every
+    key/value map, the root and an arbitrary path and asset of every host, and the donate subpaths.
+    """
+    resolver = Resolver(config)
+    for host, handler in resolver.host_dispatch.items():
+        requests = [("/", ""), ("/some/page/", ""), ("/logo.png", "")]
+        if handler.branch == DONATE:
+            for subpath in DONATE_SUBPATHS:
+                requests += [(f"/{subpath}", ""), (f"/en/{subpath}/", ""), (f"/pt-BR/{subpath}/fr", "")]
+        if handler.branch == KEYVALUE:
+            for key in keyvalue_map_for(handler, redirect_map):
+                path, _, query = key.partition("?")
+                requests.append((raw_path(path), query))
+
+        for path, query in requests:
+            yield host, path, query
+            yield host, path, f"{query}&{VERIFY_QUERY}" if query else VERIFY_QUERY
+
+
+def verify_readback(config, files_by_format):
+    """
+    Compares the answers of each format's export, read back into an EdgeTable, with those of
+    create_app(), which must be built for the redirect map the exports were built from. Returns
+    {format: report}.
+    """
+    client = Client(create_app(config))
+    tables = {name: FORMATS[name][1](files) for name, files in files_by_format.items()}
+    reports = {name: {"requests": 0, "answered": 0, "mismatches": []} for name in tables}
+
+    for host, path, query in verification_requests(config, app.REDIRECT_MAP):
+        response = client.get(path, query_string=query, headers=[("Host", host), ("X-Forwarded-Proto", "https")])
+        expected = (response.status_code, response.headers.get("Location"))
+
+        for name, table in tables.items():
+            report = reports[name]
+            report["requests"] += 1
+            answer = table.resolve(host, path, query)
+            if answer is None:
+                continue
+            report["answered"] += 1
+            if answer != expected:
+                report["mismatches"].append(
+                    {"host": host, "path": path, "query": query, "edge": list(answer), "app": list(expected)}
+                )
+
+    return reports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output", nargs="?", default=".", help="directory to write the exports to")
+    parser.add_argument("--format", action="append", choices=FORMATS, help="format to export, all by default")
+    parser.add_argument(
+        "--verify-readback",
+        action="store_true",
+        help="compare the exports, read back by this script, with create_app()",
+    )
+    args = parser.parse_args(argv)
+
+    config = load_config()
+    # Relative to the app like when it serves, wherever the script is run from
+    export_path = os.path.join(config.root_path, config["REDIRECT_MAP_PATH"])
+    load_redirect_map(export_path)
+    if not len(app.REDIRECT_MAP):
+        print(f"no key/value redirects to export, {export_path} is missing or empty", file=sys.stderr)
+        return 1
+    table = build_edge_table(config, app.REDIRECT_MAP)
+
+    files_by_format = {name: FORMATS[name][0](table) for name in args.format or FORMATS}
+    os.makedirs(args.output, exist_ok=True)
+    for files in files_by_format.values():
+        for name, contents in files.items():
+            with open(os.path.join(args.output, name), "w") as f:
+                f.write(contents)
+
+    print(f"exported {len(table.hosts)} hosts and {len(table.keys)} key/value paths to {args.output}", file=sys.stderr)
+    if not args.verify_readback:
+        return 0
+
+    reports = verify_readback(config, files_by_format)
+    json.dump(reports, sys.stdout, indent=2, ensure_ascii=False)
+    print()
+    return 1 if any(report["mismatches"] for report in reports.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
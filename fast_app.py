@@ -0,0 +1,230 @@
+import json
+import os
+import time
+
+from werkzeug.exceptions import Forbidden, Gone, MethodNotAllowed, NotFound
+from werkzeug.http import HTTP_STATUS_CODES
+from werkzeug.wsgi import get_current_url
+
+import app
+from access_log import create_access_log
+from admission import AdmissionControl
+from cache_policy import CachePolicy, etag_matches
+from profiler import Profiler
+from rate_limit import RateLimiter
+from response_cache import ResponseCache, render_redirect
+from rules import KEYVALUE, normalize_host
+
+ALLOWED_METHODS = "GET, OPTIONS, HEAD"
+
+SERVER_HEADER = ("Server", "MoFo Redirector")
+HTML_CONTENT_TYPE = ("Content-Type", "text/html; charset=utf-8")
+
+# Same status lines as werkzeug's Response
+STATUS_LINES = {code: f"{code} {reason.upper()}" for code, reason in HTTP_STATUS_CODES.items()}
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+ROBOTS_BODY = b"User-agent: *\n"
+GONE_BODY = Gone().get_body().encode("utf-8")
+BAD_REQUEST_BODY = app.BAD_REQUEST_BODY.encode("utf-8")
+METHOD_NOT_ALLOWED_BODY = MethodNotAllowed().get_body().encode("utf-8")
+NOT_FOUND_BODY = NotFound().get_body().encode("utf-8")
+FORBIDDEN_BODY = Forbidden().get_body().encode("utf-8")
+
+
+class FastApp:
+    """
+    A plain WSGI callable that answers exactly like create_app(), without Flask's routing,
+    request objects and hooks.
+
+    It covers enforce_ssl, /robots.txt and redirector, including the 405 and OPTIONS
+    responses Flask adds for the GET routes. Paths with doubled leading slashes are
+    redirected straight away rather than through Flask's merge_slashes 308.
+    """
+
+    def __init__(self, config, admission=True):
+        self.config = config
+        self.force_ssl = config["FORCE_SSL"]
+        self.access_log = create_access_log(config)
+        app.KEYVALUE_MAPS.budget = int(config["KEYVALUE_MAPS_BUDGET"])
+        self.resolver = app.Resolver(config)
+        if self.resolver.flatten:
+            app.check_redirect_loops(self.resolver, app.REDIRECT_MAP)
+        self.response_cache = ResponseCache(int(config["RESPONSE_CACHE_SIZE"]))
+        self.cache_policy = CachePolicy(config)
+        self.redirect_map_watcher = app.watch_redirect_map(config)
+        self.metrics_enabled = config["METRICS_ENABLED"]
+        if self.metrics_enabled:
+            app.METRICS.configure(config["METRICS_DIR"], float(config["METRICS_FLUSH_INTERVAL"]))
+        self.key_usage_enabled = config["KEY_USAGE_ENABLED"]
+        if self.key_usage_enabled:
+            app.KEY_USAGE.configure(config["KEY_USAGE_DIR"], float(config["KEY_USAGE_FLUSH_INTERVAL"]))
+
+        # Same admission control and rate limits as create_app(), only installed when they are on.
+        # Without admission, the caller applies it around all the time it spends on a request
+        self.rate_limiter = RateLimiter(config, lambda environ: app.predict_branch(self.resolver, environ))
+        self.serve = self.rate_limiter.wsgi(self.serve)
+        if admission:
+            self.admission = AdmissionControl(config, lambda environ: app.is_priority_request(self.resolver, environ))
+            self.serve = self.admission.wsgi(self.serve)
+
+        # Same stages as create_app() times, the wrappers are only installed when profiling
+        self.profiler = Profiler(config["PROFILE_SAMPLE_RATE"])
+        self.enforce_ssl = self.profiler.stage("enforce_ssl")(self.enforce_ssl)
+        self.respond = self.profiler.stage("response_headers")(self.respond)
+
+    def __call__(self, environ, start_response):
+        if self.profiler.enabled:
+            return self.profiler.request(self.serve, environ, start_response)
+        return self.serve(environ, start_response)
+
+    def serve(self, environ, start_response):
+        started = time.perf_counter()
+        method = environ.get("REQUEST_METHOD", "GET")
+
+        if self.force_ssl:
+            url = self.enforce_ssl(environ)
+            if url is not None:
+                return self.redirect(start_response, method, render_redirect(url, 301))
+
+        path = environ.get("PATH_INFO", "").encode("latin1").decode("utf-8", "replace").lstrip("/")
+
+        if method == "POST" and path == "__reload":
+            return self.reload_map(environ, start_response)
+
+        if method not in ("GET", "HEAD"):
+            if method == "OPTIONS":
+                return self.respond(start_response, method, 200, b"", [("Allow", ALLOWED_METHODS)])
+            return self.respond(start_response, method, 405, METHOD_NOT_ALLOWED_BODY, [("Allow", ALLOWED_METHODS)])
+
+        if path == "robots.txt":
+            return self.respond(
+                start_response,
+                method,
+                200,
+                ROBOTS_BODY,
+                self.cache_policy.robots_headers,
+                content_type=("Content-Type", "text/plain; charset=utf-8"),
+            )
+
+        if path == "__metrics" and self.metrics_enabled:
+            return self.send_metrics(environ, start_response, method)
+
+        if path == "__key_usage" and self.key_usage_enabled:
+            return self.send_key_usage(environ, start_response, method)
+
+        self.redirect_map_watcher.ensure_running()
+        redirect_map = app.REDIRECT_MAP
+
+        host = environ.get("HTTP_X_FORWARDED_HOST") or environ.get("HTTP_HOST")
+
+        host = normalize_host(host)
+        query_string = environ.get("QUERY_STRING", "").encode("latin1").decode("utf-8")
+        cache_key = (host, path, query_string)
+
+        rendered = self.response_cache.get(cache_key, redirect_map)
+        cached = rendered is not None
+        if cached:
+            resolution = rendered.resolution
+        else:
+            resolution = self.resolver.resolve(host, path, query_string, redirect_map, self.profiler.current())
+            if resolution.location is not None:
+                rendered = render_redirect(resolution.location, resolution.status, resolution)
+                self.response_cache.put(cache_key, rendered, redirect_map)
+
+        if self.metrics_enabled:
+            app.record_request_metrics(self.resolver, host, resolution, started, self.response_cache, cached)
+        if self.key_usage_enabled and resolution.branch == KEYVALUE:
+            app.record_key_usage(self.resolver, host, resolution)
+        if self.access_log is not None:
+            self.access_log.log(host, path, query_string, resolution, started, cached)
+
+        if resolution.status == 400:
+            return self.respond(start_response, method, 400, BAD_REQUEST_BODY)
+        if resolution.status == 410:
+            return self.respond(start_response, method, 410, GONE_BODY, self.cache_policy.headers(410, host))
+
+        headers = [("ETag", rendered.etag), *self.cache_policy.headers(rendered.status, host)]
+        if etag_matches(environ.get("HTTP_IF_NONE_MATCH"), rendered.etag):
+            return self.respond(start_response, method, 304, b"", headers, content_type=None)
+
+        return self.redirect(start_response, method, rendered, headers)
+
+    def enforce_ssl(self, environ):
+        """
+        Returns the https:// URL to redirect a request that didn't come over HTTPS to.
+        """
+        if environ.get("HTTP_X_FORWARDED_PROTO") == "https":
+            return None
+        return get_current_url(environ).replace("http://", "https://", 1)
+
+    def send_metrics(self, environ, start_response, method):
+        """
+        Same as the /__metrics route of create_app().
+        """
+        if not app.metrics_requested(environ.get("HTTP_AUTHORIZATION"), self.config):
+            return self.respond(start_response, method, 403, FORBIDDEN_BODY)
+
+        body = app.render_metrics(self.response_cache).encode("utf-8")
+        return self.respond(
+            start_response, method, 200, body, content_type=("Content-Type", METRICS_CONTENT_TYPE)
+        )
+
+    def send_key_usage(self, environ, start_response, method):
+        """
+        Same as the /__key_usage route of create_app().
+        """
+        if not app.key_usage_requested(environ.get("HTTP_AUTHORIZATION"), self.config):
+            return self.respond(start_response, method, 403, FORBIDDEN_BODY)
+
+        body = app.render_key_usage().encode("utf-8")
+        return self.respond(start_response, method, 200, body, content_type=("Content-Type", "application/json"))
+
+    def reload_map(self, environ, start_response):
+        """
+        Same as the /__reload route of create_app().
+        """
+        authorized = app.reload_requested(environ.get("HTTP_AUTHORIZATION"), self.config)
+        if authorized is None:
+            return self.respond(start_response, "POST", 404, NOT_FOUND_BODY)
+        if not authorized:
+            return self.respond(start_response, "POST", 403, FORBIDDEN_BODY)
+
+        path = self.config["REDIRECT_MAP_PATH"]
+        reloaded = app.reload_redirect_map(path)
+        if reloaded and os.path.exists(path):
+            os.utime(path)
+
+        body = (json.dumps(app.RELOAD_STATS, separators=(",", ":"), sort_keys=True) + "\n").encode("utf-8")
+        return self.respond(
+            start_response, "POST", 200 if reloaded else 500, body, content_type=("Content-Type", "application/json")
+        )
+
+    def redirect(self, start_response, method, rendered, headers=()):
+        return self.respond(
+            start_response, method, rendered.status, rendered.body, [("Location", rendered.location), *headers]
+        )
+
+    def respond(self, start_response, method, status, body, headers=(), content_type=HTML_CONTENT_TYPE):
+        """
+        Sends a response; content_type None sends it without entity headers, like werkzeug does for a 304.
+        """
+        if content_type is None:
+            start_response(STATUS_LINES[status], [*headers, SERVER_HEADER])
+            return [body]
+
+        start_response(
+            STATUS_LINES[status],
+            [content_type, ("Content-Length", str(len(body))), *headers, SERVER_HEADER],
+        )
+        if method == "HEAD":
+            return [b""]
+        return [body]
+
+
+def create_fast_app(test_config=None):
+    """
+    Builds the FastApp for the same configuration create_app() would use.
+    """
+    return FastApp(app.load_config(test_config))
@@ -0,0 +1,88 @@
+"""
+Finds redirect chains and loops in a Wagtail redirect export and the configured host rules,
+and optionally writes a copy of the export with every chain collapsed into a single hop.
+
+    python flatten_redirects.py [export.json] [--output flattened.json]
+
+Chains are followed through the hosts this app serves, using the same resolution as
+create_app(). Prints a JSON report and exits with status 1 if any loop was found; loops are
+left out of the flattened export untouched.
+"""
+
+import argparse
+import json
+import sys
+
+from app import RedirectLoop, Resolution, Resolver, is_permanent, load_config, resolve_redirect
+from redirect_map import LocaleIndex
+from rules import KEYVALUE
+
+DEFAULT_EXPORT = "foundation.mozilla.org_wagtail_redirects.json"
+
+
+def analyze(entries, config):
+    """
+    Returns (report, flattened entries) for a Wagtail export.
+    """
+    resolver = Resolver(config)
+    redirect_map = LocaleIndex(entries, canonical=True)
+    keyvalue_host = config["KEYVALUE_HOSTS"][0]
+
+    report = {"chains": [], "loops": []}
+    flattened = {}
+
+    for key, entry in entries.items():
+        status = 301 if entry.get("is_permanent") else 302
+        resolution = Resolution(status, entry["redirect_to"], KEYVALUE, key)
+        path, _, query_string = key[1:].partition("?")
+
+        try:
+            final = resolver.follow(resolution, redirect_map, [(keyvalue_host, path, query_string)])
+        except RedirectLoop as loop:
+            report["loops"].append({"key": key, "loop": str(loop)})
+            flattened[key] = entry
+            continue
+
+        if final.location != resolution.location:
+            report["chains"].append({"key": key, "from": resolution.location, "to": final.location})
+        flattened[key] = {"redirect_to": final.location, "is_permanent": is_permanent(final.status)}
+
+    for host, handler in resolver.host_dispatch.items():
+        resolution = resolve_redirect(handler, "", "", redirect_map)
+        if resolution.location is None:
+            continue
+
+        try:
+            final = resolver.follow(resolution, redirect_map, [(host, "", "")])
+        except RedirectLoop as loop:
+            report["loops"].append({"host": host, "loop": str(loop)})
+            continue
+
+        if final.location != resolution.location:
+            report["chains"].append({"host": host, "from": resolution.location, "to": final.location})
+
+    return report, flattened
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("export", nargs="?", default=DEFAULT_EXPORT)
+    parser.add_argument("--output", help="where to write the flattened export")
+    args = parser.parse_args(argv)
+
+    with open(args.export) as f:
+        entries = json.load(f)
+
+    report, flattened = analyze(entries, load_config())
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(flattened, f, indent=2, ensure_ascii=False)
+
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return 1 if report["loops"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
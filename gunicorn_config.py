@@ -0,0 +1,45 @@
+# Preloading gunicorn setup, used with:
+#   gunicorn -c gunicorn_config.py "app:create_app()"
+#
+# The app and its redirect map are loaded once in the master and shared copy-on-write with
+# the workers, instead of every worker parsing the Wagtail export on boot.
+
+import gc
+
+preload_app = True
+
+
+def on_starting(server):
+    # Worker metrics and key usage from a previous run would be added to this run's totals
+    from config import Config
+    from metrics import clear_metrics_directory
+
+    if Config.METRICS_DIR:
+        clear_metrics_directory(Config.METRICS_DIR)
+    if Config.KEY_USAGE_DIR:
+        clear_metrics_directory(Config.KEY_USAGE_DIR)
+
+
+def when_ready(server):
+    from app import prepare_for_fork
+
+    prepare_for_fork()
+
+
+def pre_fork(server, worker):
+    # Anything the master allocated since when_ready shouldn't be collected in the workers either
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    # gunicorn resets SIGHUP in workers; sending one to a worker reloads its redirect map.
+    # A SIGHUP to the master still restarts all workers.
+    from app import load_config, reload_redirect_map
+    from config import Config
+    from profiler import start_stack_sampler
+    from reloader import install_reload_signal
+
+    install_reload_signal(lambda: reload_redirect_map(Config.REDIRECT_MAP_PATH))
+
+    # Interval timers aren't inherited across fork, each worker samples its own stacks
+    start_stack_sampler(load_config())
@@ -0,0 +1,218 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import zlib
+from array import array
+from collections import Counter
+
+# Count-min sketch of key/value redirect hits: SKETCH_DEPTH rows of SKETCH_WIDTH counters
+SKETCH_WIDTH = 8192
+SKETCH_DEPTH = 4
+# Most requested keys each process keeps by name
+TOP_KEYS = 100
+# Hits buffered before they are added to the sketch
+PENDING_HITS = 1024
+# Start value of the second CRC32 a key's counters are picked with
+SECOND_HASH_START = 0x5BD1E995
+
+
+class KeyUsage:
+    """
+    Counts how often each key of the key/value redirect map answers a request, in fixed memory.
+
+    Every hit goes into a count-min sketch instead of a dict of keys: SKETCH_DEPTH rows of
+    SKETCH_WIDTH counters, 256 KiB however many keys there are. A key's estimate is the lowest
+    of its counters, never below its real count and almost always less than e / SKETCH_WIDTH
+    of all hits above it, so a key estimated at 0 was never requested. The TOP_KEYS keys with
+    the highest estimates are also kept by name.
+
+    Keys are hashed with CRC32 rather than hash(), which is seeded per process, so the sketches
+    of every gunicorn worker line up and merge by adding them up. Like MetricsRegistry, each
+    process writes its counts to <directory>/<pid>.json when a directory is configured, and
+    snapshot() merges those of every process.
+    """
+
+    def __init__(self, width=SKETCH_WIDTH, depth=SKETCH_DEPTH, top_size=TOP_KEYS):
+        self.width = width
+        self.depth = depth
+        self.top_size = top_size
+        self.directory = None
+        self.flush_interval = None
+        self._thread = None
+        self._rows = [(row, row * width) for row in range(depth)]
+        self.clear()
+
+    def clear(self):
+        self.hits = 0
+        self._pending = []
+        self.counts = array("Q", bytes(8 * self.width * self.depth))
+        self.top = {}
+        self._floor = 0
+
+    def _cells(self, key):
+        data = key.encode("utf-8")
+        cell = zlib.crc32(data)
+        step = zlib.crc32(data, SECOND_HASH_START) | 1
+        width = self.width
+        return [offset + (cell + row * step) % width for row, offset in self._rows]
+
+    def record(self, key):
+        """
+        Counts a hit on a key. Hits are buffered and folded into the sketch PENDING_HITS at a
+        time, once for each key they hit, so a hot key costs a list append most of the time.
+        Like the metrics, updates take no lock: a hit lost to a race between threads only makes
+        the estimates a little lower.
+        """
+        self.hits += 1
+        pending = self._pending
+        pending.append(key)
+        if len(pending) >= PENDING_HITS:
+            self._fold()
+
+    def _fold(self):
+        pending, self._pending = self._pending, []
+        for key, amount in Counter(pending).items():
+            self._add(key, amount)
+
+    def _add(self, key, amount):
+        counts = self.counts
+        estimate = 1 << 64
+        for cell in self._cells(key):
+            count = counts[cell] + amount
+            counts[cell] = count
+            if count < estimate:
+                estimate = count
+
+        top = self.top
+        if key in top or len(top) < self.top_size:
+            top[key] = estimate
+        elif estimate > self._floor:
+            coldest = min(top, key=top.get)
+            if top[coldest] < estimate:
+                del top[coldest]
+                top[key] = estimate
+            self._floor = min(top.values())
+
+    def estimate(self, key):
+        if self._pending:
+            self._fold()
+        counts = self.counts
+        return min(counts[cell] for cell in self._cells(key))
+
+    def hottest(self, limit=None):
+        """
+        Returns the (key, estimate) of the most requested keys, most requested first.
+        """
+        if self._pending:
+            self._fold()
+        ranked = sorted(((key, self.estimate(key)) for key in self.top), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit]
+
+    def configure(self, directory=None, flush_interval=60):
+        if directory and not self.directory:
+            atexit.register(self.flush)
+        self.directory = directory
+        self.flush_interval = flush_interval
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def ensure_flushing(self):
+        """
+        Starts the thread writing this process's counts, once per process.
+        """
+        if self._thread is not None or not self.directory:
+            return
+
+        self._thread = threading.Thread(target=self._run, name="key-usage-flush", daemon=True)
+        self._thread.start()
+        os.register_at_fork(after_in_child=self._forget_process)
+
+    def _forget_process(self):
+        # A forked worker starts counting from zero, the master's counts stay in its own file
+        self._thread = None
+        self.clear()
+
+    def _run(self):
+        stopped = threading.Event()
+        while not stopped.wait(self.flush_interval):
+            self.flush()
+
+    def _local_snapshot(self):
+        if self._pending:
+            self._fold()
+        counts = self.counts
+        return {
+            "width": self.width,
+            "depth": self.depth,
+            "hits": self.hits,
+            # Most counters stay at zero, only the others are written
+            "cells": [[cell, count] for cell, count in enumerate(counts) if count],
+            "top": list(self.top),
+        }
+
+    def flush(self):
+        if not self.directory:
+            return
+
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(self._local_snapshot(), f)
+        os.replace(temporary_path, path)
+
+    def merge(self, snapshot):
+        """
+        Adds the counts of another process's snapshot to these.
+        """
+        if (snapshot["width"], snapshot["depth"]) != (self.width, self.depth):
+            raise ValueError(f"a {snapshot['depth']}x{snapshot['width']} sketch can't be merged into this one")
+
+        counts = self.counts
+        for cell, count in snapshot["cells"]:
+            counts[cell] += count
+        self.hits += snapshot["hits"]
+
+        # Each process ranked its own keys, they are ranked again on the merged counts
+        candidates = {*self.top, *snapshot["top"]}
+        ranked = sorted(candidates, key=lambda key: -self.estimate(key))[: self.top_size]
+        self.top = {key: self.estimate(key) for key in ranked}
+        self._floor = min(self.top.values(), default=0)
+
+    def snapshot(self):
+        """
+        Returns a KeyUsage with the counts of every process that wrote to the directory added
+        to this process's live counts.
+        """
+        merged = KeyUsage(self.width, self.depth, self.top_size)
+        merged.merge(self._local_snapshot())
+        if self.directory:
+            own_file = os.path.join(self.directory, f"{os.getpid()}.json")
+            for path in glob.glob(os.path.join(self.directory, "*.json")):
+                if path == own_file:
+                    continue
+                try:
+                    with open(path) as f:
+                        merged.merge(json.load(f))
+                except (OSError, ValueError, KeyError):
+                    continue
+        return merged
+
+
+def key_usage_report(key_usage, redirect_map, limit=TOP_KEYS):
+    """
+    Returns what key_usage says about a redirect map: the hits counted, its most requested keys
+    and the share of hits they took, and its dead keys, those that were never requested.
+    """
+    hottest = key_usage.hottest(limit)
+    return {
+        "hits": key_usage.hits,
+        "keys": len(redirect_map),
+        "top": [{"key": key, "hits": hits} for key, hits in hottest],
+        "top_share": min(sum(hits for _, hits in hottest) / key_usage.hits, 1.0) if key_usage.hits else 0.0,
+        "dead": sorted(key for key in redirect_map if not key_usage.estimate(key)),
+    }
+
+
+KEY_USAGE = KeyUsage()
@@ -0,0 +1,44 @@
+"""
+Reports how often the keys of the key/value redirect map were requested, from the counts the
+workers write to KEY_USAGE_DIR.
+
+    python key_usage_report.py [--dir KEY_USAGE_DIR] [--export export.json] [--top 100]
+
+Prints a JSON report: the hits counted, the most requested keys and the share of hits they
+took, which a response cache needs to hold, and the dead keys that were never requested since
+the workers started, which can be pruned from the export. The report covers the configured
+REDIRECT_MAP_PATH unless another export is given.
+"""
+
+import argparse
+import json
+import sys
+
+import app
+from app import build_redirect_map, load_config
+from key_usage import TOP_KEYS, KeyUsage, key_usage_report
+
+
+def main(argv=None):
+    config = load_config()
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default=config["KEY_USAGE_DIR"], help="where the workers write their counts")
+    parser.add_argument("--export", help="the Wagtail export to report on")
+    parser.add_argument("--top", type=int, default=TOP_KEYS, help="how many of the most requested keys to list")
+    args = parser.parse_args(argv)
+
+    if not args.dir:
+        parser.error("no counts to report, set KEY_USAGE_DIR or pass --dir")
+
+    key_usage = KeyUsage()
+    key_usage.directory = args.dir
+    redirect_map = build_redirect_map(args.export) if args.export else app.REDIRECT_MAP
+
+    json.dump(key_usage_report(key_usage.snapshot(), redirect_map, args.top), sys.stdout, indent=2, ensure_ascii=False)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
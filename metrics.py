@@ -0,0 +1,187 @@
+import atexit
+import bisect
+import glob
+import json
+import os
+import threading
+
+# Request latency buckets, in seconds
+DURATION_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms for this process.
+
+    Updates are plain dict and list writes without locks, cheap enough for every request.
+    When a directory is configured, each process periodically writes a snapshot to
+    <directory>/<pid>.json, and snapshot() adds up the snapshots of every process so any
+    gunicorn worker can serve the totals.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.directory = None
+        self.flush_interval = None
+        self._thread = None
+
+    def increment(self, name, labels=(), amount=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = [0] * (len(DURATION_BUCKETS) + 1) + [0.0]
+
+        histogram[bisect.bisect_left(DURATION_BUCKETS, value)] += 1
+        histogram[-1] += value
+
+    def record_request(self, host, resolution, duration):
+        """
+        Records a resolved request: the served host it was for, the branch that answered it,
+        its status and how long it took.
+        """
+        branch = resolution.branch
+        self.increment("requests_total", (("host", host), ("branch", branch), ("status", resolution.status)))
+        self.observe("request_duration_seconds", (("branch", branch),), duration)
+
+    def record_keyvalue_lookup(self, host, hit):
+        self.increment("keyvalue_lookups_total", (("host", host), ("result", "hit" if hit else "miss")))
+
+    def configure(self, directory=None, flush_interval=10):
+        if directory and not self.directory:
+            atexit.register(self.flush)
+        self.directory = directory
+        self.flush_interval = flush_interval
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def ensure_flushing(self):
+        """
+        Starts the thread writing this process's snapshot, once per process.
+        """
+        if self._thread is not None or not self.directory:
+            return
+
+        self._thread = threading.Thread(target=self._run, name="metrics-flush", daemon=True)
+        self._thread.start()
+        os.register_at_fork(after_in_child=self._forget_process)
+
+    def _forget_process(self):
+        # A forked worker starts counting from zero, the master's counts stay in its own file
+        self._thread = None
+        self.clear()
+
+    def clear(self):
+        self.counters = {}
+        self.histograms = {}
+
+    def _run(self):
+        stopped = threading.Event()
+        while not stopped.wait(self.flush_interval):
+            self.flush()
+
+    def _local_snapshot(self):
+        counters = list(self.counters.items())
+        histograms = list(self.histograms.items())
+        return {
+            "counters": [[name, list(labels), value] for (name, labels), value in counters],
+            "histograms": [[name, list(labels), list(values)] for (name, labels), values in histograms],
+        }
+
+    def flush(self):
+        if not self.directory:
+            return
+
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(self._local_snapshot(), f)
+        os.replace(temporary_path, path)
+
+    def snapshot(self):
+        """
+        Returns ({(name, labels): value}, {(name, labels): histogram}) summed over every process
+        that wrote to the metrics directory, with this process's live values.
+        """
+        snapshots = [self._local_snapshot()]
+        if self.directory:
+            own_file = os.path.join(self.directory, f"{os.getpid()}.json")
+            for path in glob.glob(os.path.join(self.directory, "*.json")):
+                if path == own_file:
+                    continue
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+
+        counters, histograms = {}, {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot["counters"]:
+                key = (name, tuple(tuple(label) for label in labels))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, values in snapshot["histograms"]:
+                key = (name, tuple(tuple(label) for label in labels))
+                merged = histograms.setdefault(key, [0] * len(values))
+                histograms[key] = [total + value for total, value in zip(merged, values)]
+        return counters, histograms
+
+
+def clear_metrics_directory(directory):
+    """
+    Removes the snapshots left by the processes of a previous run.
+    """
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        os.remove(path)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def render_prometheus(counters, histograms, gauges=(), prefix="mofo_redirector_"):
+    """
+    Renders metrics in the Prometheus text exposition format. gauges is a sequence of
+    (name, labels, value).
+    """
+    lines = []
+
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE {prefix}{name} counter")
+        for (counter_name, labels), value in sorted(counters.items(), key=str):
+            if counter_name == name:
+                lines.append(f"{prefix}{name}{format_labels(labels)} {value}")
+
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# TYPE {prefix}{name} histogram")
+        for (histogram_name, labels), values in sorted(histograms.items(), key=str):
+            if histogram_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip((*DURATION_BUCKETS, "+Inf"), values[:-1]):
+                cumulative += count
+                lines.append(f"{prefix}{name}_bucket{format_labels((*labels, ('le', bound)))} {cumulative}")
+            lines.append(f"{prefix}{name}_sum{format_labels(labels)} {values[-1]}")
+            lines.append(f"{prefix}{name}_count{format_labels(labels)} {cumulative}")
+
+    typed = set()
+    for name, labels, value in gauges:
+        if name not in typed:
+            lines.append(f"# TYPE {prefix}{name} gauge")
+            typed.add(name)
+        lines.append(f"{prefix}{name}{format_labels(labels)} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
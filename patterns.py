@@ -0,0 +1,227 @@
+import re
+from dataclasses import dataclass
+
+from rules import preserved_query
+
+# {name} in a pattern matches one path segment, * matches one segment unless it ends the pattern
+PATTERN_TOKEN_REGEX = re.compile(r"(\{\w+\}|\*)")
+# Named groups and their back references in re: patterns
+NAMED_GROUP_REGEX = re.compile(r"\(\?P([<=])(\w+)")
+# What a trailing /* matched, as used in targets
+REST = "*"
+
+
+@dataclass(frozen=True, slots=True)
+class PatternRule:
+    """
+    A PATTERN_RULES entry: a path pattern, and its target split into a template of literal
+    strings (even indexes) and capture names (odd indexes).
+    """
+
+    pattern: str
+    template: tuple
+    status_code: int
+    preserve_query: bool
+
+    def build(self, captures, query_string):
+        """
+        Returns the redirect URL for the captures of a matched path and the request's raw query string.
+        """
+        parts = list(self.template)
+        for index in range(1, len(parts), 2):
+            parts[index] = captures.get(parts[index], "")
+        location = "".join(parts)
+
+        if self.preserve_query and query_string:
+            redirect_query = preserved_query(query_string)
+            if redirect_query:
+                separator = "&" if "?" in location else "?"
+                location = f"{location}{separator}{redirect_query}"
+        return location
+
+
+def compile_template(target):
+    template = []
+    for index, token in enumerate(PATTERN_TOKEN_REGEX.split(target)):
+        template.append(token.strip("{}") if index % 2 else token)
+    return tuple(template)
+
+
+def is_prefix_pattern(pattern):
+    """
+    Whether a pattern is a literal path, optionally ending in /*, which the prefix trie handles.
+    """
+    body = pattern[:-2] if pattern.endswith("/*") else pattern
+    return not pattern.startswith("re:") and PATTERN_TOKEN_REGEX.search(body) is None
+
+
+def pattern_regex(pattern, prefix):
+    """
+    Translates a pattern into a regex whose named groups are renamed with prefix, and returns
+    it with the {group name: capture name} of its captures.
+    """
+    captures = {}
+
+    if pattern.startswith("re:"):
+
+        def rename(match):
+            captures[prefix + match.group(2)] = match.group(2)
+            return f"(?P{match.group(1)}{prefix}{match.group(2)}"
+
+        return NAMED_GROUP_REGEX.sub(rename, pattern[3:]), captures
+
+    trailing = pattern.endswith("/*")
+    if trailing:
+        pattern = pattern[:-2]
+
+    parts = []
+    for index, token in enumerate(PATTERN_TOKEN_REGEX.split(pattern)):
+        if not index % 2:
+            parts.append(re.escape(token))
+        elif token == "*":
+            parts.append("[^/]*")
+        else:
+            group = prefix + token[1:-1]
+            captures[group] = token[1:-1]
+            parts.append(f"(?P<{group}>[^/]+)")
+
+    if trailing:
+        group = prefix + "rest"
+        captures[group] = REST
+        parts.append(f"(?:/(?P<{group}>.*))?")
+
+    return "".join(parts), captures
+
+
+class TrieNode:
+    __slots__ = ("children", "exact", "prefix")
+
+    def __init__(self):
+        self.children = {}
+        self.exact = None
+        self.prefix = None
+
+
+def literal_segment(pattern):
+    """
+    Returns (position, segment) for the first path segment of a pattern without placeholders
+    or wildcards, None if it has none or is a regex.
+    """
+    if pattern.startswith("re:"):
+        return None
+    if pattern.endswith("/*"):
+        pattern = pattern[:-2]
+    for position, segment in enumerate(pattern[1:].split("/")):
+        if PATTERN_TOKEN_REGEX.search(segment) is None:
+            return position, segment
+    return None
+
+
+class PatternMatcher:
+    """
+    Matches a path against every pattern rule of a host at once.
+
+    Literal paths and literal prefixes ending in /* go into a trie walked segment by segment,
+    so their cost only depends on the depth of the path. All other patterns are tried first,
+    in the order they were listed: they are combined into alternation regexes, one for each
+    first literal segment and its position (campaigns at 1 for /{locale}/campaigns/*), so a
+    path is only matched against the regexes of the segments it has, plus one regex for the
+    patterns without a literal segment. When none of them matches, the longest prefix in the
+    trie wins.
+    """
+
+    def __init__(self, rules):
+        self.trie = TrieNode()
+        self.regex_rules = {}
+
+        alternatives = {}
+        for index, (pattern, rule) in enumerate(rules):
+            if is_prefix_pattern(pattern):
+                self.add_prefix(pattern, rule)
+                continue
+
+            name = f"r{index}"
+            regex, captures = pattern_regex(pattern, name + "_")
+            alternatives.setdefault(literal_segment(pattern), []).append(f"(?P<{name}>{regex})")
+            self.regex_rules[name] = (index, rule, captures)
+
+        self.regexes = {key: re.compile("|".join(regexes)) for key, regexes in alternatives.items()}
+        self.unindexed_regex = self.regexes.pop(None, None)
+        self.positions = sorted({position for position, _ in self.regexes})
+
+    def add_prefix(self, pattern, rule):
+        trailing = pattern.endswith("/*")
+        literal = pattern[:-2] if trailing else pattern
+        node = self.trie
+        # /* puts its rule on the root itself
+        for segment in literal[1:].split("/") if literal else ():
+            node = node.children.setdefault(segment, TrieNode())
+
+        if trailing:
+            node.prefix = node.prefix or rule
+        else:
+            node.exact = node.exact or rule
+
+    def match(self, path):
+        """
+        Returns (PatternRule, captures) for the first rule matching a path with its leading slash, or None.
+        """
+        segments = path[1:].split("/")
+
+        if self.regex_rules:
+            candidates = [
+                self.regexes.get((position, segments[position]))
+                for position in self.positions
+                if position < len(segments)
+            ]
+            candidates.append(self.unindexed_regex)
+
+            # Each regex returns its first rule, the first listed wins across them
+            found = None
+            for regex in candidates:
+                match = regex.fullmatch(path) if regex is not None else None
+                if match and (found is None or self.regex_rules[match.lastgroup][0] < found[0]):
+                    found = self.regex_rules[match.lastgroup] + (match,)
+
+            if found is not None:
+                _, rule, captures, match = found
+                return rule, {name: match.group(group) or "" for group, name in captures.items()}
+
+        node = self.trie
+        best = None
+        for depth, segment in enumerate(segments):
+            if node.prefix is not None:
+                best = (node.prefix, depth)
+            node = node.children.get(segment)
+            if node is None:
+                break
+        else:
+            if node.exact is not None:
+                return node.exact, {}
+            if node.prefix is not None:
+                best = (node.prefix, len(segments))
+
+        if best is None:
+            return None
+        rule, depth = best
+        return rule, {REST: "/".join(segments[depth:])}
+
+
+def compile_pattern_rule(pattern, rule):
+    """
+    Compiles a PATTERN_RULES entry, see config.py for its layout.
+    """
+    target, redirect_code, preserve_query = rule
+    if not pattern.startswith(("/", "re:")):
+        raise ValueError(f"pattern {pattern!r} doesn't start with a slash or re:")
+    return PatternRule(pattern, compile_template(target), redirect_code.value, preserve_query)
+
+
+def compile_pattern_rules(pattern_rules):
+    """
+    Compiles Config.PATTERN_RULES into a dict of host to PatternMatcher.
+    """
+    return {
+        host: PatternMatcher([(pattern, compile_pattern_rule(pattern, rule)) for pattern, rule in rules.items()])
+        for host, rules in pattern_rules.items()
+    }
@@ -0,0 +1,190 @@
+import atexit
+import functools
+import os
+import random
+import signal
+import threading
+import time
+from collections import Counter, deque
+
+from metrics import METRICS
+
+
+def timed(timings, stage, function, *args):
+    """
+    Calls function(*args), adding its wall-clock time to timings[stage] unless timings is None.
+    """
+    if timings is None:
+        return function(*args)
+
+    started = time.perf_counter()
+    try:
+        return function(*args)
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - started
+
+
+class Profiler:
+    """
+    Times the stages of a sample of requests.
+
+    A sampled request gets a timings dict for the thread serving it; stages add their
+    wall-clock time to it and the totals go to the stage_duration_seconds histogram of
+    METRICS when the request ends. Requests that aren't sampled only pay for a random().
+    """
+
+    def __init__(self, sample_rate=0.0):
+        self.sample_rate = float(sample_rate)
+        self.enabled = self.sample_rate > 0
+        self._local = threading.local()
+
+    def current(self):
+        """
+        Returns the timings of the request this thread is serving, None if it isn't sampled.
+        """
+        return getattr(self._local, "timings", None)
+
+    def stage(self, name):
+        """
+        Decorates a function so its calls are timed as a stage of the current request. The
+        function is returned as is when profiling is disabled.
+        """
+
+        def decorator(function):
+            if not self.enabled:
+                return function
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                return timed(self.current(), name, functools.partial(function, *args, **kwargs))
+
+            return wrapper
+
+        return decorator
+
+    def request(self, function, *args):
+        """
+        Calls function(*args) as one request, sampled with probability sample_rate.
+        """
+        if random.random() >= self.sample_rate:
+            return function(*args)
+
+        timings = self._local.timings = {}
+        started = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            self._local.timings = None
+            timings["request"] = time.perf_counter() - started
+            for stage, seconds in timings.items():
+                METRICS.observe("stage_duration_seconds", (("stage", stage),), seconds)
+
+    def wsgi(self, application):
+        """
+        Wraps a WSGI application so each of its requests goes through request().
+        """
+        if not self.enabled:
+            return application
+
+        @functools.wraps(application)
+        def profiled_application(environ, start_response):
+            return self.request(application, environ, start_response)
+
+        return profiled_application
+
+
+def stack_codes(frame):
+    """
+    Returns the code objects of the stack ending at frame, innermost first.
+    """
+    codes = []
+    while frame is not None:
+        codes.append(frame.f_code)
+        frame = frame.f_back
+    return tuple(codes)
+
+
+def fold_codes(codes):
+    """
+    Returns a stack from stack_codes() in the folded format of flamegraph.pl, outermost first.
+    """
+    return ";".join(
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})" for code in reversed(codes)
+    )
+
+
+def fold_stack(frame):
+    return fold_codes(stack_codes(frame))
+
+
+class StackSampler:
+    """
+    Samples the Python stack of the main thread every interval seconds of CPU time, using
+    SIGPROF so a worker waiting for requests isn't sampled, and writes the folded stacks to
+    <path>.<pid> every flush_interval seconds. The files can be fed to flamegraph.pl or
+    speedscope as they are.
+
+    The signal handler only appends the code objects of the stack to a deque; a thread folds
+    and writes them, so no file is opened or string built while a sampled frame is suspended.
+
+    Interval timers don't survive a fork, so start() must be called in each worker.
+    """
+
+    def __init__(self, path, interval=0.01, flush_interval=10):
+        self.path = path
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.stacks = Counter()
+        self._samples = deque()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        atexit.register(self.flush)
+        self._thread = threading.Thread(target=self._run, name="stack-sampler-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        self.flush()
+
+    def _sample(self, signum, frame):
+        self._samples.append(stack_codes(frame))
+
+    def _run(self):
+        stopped = threading.Event()
+        while not stopped.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            samples = self._samples
+            while samples:
+                self.stacks[fold_codes(samples.popleft())] += 1
+
+            path = f"{self.path}.{os.getpid()}"
+            temporary_path = path + ".tmp"
+            with open(temporary_path, "w") as f:
+                for stack, count in self.stacks.items():
+                    f.write(f"{stack} {count}\n")
+            os.replace(temporary_path, path)
+
+
+def start_stack_sampler(config):
+    """
+    Starts sampling this process's stacks if PROFILE_STACKS_FILE is set, and returns the sampler.
+    """
+    if not config["PROFILE_STACKS_FILE"]:
+        return None
+
+    sampler = StackSampler(
+        config["PROFILE_STACKS_FILE"],
+        float(config["PROFILE_STACK_INTERVAL"]),
+        float(config["PROFILE_FLUSH_INTERVAL"]),
+    )
+    sampler.start()
+    return sampler
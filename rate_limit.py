@@ -0,0 +1,247 @@
+import functools
+import math
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+from werkzeug.exceptions import TooManyRequests
+
+from metrics import METRICS
+
+LIMITED_STATUS = "429 TOO MANY REQUESTS"
+LIMITED_BODY = TooManyRequests().get_body().encode("utf-8")
+
+# Budget of the requests that will be redirected, the others are budgeted by their branch
+REDIRECT = "redirect"
+
+
+def client_address(environ, trusted_proxies):
+    """
+    Returns the address of the client that made a request: the entry of X-Forwarded-For added
+    by the outermost of the trusted_proxies in front of the app, or the peer address when
+    there are none. Entries further left are set by the client and can't be trusted.
+    """
+    forwarded_for = environ.get("HTTP_X_FORWARDED_FOR")
+    if trusted_proxies and forwarded_for:
+        addresses = forwarded_for.split(",")
+        return addresses[-min(trusted_proxies, len(addresses))].strip()
+    return environ.get("REMOTE_ADDR", "")
+
+
+class RedisBackend:
+    """
+    Just enough of a Redis client for the rate limiter: pipelines of commands with integer
+    replies, over one connection that is reopened after a failure. Works with Redis itself or
+    rate_limit_backend.py, without a client library.
+    """
+
+    def __init__(self, url, timeout=0.5):
+        target = urlsplit(url)
+        self.address = (target.hostname or "127.0.0.1", target.port or 6379)
+        self.timeout = timeout
+        self._socket = None
+        self._file = None
+
+    def execute(self, commands):
+        """
+        Sends commands, each a sequence of arguments, and returns their replies. Raises OSError
+        if the server can't be reached or answers with an error.
+        """
+        payload = b"".join(encode_command(command) for command in commands)
+        try:
+            if self._socket is None:
+                self._socket = socket.create_connection(self.address, self.timeout)
+                self._file = self._socket.makefile("rb")
+            self._socket.sendall(payload)
+            replies = [read_reply(self._file) for _ in commands]
+        except (OSError, ValueError):
+            self.close()
+            raise
+
+        for reply in replies:
+            if isinstance(reply, Exception):
+                raise OSError(f"rate limit backend error: {reply}")
+        return replies
+
+    def close(self):
+        if self._socket is not None:
+            self._file.close()
+            self._socket.close()
+        self._socket = self._file = None
+
+
+def encode_command(arguments):
+    encoded = [str(argument).encode("utf-8") for argument in arguments]
+    return b"".join([b"*%d\r\n" % len(encoded), *(b"$%d\r\n%s\r\n" % (len(value), value) for value in encoded)])
+
+
+def read_reply(stream):
+    """
+    Reads a simple string, error, integer or bulk string reply; errors are returned, not raised.
+    """
+    line = stream.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("the rate limit backend closed the connection")
+
+    kind, value = line[:1], line[1:-2]
+    if kind == b":":
+        return int(value)
+    if kind == b"+":
+        return value.decode("utf-8")
+    if kind == b"-":
+        return ValueError(value.decode("utf-8"))
+    if kind == b"$":
+        length = int(value)
+        return None if length < 0 else stream.read(length + 2)[:-2].decode("utf-8")
+    raise ValueError(f"unexpected reply {line!r}")
+
+
+class RateLimiter:
+    """
+    Per-client sliding window rate limits, with a budget for each kind of response: requests
+    predict_branch(environ) says will get the 410 of an asset or the 400 of a host that isn't
+    served here are budgeted as that branch, the others as REDIRECT. A branch without a budget,
+    like that of robots.txt by default, is never limited. A client over budget gets a 429
+    before its request is resolved, so scanners walking /wp-admin and asset paths across every
+    host stop costing a full resolution once they used up their budgets.
+
+    Each (client, budget) keeps the counts of the current and previous fixed window, and a
+    request is allowed while the previous count, weighted by how much of it still lies in the
+    sliding window, plus the current count is under budget. At most max_keys of them are kept,
+    the least recently seen are forgotten first, so memory is fixed whoever sends requests.
+
+    Counts are per worker, unless there is a backend: then each worker adds the requests it
+    allowed to the backend's counters every sync_interval seconds, from a background thread
+    rather than on every request, and takes up the totals of every worker it gets back.
+    """
+
+    def __init__(self, config, predict_branch, backend=None):
+        self.predict_branch = predict_branch
+        self.enabled = bool(config["RATE_LIMIT_ENABLED"])
+        self.window = float(config["RATE_LIMIT_WINDOW"])
+        self.budgets = {branch: int(budget) for branch, budget in config["RATE_LIMIT_BUDGETS"].items()}
+        self.max_keys = int(config["RATE_LIMIT_MAX_KEYS"])
+        self.trusted_proxies = int(config["RATE_LIMIT_TRUSTED_PROXIES"])
+        self.sync_interval = float(config["RATE_LIMIT_SYNC_INTERVAL"])
+        if backend is None and config["RATE_LIMIT_BACKEND"]:
+            backend = RedisBackend(config["RATE_LIMIT_BACKEND"])
+        self.backend = backend
+
+        # (client, budget) -> [window number, previous count, current count, count not synced yet]
+        self._counts = OrderedDict()
+        self._unsynced = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self.limited_headers = [
+            ("Content-Type", "text/html; charset=utf-8"),
+            ("Content-Length", str(len(LIMITED_BODY))),
+            ("Cache-Control", "no-store"),
+            ("Server", "MoFo Redirector"),
+        ]
+
+    def hit(self, client, branch, now):
+        """
+        Counts a request of a client for a budget and returns 0 if it is allowed, otherwise
+        how many seconds until the client can expect to be allowed again.
+        """
+        budget = self.budgets.get(branch, 0)
+        if not budget:
+            return 0
+
+        window, offset = divmod(now, self.window)
+        key = (client, branch)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [window, 0, 0, 0]
+                if len(self._counts) > self.max_keys:
+                    self._unsynced.discard(self._counts.popitem(last=False)[0])
+            else:
+                self._counts.move_to_end(key)
+                if counts[0] != window:
+                    # Requests of the window that ended and weren't synced yet are only counted here
+                    counts[:] = [window, counts[2] if counts[0] == window - 1 else 0, 0, 0]
+
+            if counts[1] * (1 - offset / self.window) + counts[2] >= budget:
+                return math.ceil(self.window - offset)
+
+            counts[2] += 1
+            if self.backend is not None:
+                counts[3] += 1
+                self._unsynced.add(key)
+        return 0
+
+    def sync(self):
+        """
+        Adds the requests counted since the last sync to the backend, and takes up the totals
+        of every worker. Raises OSError if the backend can't be reached.
+        """
+        with self._lock:
+            batch = []
+            for key in self._unsynced:
+                counts = self._counts[key]
+                batch.append((key, counts[0], counts[3]))
+                counts[3] = 0
+            self._unsynced.clear()
+        if not batch:
+            return
+
+        commands = []
+        expires = math.ceil(self.window * 2)
+        for (client, branch), window, count in batch:
+            name = f"rate_limit:{branch}:{int(window)}:{client}"
+            commands += [("INCRBY", name, count), ("EXPIRE", name, expires)]
+        replies = self.backend.execute(commands)
+
+        with self._lock:
+            for (key, window, _), total in zip(batch, replies[::2]):
+                counts = self._counts.get(key)
+                if counts is not None and counts[0] == window:
+                    counts[2] = max(counts[2], total + counts[3])
+
+    def ensure_syncing(self):
+        """
+        Starts the thread syncing with the backend, once per process.
+        """
+        if self._thread is not None or self.backend is None:
+            return
+
+        self._thread = threading.Thread(target=self._run, name="rate-limit-sync", daemon=True)
+        self._thread.start()
+        os.register_at_fork(after_in_child=self._forget_thread)
+
+    def _forget_thread(self):
+        self._thread = None
+
+    def _run(self):
+        stopped = threading.Event()
+        while not stopped.wait(self.sync_interval):
+            try:
+                self.sync()
+            except OSError:
+                METRICS.increment("rate_limit_backend_errors_total")
+
+    def wsgi(self, application):
+        """
+        Wraps a WSGI application so its requests are rate limited.
+        """
+        if not self.enabled:
+            return application
+
+        @functools.wraps(application)
+        def limited_application(environ, start_response):
+            self.ensure_syncing()
+            branch = self.predict_branch(environ) or REDIRECT
+            retry_after = self.hit(client_address(environ, self.trusted_proxies), branch, time.time())
+            if not retry_after:
+                return application(environ, start_response)
+
+            METRICS.increment("requests_limited_total", (("branch", branch),))
+            start_response(LIMITED_STATUS, [*self.limited_headers, ("Retry-After", str(retry_after))])
+            return [b"" if environ.get("REQUEST_METHOD") == "HEAD" else LIMITED_BODY]
+
+        return limited_application
@@ -0,0 +1,157 @@
+"""
+A stand-in for Redis as the shared RATE_LIMIT_BACKEND, for a single machine or local dev.
+
+    python rate_limit_backend.py [--host 127.0.0.1] [--port 6379]
+
+It speaks enough of the Redis protocol for the rate limiter (PING, GET, INCR, INCRBY, EXPIRE
+and DEL) and keeps its counters in memory, dropping them when they expire. Point the workers
+at it with RATE_LIMIT_BACKEND=redis://127.0.0.1:6379.
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+# Seconds between sweeps for expired counters
+SWEEP_INTERVAL = 10
+
+
+class SimpleString(str):
+    """
+    A status reply, sent as +<value> rather than as a bulk string.
+    """
+
+
+class Counters:
+    """
+    Integer counters with an optional expiry time.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.values = {}
+        self.expires = {}
+
+    def _live(self, key):
+        expires = self.expires.get(key)
+        if expires is not None and expires <= self.clock():
+            self.values.pop(key, None)
+            del self.expires[key]
+        return key in self.values
+
+    def execute(self, command, *arguments):
+        """
+        Runs a command and returns its reply: an int, a str, None or an error.
+        """
+        command = command.upper()
+        try:
+            if command == "PING":
+                return SimpleString("PONG")
+            if command == "GET":
+                (key,) = arguments
+                return str(self.values[key]) if self._live(key) else None
+            if command in ("INCR", "INCRBY"):
+                key, amount = (arguments[0], "1") if command == "INCR" else arguments
+                value = (self.values[key] if self._live(key) else 0) + int(amount)
+                self.values[key] = value
+                return value
+            if command == "EXPIRE":
+                key, seconds = arguments
+                if not self._live(key):
+                    return 0
+                self.expires[key] = self.clock() + int(seconds)
+                return 1
+            if command == "DEL":
+                deleted = 0
+                for key in arguments:
+                    if self._live(key):
+                        del self.values[key]
+                        self.expires.pop(key, None)
+                        deleted += 1
+                return deleted
+        except ValueError:
+            return ValueError(f"ERR wrong arguments for '{command.lower()}' command")
+        return ValueError(f"ERR unknown command '{command.lower()}'")
+
+    def sweep(self):
+        now = self.clock()
+        for key in [key for key, expires in self.expires.items() if expires <= now]:
+            self.values.pop(key, None)
+            del self.expires[key]
+
+
+def encode_reply(reply):
+    if isinstance(reply, Exception):
+        return f"-{reply}\r\n".encode("utf-8")
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, SimpleString):
+        return f"+{reply}\r\n".encode("utf-8")
+    encoded = reply.encode("utf-8")
+    return b"$%d\r\n%s\r\n" % (len(encoded), encoded)
+
+
+async def read_command(reader):
+    """
+    Reads a command sent as an array of bulk strings, or None when the client is gone.
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        # An inline command, as typed into telnet
+        return line.decode("utf-8").split()
+
+    arguments = []
+    for _ in range(int(line[1:])):
+        length = int((await reader.readline())[1:])
+        arguments.append((await reader.readexactly(length + 2))[:-2].decode("utf-8"))
+    return arguments
+
+
+async def serve_client(counters, reader, writer):
+    try:
+        while True:
+            command = await read_command(reader)
+            if command is None:
+                break
+            if command:
+                writer.write(encode_reply(counters.execute(*command)))
+                await writer.drain()
+    except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host, port, counters=None, started=None):
+    counters = counters or Counters()
+    server = await asyncio.start_server(lambda reader, writer: serve_client(counters, reader, writer), host, port)
+    if started is not None:
+        started(server)
+
+    async with server:
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            counters.sweep()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args(argv)
+
+    print(f"rate limit backend listening on {args.host}:{args.port}", file=sys.stderr)
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
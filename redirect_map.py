@@ -0,0 +1,666 @@
+import bisect
+import hashlib
+import mmap
+import os
+import re
+import struct
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from urllib.parse import parse_qsl, unquote, urlencode
+
+# Same shape as the language codes stripped from donate.mozilla.org paths (EX: fr, pt-BR, fy-NL)
+LOCALE_REGEX = re.compile(r"^[a-z]{2}(-[A-Z]{2}|-[A-Z][a-z])?$")
+
+# Locale membership per slug is kept as a bitmask, the template id sits above it
+MAX_LOCALES = 32
+TEMPLATE_SHIFT = MAX_LOCALES
+# What a LocaleIndex holds for a key whose entry hasn't been looked up yet
+UNBUILT = object()
+
+
+# A leading locale once lowercased, and runs of slashes
+LOWERCASED_LOCALE_REGEX = re.compile(r"^/[a-z]{2}-[a-z]{2}(?=/|$)")
+REPEATED_SLASHES_REGEX = re.compile(r"//+")
+
+
+def canonical_key(key):
+    """
+    Returns the canonical form of a redirect key, or of a request path and query string joined
+    by ?: percent-decoded, lowercased apart from the region of a leading locale (/pt-BR/),
+    without repeated or trailing slashes, and with its query parameters sorted.
+    """
+    path, _, query = key.partition("?")
+    if "%" in path:
+        path = unquote(path)
+    if "//" in path:
+        path = REPEATED_SLASHES_REGEX.sub("/", path)
+    path = path.rstrip("/").lower() or "/"
+    if path[3:4] == "-" and LOWERCASED_LOCALE_REGEX.match(path):
+        path = path[:4] + path[4:6].upper() + path[6:]
+
+    if query:
+        return path + "?" + canonical_query(query)
+    return path
+
+
+def canonical_query(query_string):
+    return urlencode(sorted(parse_qsl(query_string, keep_blank_values=True)))
+
+
+def canonical_path(key):
+    """
+    Returns the path of a redirect key without its query string and trailing slashes, which is
+    the same for every candidate key lookup_keyvalue_redirect() tries for a request. It's the
+    path of a canonical key as it is.
+    """
+    return key.partition("?")[0].rstrip("/") or "/"
+
+
+def filtered_paths(keys):
+    paths = set()
+    for key in keys:
+        paths.add(canonical_path(key))
+        # Keys with a query string are only looked up when the filter has them as they are
+        if "?" in key:
+            paths.add(key)
+    return paths
+
+
+class KeyFilter(frozenset):
+    """
+    The canonical paths of a redirect map's keys, so a request whose path isn't in the map can
+    be turned away with a single set lookup, for the price of a set entry per path. It is
+    immutable: with_keys() returns a filter that also has some keys.
+    """
+
+    def __new__(cls, keys):
+        return super().__new__(cls, filtered_paths(keys))
+
+    def with_keys(self, keys):
+        """
+        Returns a filter that also has keys written to the map after this one was built. Removed
+        keys aren't taken out, they only let a few more misses through until it is rebuilt.
+        """
+        return frozenset.__new__(KeyFilter, self.union(filtered_paths(keys)))
+
+
+CHECKSUM_MASK = (1 << 64) - 1
+
+
+def entry_checksum(key, redirect_to, is_permanent):
+    data = f"{key}\0{redirect_to}\0{int(bool(is_permanent))}".encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def redirect_map_checksum(entries):
+    """
+    Returns the checksum of a redirect map or export as 16 hex digits: the sum, modulo 2**64,
+    of a hash of each entry under its canonical key. It doesn't depend on the order of the
+    entries, and adding, changing or removing one updates it in constant time. Keys that
+    canonicalize alike count once, with the last entry, like a canonical map stores them.
+    """
+    canonical = {canonical_key(key): entry for key, entry in entries.items()}
+    checksum = 0
+    for key, entry in canonical.items():
+        checksum += entry_checksum(key, entry["redirect_to"], entry.get("is_permanent"))
+    return f"{checksum & CHECKSUM_MASK:016x}"
+
+
+def diff_redirect_maps(old, new):
+    """
+    Returns the delta that turns redirect map or export old into new: the checksums of both,
+    the canonical keys to set with their entries and the canonical keys to remove.
+    """
+    old = {canonical_key(key): entry for key, entry in old.items()}
+    new = {canonical_key(key): entry for key, entry in new.items()}
+
+    changed = {}
+    for key, entry in new.items():
+        entry = {"redirect_to": entry["redirect_to"], "is_permanent": bool(entry.get("is_permanent"))}
+        previous = old.get(key)
+        if previous is None or (previous["redirect_to"], bool(previous.get("is_permanent"))) != (
+            entry["redirect_to"],
+            entry["is_permanent"],
+        ):
+            changed[key] = entry
+
+    return {
+        "base": redirect_map_checksum(old),
+        "checksum": redirect_map_checksum(new),
+        "set": changed,
+        "remove": sorted(key for key in old if key not in new),
+    }
+
+
+def delta_path_for(path):
+    """
+    Where the delta of a JSON redirect export lives, see apply_delta().
+    """
+    return os.path.splitext(path)[0] + ".delta.json"
+
+
+class FilteredKeys:
+    """
+    Gives a canonical redirect map with a version a KeyFilter and a checksum, rebuilt after
+    the map changes or kept up to date by apply_delta(). The map sets a _key_filter_lock.
+    """
+
+    _key_filter = None
+    _key_filter_version = None
+    _checksum = None
+    _checksum_version = None
+
+    @property
+    def key_filter(self):
+        if self._key_filter_version != self.version:
+            # A map being changed by apply_delta() is waited for, rather than filtered half-changed
+            with self._key_filter_lock:
+                version = self.version
+                if self._key_filter_version != version:
+                    self._key_filter = KeyFilter(self)
+                    self._key_filter_version = version
+        return self._key_filter
+
+    @property
+    def checksum(self):
+        """
+        The redirect_map_checksum() of the map.
+        """
+        if self._checksum_version != self.version:
+            self._checksum = int(redirect_map_checksum(self), 16)
+            self._checksum_version = self.version
+        return f"{self._checksum:016x}"
+
+    def apply_delta(self, delta):
+        """
+        Applies a delta from diff_redirect_maps() in place: the checksum is updated in time
+        proportional to its size, and the KeyFilter extended with the keys it sets rather than
+        rebuilt from the map. Raises ValueError, without changing anything, if the map isn't the
+        one the delta was made from or the delta doesn't add up to its checksum.
+        """
+        if self.checksum != delta["base"]:
+            raise ValueError(f"the redirect map has checksum {self.checksum}, the delta is for {delta['base']}")
+
+        checksum = self._checksum
+        removed = [canonical_key(key) for key in delta["remove"]]
+        changed = {canonical_key(key): entry for key, entry in delta["set"].items()}
+        for key in (*removed, *changed):
+            previous = self.get(key)
+            if previous is not None:
+                checksum -= entry_checksum(key, previous["redirect_to"], previous["is_permanent"])
+            elif key not in changed:
+                raise ValueError(f"the delta removes {key!r}, which the redirect map doesn't have")
+        for key, entry in changed.items():
+            checksum += entry_checksum(key, entry["redirect_to"], entry.get("is_permanent"))
+        checksum &= CHECKSUM_MASK
+        if f"{checksum:016x}" != delta["checksum"]:
+            raise ValueError(f"the delta adds up to checksum {checksum:016x} instead of {delta['checksum']}")
+
+        with self._key_filter_lock:
+            if self._key_filter_version == self.version:
+                key_filter = self._key_filter
+            else:
+                key_filter = KeyFilter(self)
+            for key in removed:
+                del self[key]
+            for key, entry in changed.items():
+                self[key] = entry
+            key_filter = key_filter.with_keys(changed)
+
+            # The filter is published before its version, a lookup never pairs it with the old one
+            self._key_filter = key_filter
+            self._key_filter_version = self.version
+            self._checksum = checksum
+            self._checksum_version = self.version
+
+
+class LocaleIndex(FilteredKeys, MutableMapping):
+    """
+    A key/value redirect map that stores locale-prefixed entries once per slug.
+
+    Wagtail exports the same slug under every locale (/fr/foo, /de/foo, ...) with targets
+    that only differ by that locale segment. Those entries are kept as a slug, a bitmask of
+    the locales it exists under and a shared target template; the locale is expanded back
+    into the target when the entry is looked up. Anything that doesn't factor cleanly is
+    kept as an exact entry.
+
+    Entries are read and written as the same {"redirect_to": ..., "is_permanent": ...}
+    dicts found in the JSON export. A flat dict holds every key, with its entry once it has
+    been looked up, and UNBUILT until then. A hit or a miss is one probe of it like of the
+    export, and a hit returns the same dict every time: entries that are read must not be
+    changed. Only the targets of the entries looked up take memory as strings.
+
+    `version` changes on every write, so anything derived from the index can tell when it is
+    stale. A canonical index stores the canonical_key() of the keys written to it, and
+    expects lookups to use canonical keys too.
+    """
+
+    def __init__(self, entries=None, canonical=False):
+        self.version = 0
+        self.canonical = canonical
+        self._key_filter_lock = threading.Lock()
+        self._entries_lock = threading.Lock()
+        self._reset()
+
+        if entries:
+            self.update(entries)
+
+    def _reset(self):
+        self._entries = {}
+        self._exact = {}
+        self._slugs = {}
+        self._locales = []
+        self._locale_bits = {}
+        self._templates = []
+        self._template_ids = {}
+
+    def _split(self, key):
+        """
+        Returns (locale, slug) for a locale-prefixed key, or (None, None).
+        """
+        end = key.find("/", 1)
+        if end == -1 or key[:1] != "/":
+            return None, None
+
+        locale = key[1:end]
+        if locale not in self._locale_bits and not LOCALE_REGEX.match(locale):
+            return None, None
+
+        return locale, key[end:]
+
+    def _locale_bit(self, locale):
+        bit = self._locale_bits.get(locale)
+        if bit is None and len(self._locales) < MAX_LOCALES:
+            bit = 1 << len(self._locales)
+            self._locales.append(locale)
+            self._locale_bits[locale] = bit
+        return bit
+
+    def _template_id(self, locale, redirect_to, is_permanent):
+        marker = "/" + locale + "/"
+        position = redirect_to.find(marker)
+
+        if position == -1:
+            template = (redirect_to, None, is_permanent)
+        else:
+            template = (redirect_to[: position + 1], redirect_to[position + 1 + len(locale):], is_permanent)
+
+        template_id = self._template_ids.get(template)
+        if template_id is None:
+            template_id = len(self._templates)
+            self._templates.append(template)
+            self._template_ids[template] = template_id
+        return template_id
+
+    def _entry(self, key):
+        """
+        Returns (redirect_to, is_permanent) for a key, or None.
+        """
+        end = key.find("/", 1)
+        if end != -1:
+            locale = key[1:end]
+            bit = self._locale_bits.get(locale)
+            if bit is not None:
+                packed = self._slugs.get(key[end:])
+                if packed is not None and packed & bit:
+                    head, tail, is_permanent = self._templates[packed >> TEMPLATE_SHIFT]
+                    if tail is None:
+                        return head, is_permanent
+                    return head + locale + tail, is_permanent
+
+        return self._exact.get(key)
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key, default)
+        if entry is UNBUILT:
+            return self._build(key, default)
+        return entry
+
+    def _build(self, key, default):
+        # Writes hold the lock too, an entry is never built from the index halfway through one
+        with self._entries_lock:
+            entry = self._entries.get(key, default)
+            if entry is UNBUILT:
+                redirect_to, is_permanent = self._entry(key)
+                entry = self._entries[key] = {"redirect_to": redirect_to, "is_permanent": is_permanent}
+        return entry
+
+    def __getitem__(self, key):
+        entry = self.get(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __setitem__(self, key, value):
+        if self.canonical:
+            key = canonical_key(key)
+        with self._entries_lock:
+            self._store(key, value)
+
+    def _store(self, key, value):
+        redirect_to = value["redirect_to"]
+        is_permanent = bool(value.get("is_permanent"))
+
+        if key in self._entries:
+            self._delete(key)
+        self.version += 1
+
+        locale, slug = self._split(key)
+        bit = self._locale_bit(locale) if locale is not None else None
+        self._entries[key] = UNBUILT
+
+        if bit is not None:
+            template_id = self._template_id(locale, redirect_to, is_permanent)
+            packed = self._slugs.get(slug)
+
+            if packed is None:
+                self._slugs[slug] = (template_id << TEMPLATE_SHIFT) | bit
+                return
+
+            if packed >> TEMPLATE_SHIFT == template_id:
+                self._slugs[slug] = packed | bit
+                return
+
+        # Not locale-prefixed, or this locale's target doesn't share the slug's template
+        self._exact[key] = (redirect_to, is_permanent)
+
+    def __delitem__(self, key):
+        if self.canonical:
+            key = canonical_key(key)
+        with self._entries_lock:
+            self._delete(key)
+
+    def _delete(self, key):
+        if key not in self._entries:
+            raise KeyError(key)
+        self.version += 1
+        del self._entries[key]
+
+        if key in self._exact:
+            del self._exact[key]
+            return
+
+        end = key.find("/", 1)
+        slug = key[end:]
+        packed = self._slugs[slug] & ~self._locale_bits[key[1:end]]
+        if packed & ((1 << MAX_LOCALES) - 1):
+            self._slugs[slug] = packed
+        else:
+            del self._slugs[slug]
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def compact(self):
+        """
+        Rebuilds the index without the templates and dict slots left behind by removed entries,
+        and builds its KeyFilter.
+        """
+        with self._entries_lock:
+            entries = {key: self._entry(key) for key in self._entries}
+            version = self.version
+            self._reset()
+
+            for key, (redirect_to, is_permanent) in entries.items():
+                self._store(key, {"redirect_to": redirect_to, "is_permanent": is_permanent})
+            self.version = version + 1
+        self.key_filter
+
+    def clear(self):
+        with self._entries_lock:
+            self.version += 1
+            self._reset()
+
+
+# Compiled redirect map layout, all integers little-endian:
+#   header:    magic, entry count, sparse index stride
+#   key table: one record per entry, sorted by the UTF-8 bytes of the canonical keys
+#   pool:      UTF-8 keys and targets, targets stored once
+COMPILED_MAGIC = b"MOFORDR2"
+COMPILED_HEADER = struct.Struct("<8sII")
+COMPILED_RECORD = struct.Struct("<IIIIB3x")
+PERMANENT_FLAG = 1
+SPARSE_STRIDE = 16
+
+
+def compiled_path_for(path):
+    """
+    Where the compiled form of a JSON redirect export lives.
+    """
+    return os.path.splitext(path)[0] + ".bin"
+
+
+def compile_redirect_map(entries, path):
+    """
+    Writes a key/value redirect map to path in the binary format MappedRedirectMap reads,
+    with its keys in canonical form.
+    """
+    entries = {canonical_key(key): entry for key, entry in entries.items()}
+    keys = sorted(entries, key=lambda key: key.encode("utf-8"))
+    pool = bytearray()
+    pool_offsets = {}
+
+    def intern(value):
+        offset = pool_offsets.get(value)
+        if offset is None:
+            offset = pool_offsets[value] = len(pool)
+            pool.extend(value)
+        return offset
+
+    records = []
+    for key in keys:
+        entry = entries[key]
+        encoded_key = key.encode("utf-8")
+        target = entry["redirect_to"].encode("utf-8")
+        flags = PERMANENT_FLAG if entry.get("is_permanent") else 0
+        target_offset = intern(target)
+        records.append((len(pool), len(encoded_key), target_offset, len(target), flags))
+        pool.extend(encoded_key)
+
+    pool_start = COMPILED_HEADER.size + COMPILED_RECORD.size * len(records)
+
+    with open(path, "wb") as f:
+        f.write(COMPILED_HEADER.pack(COMPILED_MAGIC, len(records), SPARSE_STRIDE))
+        for key_offset, key_length, target_offset, target_length, flags in records:
+            f.write(
+                COMPILED_RECORD.pack(
+                    pool_start + key_offset, key_length, pool_start + target_offset, target_length, flags
+                )
+            )
+        f.write(pool)
+
+
+class MappedRedirectMap(FilteredKeys, MutableMapping):
+    """
+    A key/value redirect map backed by a memory-mapped file written by compile_redirect_map().
+
+    Nothing is unpacked up front: lookups binary search the sorted key table in place,
+    narrowed down by a small in-memory index of every SPARSE_STRIDE-th key. Every worker
+    maps the same file, so the data lives once in the OS page cache. Its keys are canonical.
+
+    The file itself is never written: writes, such as those of apply_delta(), go to a small
+    in-memory overlay of set entries and removed keys (None) that lookups check first, and
+    bump `version` like LocaleIndex's do.
+    """
+
+    canonical = True
+
+    def __init__(self, path):
+        self.version = 0
+        self._overlay = {}
+        self._key_filter_lock = threading.Lock()
+        with open(path, "rb") as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self._size, self._stride = COMPILED_HEADER.unpack_from(self._buffer, 0)
+        if magic != COMPILED_MAGIC:
+            raise ValueError(f"{path} is not a compiled redirect map of this version")
+
+        self._sparse_keys = [self._key(position) for position in range(0, self._size, self._stride)]
+
+    def _record(self, position):
+        return COMPILED_RECORD.unpack_from(self._buffer, COMPILED_HEADER.size + position * COMPILED_RECORD.size)
+
+    def _key(self, position):
+        key_offset, key_length, _, _, _ = self._record(position)
+        return self._buffer[key_offset: key_offset + key_length]
+
+    def _find(self, key):
+        """
+        Returns the position of a key in the key table, or None.
+        """
+        encoded = key.encode("utf-8")
+        block = bisect.bisect_right(self._sparse_keys, encoded) - 1
+        if block < 0:
+            return None
+
+        low = block * self._stride
+        high = min(low + self._stride, self._size)
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < encoded:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low < self._size and self._key(low) == encoded:
+            return low
+        return None
+
+    def get(self, key, default=None):
+        if self._overlay and key in self._overlay:
+            entry = self._overlay[key]
+            return default if entry is None else dict(entry)
+
+        position = self._find(key)
+        if position is None:
+            return default
+
+        _, _, target_offset, target_length, flags = self._record(position)
+        return {
+            "redirect_to": self._buffer[target_offset: target_offset + target_length].decode("utf-8"),
+            "is_permanent": bool(flags & PERMANENT_FLAG),
+        }
+
+    def __getitem__(self, key):
+        entry = self.get(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry
+
+    def __contains__(self, key):
+        if self._overlay and key in self._overlay:
+            return self._overlay[key] is not None
+        return self._find(key) is not None
+
+    def __setitem__(self, key, value):
+        key = canonical_key(key)
+        self._overlay[key] = {"redirect_to": value["redirect_to"], "is_permanent": bool(value.get("is_permanent"))}
+        self.version += 1
+
+    def __delitem__(self, key):
+        key = canonical_key(key)
+        if key not in self:
+            raise KeyError(key)
+        self._overlay[key] = None
+        self.version += 1
+
+    def __iter__(self):
+        for position in range(self._size):
+            key = self._key(position).decode("utf-8")
+            if key not in self._overlay:
+                yield key
+
+        for key, entry in self._overlay.items():
+            if entry is not None:
+                yield key
+
+    def __len__(self):
+        if not self._overlay:
+            return self._size
+        compiled = sum(self._find(key) is not None for key in self._overlay)
+        return self._size - compiled + sum(entry is not None for entry in self._overlay.values())
+
+    def clear(self):
+        """
+        Drops every entry at once: the mapped key table is treated as empty rather than each
+        of its keys being removed through the overlay.
+        """
+        self._size = 0
+        self._sparse_keys = []
+        self._overlay = {}
+        self.version += 1
+
+    def compact(self):
+        """
+        Nothing to compact, the map lives in the page cache. Builds its KeyFilter.
+        """
+        self.key_filter
+
+
+class RedirectMapStore:
+    """
+    Key/value redirect maps loaded by load(path) on their first use, keyed by export path.
+
+    With a budget, the least recently used maps are dropped once the exports of the loaded
+    maps add up to more than budget bytes, and loaded again on their next use. The map in use
+    is never dropped, so a single export larger than the budget still gets served.
+    """
+
+    def __init__(self, load, budget=0):
+        self.load = load
+        self.budget = budget
+        self.loads = 0
+        self.evictions = 0
+        self._maps = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        redirect_map = self._maps.get(path)
+        if redirect_map is None:
+            return self._load(path)
+
+        if self.budget:
+            with self._lock:
+                if path in self._maps:
+                    self._maps.move_to_end(path)
+        return redirect_map
+
+    def _load(self, path):
+        redirect_map = self.load(path)
+        size = 0
+        for candidate in (path, compiled_path_for(path)):
+            if os.path.exists(candidate):
+                size = os.path.getsize(candidate)
+                break
+
+        with self._lock:
+            self._maps[path] = redirect_map
+            self._sizes[path] = size
+            self.loads += 1
+            while self.budget and len(self._maps) > 1 and sum(self._sizes.values()) > self.budget:
+                evicted, _ = self._maps.popitem(last=False)
+                del self._sizes[evicted]
+                self.evictions += 1
+
+        return redirect_map
+
+    def compact(self):
+        for redirect_map in list(self._maps.values()):
+            redirect_map.compact()
+
+    def clear(self):
+        with self._lock:
+            self._maps.clear()
+            self._sizes.clear()
+
+    def __len__(self):
+        return len(self._maps)
@@ -0,0 +1,68 @@
+import os
+import signal
+import threading
+
+
+class FileWatcher:
+    """
+    Polls the modification times of a set of files from a background thread and calls
+    on_change with the list of those that changed whenever one of them does.
+
+    Threads don't survive a fork, so ensure_running() is cheap enough to call on every
+    request: it only starts the thread the first time it is called in a process.
+    """
+
+    def __init__(self, paths, interval, on_change):
+        self.paths = paths
+        self.interval = interval
+        self.on_change = on_change
+        self._thread = None
+        self._mtimes = self._read_mtimes()
+
+    def _forget_thread(self):
+        self._thread = None
+
+    def _read_mtimes(self):
+        mtimes = []
+        for path in self.paths:
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                mtimes.append(None)
+        return mtimes
+
+    def ensure_running(self):
+        if self._thread is not None or not self.interval:
+            return
+
+        self._thread = threading.Thread(target=self._run, name="redirect-map-watcher", daemon=True)
+        self._thread.start()
+        os.register_at_fork(after_in_child=self._forget_thread)
+
+    def poll(self):
+        """
+        Calls on_change if any watched file changed since the last poll.
+        """
+        mtimes = self._read_mtimes()
+        if mtimes != self._mtimes:
+            changed = [path for path, old, new in zip(self.paths, self._mtimes, mtimes) if old != new]
+            self._mtimes = mtimes
+            self.on_change(changed)
+
+    def _run(self):
+        stopped = threading.Event()
+        while not stopped.wait(self.interval):
+            self.poll()
+
+
+def install_reload_signal(reload, signum=signal.SIGHUP):
+    """
+    Reloads from a background thread when the process receives signum, so the signal
+    handler doesn't stall a request that is being served.
+    """
+
+    def handler(received, frame):
+        threading.Thread(target=reload, name="redirect-map-reload", daemon=True).start()
+
+    signal.signal(signum, handler)
+    signal.siginterrupt(signum, False)
@@ -0,0 +1,129 @@
+"""
+Resolves a list of URLs the way the redirector would, without going through HTTP, for link audits.
+
+    python resolve_urls.py [urls.txt] [--output results.jsonl] [--workers N]
+
+Reads one URL per line from the file, or from stdin when it's missing or -, and writes a JSON
+line for each URL, in input order, as soon as it is resolved:
+
+    {"url": "https://foundation.mozilla.org/about", "host": "foundation.mozilla.org", "status": 301,
+     "location": "https://www.mozillafoundation.org/en/who-we-are/", "branch": "kv", "matched": "/about"}
+
+URLs without a scheme are taken as they would be requested over HTTPS, lines that aren't URLs
+get an "error". Requests are resolved by the Resolver create_app() uses, for config.py and its
+redirect maps, across a pool of worker processes. A count of each status goes to stderr.
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+from collections import Counter
+from urllib.parse import unquote, urlsplit
+
+import app
+from app import Resolver, load_config, prepare_for_fork
+from rules import normalize_host
+
+# URLs each worker process takes at a time
+CHUNK_SIZE = 256
+# URLs read from the input at a time, the pool reads all it is given up front
+BATCH_SIZE = CHUNK_SIZE * 64
+
+# The worker process's Resolver, set by init_worker()
+resolver = None
+
+
+def init_worker(config):
+    global resolver
+    resolver = Resolver(config)
+
+
+def resolve_url(url):
+    """
+    Resolves a URL with this process's Resolver and returns its result record.
+    """
+    target = urlsplit(url if "://" in url else "https://" + url)
+    host = normalize_host(target.netloc)
+    if not host or target.scheme not in ("http", "https"):
+        return {"url": url, "error": "not an http(s) URL"}
+
+    path = unquote(target.path).lstrip("/")
+    resolution = resolver.resolve(host, path, target.query, app.REDIRECT_MAP)
+    return {
+        "url": url,
+        "host": host,
+        "status": resolution.status,
+        "location": resolution.location,
+        "branch": resolution.branch,
+        "matched": resolution.matched,
+    }
+
+
+def resolve_line(url):
+    """
+    Returns the status and the JSON line of a URL's result record, serialized in the worker so
+    only a string goes back to the parent process.
+    """
+    record = resolve_url(url)
+    return record.get("status", "error"), json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def resolve_urls(urls, config, workers):
+    """
+    Yields (status, JSON line) for each URL, in order, resolving them in workers processes.
+
+    The pool is given BATCH_SIZE URLs at a time, the next batch while the results of the
+    current one are written, so an audit file of any size holds at most two batches in
+    memory and the workers don't wait between batches.
+    """
+    if workers <= 1:
+        init_worker(config)
+        yield from map(resolve_line, urls)
+        return
+
+    # The workers are forked with the redirect maps already loaded, and share them
+    prepare_for_fork()
+    with multiprocessing.get_context("fork").Pool(workers, init_worker, (config,)) as pool:
+        urls = iter(urls)
+        results = None
+        while batch := list(itertools.islice(urls, BATCH_SIZE)):
+            next_results = pool.imap(resolve_line, batch, CHUNK_SIZE)
+            if results is not None:
+                yield from results
+            results = next_results
+        if results is not None:
+            yield from results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", nargs="?", default="-", help="file with one URL per line, - for stdin")
+    parser.add_argument("--output", default="-", help="where to write the JSON lines, - for stdout")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes, 1 resolves inline")
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.input == "-" else open(args.input)
+    output = sys.stdout if args.output == "-" else open(args.output, "w")
+    statuses = Counter()
+
+    try:
+        urls = (line.strip() for line in source if line.strip())
+        for status, line in resolve_urls(urls, load_config(), args.workers):
+            statuses[status] += 1
+            output.write(line)
+    finally:
+        for f in (source, output):
+            if f not in (sys.stdin, sys.stdout):
+                f.close()
+
+    output_name = "stdout" if args.output == "-" else args.output
+    counts = ", ".join(f"{count} {status}" for status, count in sorted(statuses.items(), key=str))
+    print(f"resolved {sum(statuses.values())} URLs to {output_name}: {counts}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
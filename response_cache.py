@@ -0,0 +1,95 @@
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+from werkzeug.utils import redirect
+
+from cache_policy import redirect_etag
+
+
+class RenderedRedirect(NamedTuple):
+    """
+    A redirect response ready to be sent: its status, Location header and encoded HTML body,
+    the Resolution it was rendered from and its ETag.
+    """
+
+    status: int
+    location: str
+    body: bytes
+    resolution: tuple = None
+    etag: str = None
+
+
+def render_redirect(location, status, resolution=None):
+    """
+    Renders a redirect the way flask.redirect() does.
+    """
+    response = redirect(location, code=status)
+    location = response.headers["Location"]
+    return RenderedRedirect(status, location, response.get_data(), resolution, redirect_etag(status, location))
+
+
+class ResponseCache:
+    """
+    A bounded LRU cache of rendered redirects, keyed by (normalized host, path, query string).
+
+    Cached redirects are only valid for the redirect map they were resolved against; the
+    cache empties itself as soon as it sees a different map or a newer version of the same one.
+    A maxsize of 0 disables caching.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._source = None
+        self._source_version = None
+
+    def get(self, key, redirect_map):
+        """
+        Returns the cached RenderedRedirect for a key, or None.
+        """
+        if not self.maxsize:
+            return None
+
+        version = getattr(redirect_map, "version", None)
+
+        with self._lock:
+            if redirect_map is not self._source or version != self._source_version:
+                self._entries.clear()
+                self._source = redirect_map
+                self._source_version = version
+
+            rendered = self._entries.get(key)
+            if rendered is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return rendered
+
+    def put(self, key, rendered, redirect_map):
+        """
+        Caches a RenderedRedirect resolved against redirect_map, unless the map changed meanwhile.
+        """
+        if not self.maxsize:
+            return
+
+        with self._lock:
+            if redirect_map is not self._source or getattr(redirect_map, "version", None) != self._source_version:
+                return
+
+            self._entries[key] = rendered
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
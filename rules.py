@@ -0,0 +1,146 @@
+from dataclasses import dataclass
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+# Branches a host can be dispatched to
+KEYVALUE = "kv"
+DONATE = "donate"
+RULE = "rule"
+PATTERN = "pattern"
+# Requests that are answered without a redirect
+ASSET = "asset"
+UNMATCHED = "unmatched"
+ROBOTS = "robots"
+
+
+@dataclass(frozen=True, slots=True)
+class HostRule:
+    """
+    A REDIRECT_RULES entry with its target split up front, so a redirect can be built
+    without parsing the target again.
+    """
+
+    host: str
+    origin: str
+    path: str
+    query: str
+    status_code: int
+    preserve_path: bool
+    preserve_query: bool
+    location: str
+
+    def build(self, path, query_string):
+        """
+        Returns the redirect URL for a request path (without leading slash) and its raw query string.
+        """
+        if not self.preserve_path and not self.preserve_query:
+            return self.location
+
+        redirect_path = path if self.preserve_path else self.path
+        if redirect_path and redirect_path[0] != "/":
+            redirect_path = "/" + redirect_path
+
+        redirect_query = preserved_query(query_string) if self.preserve_query else self.query
+
+        if redirect_query:
+            return self.origin + redirect_path + "?" + redirect_query
+        return self.origin + redirect_path
+
+
+def preserved_query(query_string):
+    """
+    Re-encodes a query string the way urlencode(request.args, doseq=True) does, keeping
+    the first value of each parameter.
+    """
+    args = {}
+    for key, value in parse_qsl(query_string, keep_blank_values=True):
+        args.setdefault(key, value)
+    return urlencode(args, doseq=True)
+
+
+def compile_rule(host, rule):
+    """
+    Compiles a REDIRECT_RULES value, see config.py for its layout.
+    """
+    redirect_target, redirect_code, preserves = rule
+    preserve_path, preserve_query = preserves
+
+    target_url = urlparse(redirect_target)
+    origin = f"{target_url.scheme}://{target_url.netloc}"
+
+    path = target_url.path
+    if path and path[0] != "/":
+        path = "/" + path
+
+    location = origin + path
+    if target_url.query:
+        location += "?" + target_url.query
+
+    return HostRule(
+        host=host,
+        origin=origin,
+        path=path,
+        query=target_url.query,
+        status_code=redirect_code.value,
+        preserve_path=preserve_path,
+        preserve_query=preserve_query,
+        location=location,
+    )
+
+
+def compile_rules(redirect_rules):
+    """
+    Compiles Config.REDIRECT_RULES into a dict of host to HostRule.
+    """
+    return {host: compile_rule(host, rule) for host, rule in redirect_rules.items()}
+
+
+@dataclass(frozen=True, slots=True)
+class HostHandler:
+    """
+    What to do with requests for a host: the branch to take, the PatternMatcher of its pattern
+    rules, if any, and the HostRule, if any, to fall back on. keyvalue_path is the export of
+    the host's own key/value map, for hosts that don't use the main one.
+    """
+
+    branch: str
+    rule: HostRule
+    patterns: object = None
+    keyvalue_path: str = None
+
+
+def normalize_host(host):
+    """
+    Lowercases a Host header value and strips its port and trailing dot.
+    """
+    if not host:
+        return ""
+
+    host = host.lower()
+    if host[-1] != "]" and ":" in host:
+        host = host.rpartition(":")[0]
+
+    return host.rstrip(".")
+
+
+def build_host_dispatch(host_rules, keyvalue_hosts=(), donate_hosts=(), pattern_matchers=None, keyvalue_maps=None):
+    """
+    Maps every normalized host the redirector serves to its HostHandler, so a request only needs one lookup.
+    """
+    rules = {normalize_host(host): rule for host, rule in host_rules.items()}
+    dispatch = {host: HostHandler(RULE, rule) for host, rule in rules.items()}
+
+    for branch, hosts in ((KEYVALUE, keyvalue_hosts), (DONATE, donate_hosts)):
+        for host in hosts:
+            host = normalize_host(host)
+            dispatch[host] = HostHandler(branch, rules.get(host))
+
+    for host, path in (keyvalue_maps or {}).items():
+        host = normalize_host(host)
+        dispatch[host] = HostHandler(KEYVALUE, rules.get(host), keyvalue_path=path)
+
+    for host, matcher in (pattern_matchers or {}).items():
+        host = normalize_host(host)
+        handler = dispatch.get(host, HostHandler(RULE, None))
+        dispatch[host] = HostHandler(handler.branch, handler.rule, matcher, handler.keyvalue_path)
+
+    return dispatch
@@ -0,0 +1,84 @@
+import json
+import time
+
+from access_log import AccessLog
+from app import REDIRECT_MAP, Resolution, create_app
+from config import ReturnCodes
+from metrics import METRICS
+
+
+def read_records(path, count, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if path.exists():
+            lines = path.read_text().splitlines()
+            if len(lines) >= count:
+                return [json.loads(line) for line in lines]
+        time.sleep(0.01)
+    raise AssertionError(f"expected {count} access log records in {path}")
+
+
+def test_redirects_are_logged(tmp_path):
+    REDIRECT_MAP.clear()
+    REDIRECT_MAP["/about/trademarks"] = {
+        "redirect_to": "https://www.mozillafoundation.org/en/who-we-are/licensing/",
+        "is_permanent": True,
+    }
+    log_path = tmp_path / "access.log"
+    rules = {"foundation.mozilla.org": ("https://www.mozillafoundation.org", ReturnCodes.PERMANENT, (True, True))}
+
+    app = create_app({"REDIRECT_RULES": rules, "FORCE_SSL": False, "DEBUG": False, "ACCESS_LOG": str(log_path)})
+    test_client = app.test_client()
+    test_client.get("/about/trademarks", headers=[("Host", "foundation.mozilla.org")])
+    test_client.get("/about/trademarks", headers=[("Host", "foundation.mozilla.org")])
+    test_client.get("/style.css", query_string="v=1", headers=[("Host", "scanner.example")])
+
+    first, second, third = read_records(log_path, 3)
+
+    assert first["host"] == "foundation.mozilla.org"
+    assert first["path"] == "/about/trademarks"
+    assert first["key"] == "/about/trademarks"
+    assert first["location"] == "https://www.mozillafoundation.org/en/who-we-are/licensing/"
+    assert first["status"] == 301
+    assert first["branch"] == "kv"
+    assert first["cached"] is False
+    assert second["cached"] is True
+    assert third == {
+        **third,
+        "host": "scanner.example",
+        "path": "/style.css",
+        "query": "v=1",
+        "status": 410,
+        "location": None,
+        "branch": "asset",
+    }
+
+
+def test_full_queue_drops_records(tmp_path, monkeypatch):
+    monkeypatch.setattr(METRICS, "counters", {})
+    access_log = AccessLog(str(tmp_path / "access.log"), queue_size=2)
+    # Keep the writer from draining the queue
+    monkeypatch.setattr(access_log, "ensure_running", lambda: None)
+
+    resolution = Resolution(301, "https://example.com/", "rule", "example.com")
+    for _ in range(5):
+        access_log.log("example.com", "", "", resolution, time.perf_counter(), False)
+
+    assert access_log.dropped == 3
+    assert METRICS.counters[("access_log_dropped_total", ())] == 3
+
+    access_log.drain()
+    assert len((tmp_path / "access.log").read_text().splitlines()) == 2
+
+
+def test_sampling(tmp_path, monkeypatch):
+    access_log = AccessLog(str(tmp_path / "access.log"), sample_rate=0.25)
+    monkeypatch.setattr(access_log, "ensure_running", lambda: None)
+    samples = iter([0.1, 0.5, 0.2, 0.9])
+    monkeypatch.setattr("random.random", lambda: next(samples))
+
+    resolution = Resolution(400, None, "unmatched", None)
+    for _ in range(4):
+        access_log.log("example.com", "", "", resolution, time.perf_counter(), False)
+
+    assert access_log.queue.qsize() == 2
@@ -0,0 +1,68 @@
+import pytest
+
+from admission import SHED_STATUS, AdmissionControl, request_queue_time
+
+CONFIG = {
+    "ADMISSION_MAX_IN_FLIGHT": 4,
+    "ADMISSION_MAX_QUEUE_TIME": 0,
+    "ADMISSION_LOW_PRIORITY_SHARE": 0.5,
+    "ADMISSION_RETRY_AFTER": 5,
+}
+
+
+@pytest.mark.parametrize(
+    "request_start, queue_time",
+    [
+        ("1700000000123", 0.877),
+        ("t=1700000000123456", 0.876544),
+        ("t=1700000000.5", 0.5),
+        ("1700000002000", 0.0),
+        ("", None),
+        ("soon", None),
+    ],
+)
+def test_request_queue_time(request_start, queue_time):
+    assert request_queue_time(request_start, 1700000001.0) == pytest.approx(queue_time)
+
+
+def test_in_flight_limit_sheds_low_priority_first():
+    admission = AdmissionControl(CONFIG, lambda environ: environ["priority"])
+    shed = []
+
+    def start_response(status, headers):
+        shed.append(dict(headers))
+        assert status == SHED_STATUS
+
+    # Each request makes the next one while it is still in flight
+    def application(environ, start_response):
+        if environ["next"] is not None:
+            admitted_application(environ["next"], start_response)
+        return [b""]
+
+    admitted_application = admission.wsgi(application)
+
+    def nested(*priorities):
+        environ = None
+        for priority in reversed(priorities):
+            environ = {"REQUEST_METHOD": "GET", "priority": priority, "next": environ}
+        return environ
+
+    # Low priority requests only get half of the limit
+    admitted_application(nested(False, False, False), start_response)
+    assert len(shed) == 1
+    assert shed[0]["Retry-After"] == "5"
+    assert admission.in_flight == 0
+
+    admitted_application(nested(True, True, False, True, True), start_response)
+    assert len(shed) == 2
+    admitted_application(nested(True, True, True, True, True), start_response)
+    assert len(shed) == 3
+    assert admission.in_flight == 0
+
+
+def test_disabled_admission_control_is_not_installed():
+    def application(environ, start_response):
+        return []
+
+    admission = AdmissionControl({**CONFIG, "ADMISSION_MAX_IN_FLIGHT": 0}, lambda environ: True)
+    assert admission.wsgi(application) is application
@@ -1,6 +1,20 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+from werkzeug.http import HTTP_STATUS_CODES
+from werkzeug.test import Client
+
 from config import ReturnCodes
 
-from app import REDIRECT_MAP, create_app
+import app
+from app import REDIRECT_MAP, RELOAD_STATS, create_app
+from asgi import create_asgi_app
+from fast_app import create_fast_app
+from key_usage import KeyUsage
+from redirect_map import LocaleIndex
 
 
 def assert_redirect(response, expected_status_code, expected_location):
@@ -13,12 +27,68 @@ def assert_robots(response):
     assert response.get_data(as_text=True) == "User-agent: *\n"
 
 
-def client(rules):
-    config = {"REDIRECT_RULES": rules, "FORCE_SSL": False, "DEBUG": False}
-    return create_app(config).test_client()
+def asgi_to_wsgi(asgi_app):
+    """
+    Runs an ASGI app one request at a time, so werkzeug's test Client can drive it.
+    """
+
+    def application(environ, start_response):
+        headers = [
+            (name[5:].replace("_", "-").lower().encode("latin1"), value.encode("latin1"))
+            for name, value in environ.items()
+            if name.startswith("HTTP_")
+        ]
+        scope = {
+            "type": "http",
+            "http_version": "1.1",
+            "method": environ["REQUEST_METHOD"],
+            "scheme": environ["wsgi.url_scheme"],
+            "root_path": environ.get("SCRIPT_NAME", ""),
+            "path": environ["PATH_INFO"].encode("latin1").decode("utf-8", "replace"),
+            "query_string": environ["QUERY_STRING"].encode("latin1"),
+            "headers": headers,
+            "server": (environ["SERVER_NAME"], int(environ["SERVER_PORT"])),
+        }
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(asgi_app(scope, receive, send))
+
+        # ASGI servers pick their own reason phrase, use werkzeug's like the other apps
+        start, *bodies = messages
+        start_response(
+            f"{start['status']} {HTTP_STATUS_CODES[start['status']].upper()}",
+            [(name.decode("latin1"), value.decode("latin1")) for name, value in start["headers"]],
+        )
+        return [b"".join(body["body"] for body in bodies)]
+
+    return application
 
 
-def test_permanent_redirect():
+@pytest.fixture(params=["flask", "wsgi", "asgi"])
+def client(request):
+    """
+    Builds test clients for create_app() and, to check they stay in parity, create_fast_app()
+    and create_asgi_app().
+    """
+
+    def make_client(rules, force_ssl=False, **extra_config):
+        config = {"REDIRECT_RULES": rules, "FORCE_SSL": force_ssl, "DEBUG": False, **extra_config}
+        if request.param == "wsgi":
+            return Client(create_fast_app(config))
+        if request.param == "asgi":
+            return Client(asgi_to_wsgi(create_asgi_app(config)))
+        return create_app(config).test_client()
+
+    return make_client
+
+
+def test_permanent_redirect(client):
     test_client = client({"example.com": ("https://another-example.com", ReturnCodes.PERMANENT, (False, False))})
 
     r = test_client.get("/", headers=[("Host", "example.com")])
@@ -26,7 +96,7 @@ def test_permanent_redirect():
     assert_redirect(r, 301, "https://another-example.com")
 
 
-def test_temporary_redirect():
+def test_temporary_redirect(client):
     test_client = client({"example.com": ("https://another-example.com", ReturnCodes.TEMPORARY, (False, False))})
 
     r = test_client.get("/", headers=[("Host", "example.com")])
@@ -34,7 +104,7 @@ def test_temporary_redirect():
     assert_redirect(r, 307, "https://another-example.com")
 
 
-def test_keep_query():
+def test_keep_query(client):
     test_client = client({"example.com": ("https://another-example.com", ReturnCodes.TEMPORARY, (False, True))})
 
     r = test_client.get("/", headers=[("Host", "example.com")], query_string="such_query=very_value")
@@ -42,7 +112,7 @@ def test_keep_query():
     assert_redirect(r, 307, "https://another-example.com?such_query=very_value")
 
 
-def test_keep_path():
+def test_keep_path(client):
     test_client = client({"example.com": ("https://another-example.com", ReturnCodes.TEMPORARY, (True, False))})
 
     r = test_client.get("/path/", headers=[("Host", "example.com")])
@@ -50,7 +120,7 @@ def test_keep_path():
     assert_redirect(r, 307, "https://another-example.com/path/")
 
 
-def test_keep_path_and_query():
+def test_keep_path_and_query(client):
     test_client = client({"example.com": ("https://another-example.com", ReturnCodes.TEMPORARY, (True, True))})
 
     r = test_client.get("/path/", headers=[("Host", "example.com")], query_string="such_query=very_value")
@@ -58,7 +128,7 @@ def test_keep_path_and_query():
     assert_redirect(r, 307, "https://another-example.com/path/?such_query=very_value")
 
 
-def test_robots():
+def test_robots(client):
     test_client = client({"example.com": ("https://another-example.com", ReturnCodes.TEMPORARY, (True, False))})
 
     r = test_client.get("/robots.txt", headers=[("Host", "example.com")])
@@ -66,7 +136,7 @@ def test_robots():
     assert_robots(r)
 
 
-def test_donate_mozilla_org_redirect_handling():
+def test_donate_mozilla_org_redirect_handling(client):
     """
     Validates redirection logic for donate.mozilla.org, ensuring correct path handling,
     removal of language codes, and preservation of query parameters.
@@ -110,7 +180,7 @@ def test_donate_mozilla_org_redirect_handling():
     assert_redirect(response, 301, "https://www.mozillafoundation.org/donate/")
 
 
-def test_keyvalue_redirect_exact_match():
+def test_keyvalue_redirect_exact_match(client):
     # Inject key/value redirect map for this test
     REDIRECT_MAP.clear()
     REDIRECT_MAP["/about/trademarks"] = {
@@ -124,7 +194,7 @@ def test_keyvalue_redirect_exact_match():
     assert_redirect(response, 301, "https://www.mozillafoundation.org/en/who-we-are/licensing/")
 
 
-def test_keyvalue_redirect_with_query_string():
+def test_keyvalue_redirect_with_query_string(client):
     REDIRECT_MAP.clear()
     REDIRECT_MAP["/about/trademarks/?q=test&utf=a_campaign"] = {
         "redirect_to": "https://www.mozillafoundation.org/en/who-we-are/licensing/?q=test&utf=a_campaign",
@@ -139,3 +209,585 @@ def test_keyvalue_redirect_with_query_string():
     assert_redirect(
         response, 302, "https://www.mozillafoundation.org/en/who-we-are/licensing/?q=test&utf=a_campaign"
     )
+
+
+def test_keyvalue_redirect_matches_canonical_variants(client):
+    REDIRECT_MAP.clear()
+    REDIRECT_MAP["/en/blog/espa%C3%B1ol-en-mozfest"] = {
+        "redirect_to": "https://www.mozillafoundation.org/es/blog/mozfest/",
+        "is_permanent": True,
+    }
+    REDIRECT_MAP["/about/trademarks/?q=test&utf=a_campaign"] = {
+        "redirect_to": "https://www.mozillafoundation.org/en/who-we-are/licensing/?q=test&utf=a_campaign",
+        "is_permanent": False,
+    }
+
+    test_client = client({})
+    headers = [("Host", "foundation.mozilla.org")]
+
+    variants = ("/en/blog/espa%C3%B1ol-en-mozfest", "/en/blog/español-en-mozfest", "/EN//Blog/ESPA%C3%91OL-en-mozfest")
+    for path in variants:
+        response = test_client.get(path, headers=headers)
+        assert_redirect(response, 301, "https://www.mozillafoundation.org/es/blog/mozfest/")
+
+    response = test_client.get("/About//trademarks/", query_string="utf=a_campaign&q=test", headers=headers)
+    assert_redirect(
+        response, 302, "https://www.mozillafoundation.org/en/who-we-are/licensing/?q=test&utf=a_campaign"
+    )
+
+
+def test_get_keyvalue_redirect():
+    redirect_map = LocaleIndex(
+        {"/about/trademarks": {"redirect_to": "https://www.mozillafoundation.org/en/", "is_permanent": True}},
+        canonical=True,
+    )
+
+    response = app.get_keyvalue_redirect("About/trademarks/", "q=1", redirect_map)
+    assert response.status_code == 301
+    assert response.headers["Location"] == "https://www.mozillafoundation.org/en/?q=1"
+    assert app.get_keyvalue_redirect("about/licensing", "", redirect_map) is None
+
+
+def test_caching_headers(client):
+    rules = {
+        "example.com": ("https://another-example.com", ReturnCodes.PERMANENT, (False, False)),
+        "temporary.example.com": ("https://another-example.com", ReturnCodes.TEMPORARY, (False, False)),
+        "fresh.example.com": ("https://another-example.com", ReturnCodes.PERMANENT, (False, False)),
+    }
+    test_client = client(rules, CACHE_HOST_MAX_AGES={"fresh.example.com": 0})
+
+    r = test_client.get("/", headers=[("Host", "example.com")])
+    assert r.headers["Cache-Control"] == "public, max-age=86400"
+    assert r.headers["Vary"] == "Host, X-Forwarded-Host"
+
+    r = test_client.get("/", headers=[("Host", "temporary.example.com")])
+    assert r.headers["Cache-Control"] == "public, max-age=300"
+
+    r = test_client.get("/", headers=[("Host", "fresh.example.com")])
+    assert r.headers["Cache-Control"] == "no-cache"
+
+    r = test_client.get("/script.js", headers=[("Host", "example.com")])
+    assert r.status_code == 410
+    assert r.headers["Cache-Control"] == "public, max-age=86400"
+
+    r = test_client.get("/robots.txt", headers=[("Host", "example.com")])
+    assert r.headers["Cache-Control"] == "public, max-age=86400"
+    assert "Vary" not in r.headers
+
+    r = test_client.get("/", headers=[("Host", "unknown.example.com")])
+    assert r.status_code == 400
+    assert "Cache-Control" not in r.headers
+
+
+def test_conditional_redirect(client):
+    test_client = client({"example.com": ("https://another-example.com", ReturnCodes.PERMANENT, (True, False))})
+
+    r = test_client.get("/page", headers=[("Host", "example.com")])
+    etag = r.headers["ETag"]
+
+    for if_none_match in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+        r = test_client.get("/page", headers=[("Host", "example.com"), ("If-None-Match", if_none_match)])
+        assert r.status_code == 304
+        assert r.get_data() == b""
+        assert r.headers["ETag"] == etag
+        assert r.headers["Cache-Control"] == "public, max-age=86400"
+        assert "Location" not in r.headers
+
+    # Another path redirects elsewhere, so its ETag differs
+    r = test_client.get("/other", headers=[("Host", "example.com"), ("If-None-Match", etag)])
+    assert_redirect(r, 301, "https://another-example.com/other")
+    assert r.headers["ETag"] != etag
+
+
+def test_host_is_normalized(client):
+    test_client = client({"example.com": ("https://another-example.com", ReturnCodes.PERMANENT, (False, False))})
+
+    for host in ("example.com:8080", "EXAMPLE.com", "example.com."):
+        r = test_client.get("/", headers=[("Host", host)])
+        assert_redirect(r, 301, "https://another-example.com")
+
+
+def test_unmatched_host(client):
+    test_client = client({"example.com": ("https://another-example.com", ReturnCodes.PERMANENT, (False, False))})
+
+    r = test_client.get("/", headers=[("Host", "example.com.example")])
+    assert r.status_code == 400
+
+    r = test_client.get("/about/trademarks", headers=[("Host", "foundation.mozilla.org.example")])
+    assert r.status_code == 400
+
+    r = test_client.get("/script.js", headers=[("Host", "not-a-mofo-domain.org")])
+    assert r.status_code == 410
+
+
+def test_response_cache():
+    REDIRECT_MAP.clear()
+    REDIRECT_MAP["/about/trademarks"] = {
+        "redirect_to": "https://www.mozillafoundation.org/en/who-we-are/licensing/",
+        "is_permanent": True,
+    }
+
+    app = create_app(
+        {
+            "REDIRECT_RULES": {
+                "foundation.mozilla.org": ("https://www.mozillafoundation.org", ReturnCodes.PERMANENT, (True, True))
+            },
+            "FORCE_SSL": False,
+            "DEBUG": False,
+            "RESPONSE_CACHE_SIZE": 2,
+        }
+    )
+    response_cache = app.extensions["response_cache"]
+    test_client = app.test_client()
+
+    for _ in range(3):
+        response = test_client.get("/about/trademarks", headers=[("Host", "foundation.mozilla.org")])
+        assert_redirect(response, 301, "https://www.mozillafoundation.org/en/who-we-are/licensing/")
+
+    assert (response_cache.hits, response_cache.misses) == (2, 1)
+
+    # Changing the redirect map drops cached redirects
+    REDIRECT_MAP["/about/trademarks"] = {"redirect_to": "https://www.mozillafoundation.org/en/", "is_permanent": False}
+    response = test_client.get("/about/trademarks", headers=[("Host", "foundation.mozilla.org")])
+    assert_redirect(response, 302, "https://www.mozillafoundation.org/en/")
+
+    for path in ("/one", "/two", "/three"):
+        test_client.get(path, headers=[("Host", "foundation.mozilla.org")])
+
+    assert len(response_cache) == 2
+
+
+def test_force_ssl(client):
+    test_client = client({"example.com": ("https://another-example.com", ReturnCodes.PERMANENT, (True, True))}, True)
+
+    r = test_client.get("/path/", headers=[("Host", "example.com")], query_string="a=b")
+    assert_redirect(r, 301, "https://example.com/path/?a=b")
+
+    r = test_client.get("/path/", headers=[("Host", "example.com"), ("X-Forwarded-Proto", "https")])
+    assert_redirect(r, 301, "https://another-example.com/path/")
+
+
+@pytest.mark.parametrize("create", [create_fast_app, lambda config: asgi_to_wsgi(create_asgi_app(config))])
+def test_fast_app_parity(create):
+    """
+    Compares full responses, headers included, for requests the other tests don't cover.
+    """
+    REDIRECT_MAP.clear()
+    REDIRECT_MAP["/fr/campagnes/été"] = {
+        "redirect_to": "https://www.mozillafoundation.org/fr/été/",
+        "is_permanent": True,
+    }
+
+    config = {
+        "REDIRECT_RULES": {
+            "foundation.mozilla.org": ("https://www.mozillafoundation.org", ReturnCodes.PERMANENT, (True, True)),
+            "example.com": ("https://another-example.com/landing/?utm=1", ReturnCodes.TEMPORARY, (False, False)),
+        },
+        "FORCE_SSL": False,
+        "DEBUG": False,
+    }
+    flask_client = create_app(config).test_client()
+    fast_client = Client(create(config))
+
+    requests = [
+        ("GET", "/fr/campagnes/%C3%A9t%C3%A9", "foundation.mozilla.org", ""),
+        ("GET", "/caf%C3%A9/%ff", "foundation.mozilla.org", "q=%E2%9C%93&q=2"),
+        ("GET", "/deep/path", "example.com", "ignored=1"),
+        ("HEAD", "/deep/path", "example.com", ""),
+        ("POST", "/deep/path", "example.com", ""),
+        ("OPTIONS", "/deep/path", "example.com", ""),
+        ("GET", "/robots.txt", "unknown.example", ""),
+        ("GET", "/__reload", "example.com", ""),
+        ("GET", "/styles.css", "example.com", ""),
+        ("GET", "/", "unknown.example", ""),
+    ]
+
+    for method, path, host, query_string in requests:
+        expected = flask_client.open(path, method=method, headers=[("Host", host)], query_string=query_string)
+        actual = fast_client.open(path, method=method, headers=[("Host", host)], query_string=query_string)
+
+        assert actual.status == expected.status
+        assert actual.get_data() == expected.get_data()
+
+        # Flask doesn't order the methods it allows
+        for response in (actual, expected):
+            if "Allow" in response.headers:
+                response.headers["Allow"] = ", ".join(sorted(response.headers["Allow"].split(", ")))
+
+        # ASGI sends header names lowercased
+        assert sorted((name.lower(), value) for name, value in actual.headers.items()) == sorted(
+            (name.lower(), value) for name, value in expected.headers.items()
+        )
+
+    etag = flask_client.get("/deep/path", headers=[("Host", "example.com")]).headers["ETag"]
+    headers = [("Host", "example.com"), ("If-None-Match", etag)]
+    expected = flask_client.get("/deep/path", headers=headers)
+    actual = fast_client.get("/deep/path", headers=headers)
+    assert actual.status == expected.status
+    assert sorted((name.lower(), value) for name, value in actual.headers.items()) == sorted(
+        (name.lower(), value) for name, value in expected.headers.items()
+    )
+
+
+def test_reload_endpoint(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "REDIRECT_MAP", app.REDIRECT_MAP)
+    export_path = tmp_path / "redirects.json"
+    export_path.write_text(json.dumps({"/old": {"redirect_to": "https://example.com/new/", "is_permanent": True}}))
+
+    rules = {"foundation.mozilla.org": ("https://www.mozillafoundation.org", ReturnCodes.PERMANENT, (True, True))}
+    headers = [("Host", "foundation.mozilla.org")]
+
+    test_client = client(rules)
+    assert test_client.post("/__reload", headers=headers).status_code == 404
+
+    test_client = client(rules, ADMIN_TOKEN="secret", REDIRECT_MAP_PATH=str(export_path))
+    # Only a POST reloads, the path is redirected like any other
+    for method in (test_client.get, test_client.head):
+        assert_redirect(method("/__reload", headers=headers), 301, "https://www.mozillafoundation.org/__reload")
+
+    assert test_client.post("/__reload", headers=[*headers, ("Authorization", "Bearer wrong")]).status_code == 403
+
+    r = test_client.post("/__reload", headers=[*headers, ("Authorization", "Bearer secret")])
+    assert r.status_code == 200
+    assert r.get_json()["entries"] == 1
+
+    r = test_client.get("/old", headers=headers)
+    assert_redirect(r, 301, "https://example.com/new/")
+
+    # A broken export leaves the current map in place
+    failures = RELOAD_STATS["failures"]
+    export_path.write_text(json.dumps({"/old": {"redirect_to": "example.com/new/", "is_permanent": True}}))
+
+    r = test_client.post("/__reload", headers=[*headers, ("Authorization", "Bearer secret")])
+    assert r.status_code == 500
+    assert RELOAD_STATS["failures"] == failures + 1
+
+    r = test_client.get("/old", headers=headers)
+    assert_redirect(r, 301, "https://example.com/new/")
+
+
+def test_flatten_redirects(client):
+    rules = {
+        "give.mozilla.org": ("https://donate.mozilla.org", ReturnCodes.PERMANENT, (True, True)),
+        "donate.mozilla.org": ("https://www.mozillafoundation.org", ReturnCodes.PERMANENT, (True, True)),
+        "old.example.com": ("https://give.mozilla.org/en-US/faq", ReturnCodes.TEMPORARY, (False, False)),
+    }
+
+    test_client = client(rules)
+    r = test_client.get("/en-US/help", headers=[("Host", "give.mozilla.org")])
+    assert_redirect(r, 301, "https://donate.mozilla.org/en-US/help")
+
+    test_client = client(rules, FLATTEN_REDIRECTS=True)
+    r = test_client.get("/en-US/help", headers=[("Host", "give.mozilla.org")])
+    assert_redirect(r, 301, "https://www.mozillafoundation.org/donate/help")
+
+    # A temporary hop makes the whole chain temporary
+    r = test_client.get("/", headers=[("Host", "old.example.com")])
+    assert_redirect(r, 307, "https://www.mozillafoundation.org/donate/faq")
+
+
+def test_redirect_loops_are_rejected():
+    rules = {
+        "a.example.com": ("https://b.example.com", ReturnCodes.PERMANENT, (True, True)),
+        "b.example.com": ("https://a.example.com", ReturnCodes.PERMANENT, (True, True)),
+    }
+    config = {"REDIRECT_RULES": rules, "FORCE_SSL": False, "DEBUG": False, "FLATTEN_REDIRECTS": True}
+
+    with pytest.raises(app.RedirectLoop):
+        create_app(config)
+    with pytest.raises(app.RedirectLoop):
+        create_fast_app(config)
+
+
+def test_metrics_endpoint(client, monkeypatch):
+    monkeypatch.setattr(app.METRICS, "counters", {})
+    monkeypatch.setattr(app.METRICS, "histograms", {})
+    REDIRECT_MAP.clear()
+    REDIRECT_MAP["/about/trademarks"] = {
+        "redirect_to": "https://www.mozillafoundation.org/en/who-we-are/licensing/",
+        "is_permanent": True,
+    }
+    rules = {"foundation.mozilla.org": ("https://www.mozillafoundation.org", ReturnCodes.PERMANENT, (True, True))}
+    headers = [("Host", "foundation.mozilla.org")]
+
+    # Without METRICS_ENABLED the path is just another redirect
+    r = client(rules).get("/__metrics", headers=headers)
+    assert_redirect(r, 301, "https://www.mozillafoundation.org/__metrics")
+
+    test_client = client(rules, METRICS_ENABLED=True)
+    test_client.get("/about/trademarks", headers=headers)
+    test_client.get("/about/trademarks", headers=headers)
+    test_client.get("/elsewhere", headers=headers)
+    test_client.get("/", headers=[("Host", "scanner.example")])
+
+    r = test_client.get("/__metrics")
+    assert r.status_code == 200
+    assert r.headers["Content-Type"].startswith("text/plain")
+    body = r.get_data(as_text=True)
+
+    assert 'mofo_redirector_requests_total{host="foundation.mozilla.org",branch="kv",status="301"} 2' in body
+    assert 'mofo_redirector_requests_total{host="foundation.mozilla.org",branch="rule",status="301"} 1' in body
+    assert 'mofo_redirector_requests_total{host="",branch="unmatched",status="400"} 1' in body
+    assert 'mofo_redirector_keyvalue_lookups_total{host="foundation.mozilla.org",result="hit"} 2' in body
+    assert 'mofo_redirector_keyvalue_lookups_total{host="foundation.mozilla.org",result="miss"} 1' in body
+    assert 'mofo_redirector_response_cache_lookups_total{result="hit"} 1' in body
+    assert 'mofo_redirector_request_duration_seconds_count{branch="kv"} 2' in body
+    assert "mofo_redirector_response_cache_entries 2" in body
+
+    test_client = client(rules, METRICS_ENABLED=True, ADMIN_TOKEN="secret")
+    assert test_client.get("/__metrics").status_code == 403
+    assert test_client.get("/__metrics", headers=[("Authorization", "Bearer secret")]).status_code == 200
+
+
+def test_key_usage_endpoint(client, monkeypatch):
+    monkeypatch.setattr(app, "KEY_USAGE", KeyUsage())
+    entries = {
+        key: {"redirect_to": f"https://www.mozillafoundation.org/en{key}", "is_permanent": True}
+        for key in ("/about/trademarks", "/about/press", "/old/campaign")
+    }
+    monkeypatch.setattr(app, "REDIRECT_MAP", LocaleIndex(entries, canonical=True))
+    rules = {"foundation.mozilla.org": ("https://www.mozillafoundation.org", ReturnCodes.PERMANENT, (True, True))}
+    headers = [("Host", "foundation.mozilla.org")]
+
+    # Without KEY_USAGE_ENABLED the path is just another redirect, and nothing is counted
+    r = client(rules).get("/__key_usage", headers=headers)
+    assert_redirect(r, 301, "https://www.mozillafoundation.org/__key_usage")
+    client(rules).get("/about/press", headers=headers)
+    assert app.KEY_USAGE.hits == 0
+
+    test_client = client(rules, KEY_USAGE_ENABLED=True)
+    test_client.get("/about/trademarks", headers=headers)
+    # Answered from the response cache, still counted
+    test_client.get("/about/trademarks", headers=headers)
+    test_client.get("/About/Trademarks/", headers=headers)
+    test_client.get("/about/press", headers=headers)
+    test_client.get("/elsewhere", headers=headers)
+
+    r = test_client.get("/__key_usage")
+    assert r.status_code == 200
+    assert r.headers["Content-Type"] == "application/json"
+    report = r.get_json()
+    assert report["hits"] == 4
+    assert report["top"] == [{"key": "/about/trademarks", "hits": 3}, {"key": "/about/press", "hits": 1}]
+    assert report["dead"] == ["/old/campaign"]
+
+    test_client = client(rules, KEY_USAGE_ENABLED=True, ADMIN_TOKEN="secret")
+    assert test_client.get("/__key_usage").status_code == 403
+    assert test_client.get("/__key_usage", headers=[("Authorization", "Bearer secret")]).status_code == 200
+
+
+def test_asgi_answers_endpoints_reading_files_in_a_thread(monkeypatch):
+    monkeypatch.setattr(app, "KEY_USAGE", KeyUsage())
+    rules = {"foundation.mozilla.org": ("https://www.mozillafoundation.org", ReturnCodes.PERMANENT, (True, True))}
+    config = {"REDIRECT_RULES": rules, "DEBUG": False, "METRICS_ENABLED": True, "KEY_USAGE_ENABLED": True}
+    asgi_app = create_asgi_app(config)
+
+    threads = {}
+    respond = asgi_app.respond
+
+    def recording_respond(environ):
+        threads[environ["PATH_INFO"]] = threading.current_thread()
+        return respond(environ)
+
+    monkeypatch.setattr(asgi_app, "respond", recording_respond)
+    test_client = Client(asgi_to_wsgi(asgi_app))
+    assert test_client.get("/__metrics").status_code == 200
+    assert test_client.get("/__key_usage").status_code == 200
+    test_client.get("/about", headers=[("Host", "foundation.mozilla.org")])
+
+    # The event loop runs on the thread of the test
+    assert threads["/__metrics"] is not threading.current_thread()
+    assert threads["/__key_usage"] is not threading.current_thread()
+    assert threads["/about"] is threading.current_thread()
+
+
+def test_admission_control_sheds_queued_requests(client, monkeypatch):
+    monkeypatch.setattr(app.METRICS, "counters", {})
+    REDIRECT_MAP.clear()
+    rules = {
+        "foundation.mozilla.org": ("https://www.mozillafoundation.org", ReturnCodes.PERMANENT, (True, True)),
+        "donate.mozilla.org": ("https://www.mozillafoundation.org", ReturnCodes.PERMANENT, (True, True)),
+    }
+    test_client = client(rules, ADMISSION_MAX_QUEUE_TIME=1, ADMISSION_RETRY_AFTER=2)
+
+    def get(path, host, queued):
+        request_start = str(int((time.time() - queued) * 1000))
+        return test_client.get(path, headers=[("Host", host), ("X-Request-Start", request_start)])
+
+    assert_redirect(get("/about", "foundation.mozilla.org", 0.8), 301, "https://www.mozillafoundation.org/about")
+    assert get("/about", "foundation.mozilla.org", 0).status_code == 301
+    assert test_client.get("/about", headers=[("Host", "foundation.mozilla.org")]).status_code == 301
+
+    # Unknown hosts and assets only get half the queue time
+    for path, host in (("/about", "scanner.example"), ("/logo.png", "foundation.mozilla.org")):
+        r = get(path, host, 0.8)
+        assert r.status_code == 503
+        assert r.headers["Retry-After"] == "2"
+        assert r.headers["Cache-Control"] == "no-store"
+        assert r.headers["Server"] == "MoFo Redirector"
+
+    # robots.txt ends like an asset, but crawlers should keep getting it
+    assert_robots(get("/robots.txt", "foundation.mozilla.org", 0.8))
+    # Donate paths are rewritten to /donate/ before the asset check, so these are redirected
+    assert_redirect(get("/en-US/app.js", "donate.mozilla.org", 0.8), 301, "https://www.mozillafoundation.org/donate/")
+
+    assert get("/about", "foundation.mozilla.org", 5).status_code == 503
+    assert app.METRICS.counters == {
+        ("requests_shed_total", (("priority", "low"), ("reason", "queue_time"))): 2,
+        ("requests_shed_total", (("priority", "high"), ("reason", "queue_time"))): 1,
+    }
+
+
+def test_asgi_admission_counts_requests_until_sent():
+    rules = {"foundation.mozilla.org": ("https://www.mozillafoundation.org", ReturnCodes.PERMANENT, (True, True))}
+    asgi_app = create_asgi_app({"REDIRECT_RULES": rules, "DEBUG": False, "ADMISSION_MAX_IN_FLIGHT": 2})
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/about",
+        "query_string": b"",
+        "headers": [(b"host", b"foundation.mozilla.org")],
+    }
+    statuses = {}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def serve_clients():
+        clients_read = asyncio.Event()
+
+        def client(name, slow):
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    statuses[name] = message["status"]
+                elif slow:
+                    await clients_read.wait()
+
+            return asgi_app(scope, receive, send)
+
+        # Two slow clients hold both requests in flight until they read their responses
+        slow_clients = [asyncio.create_task(client(f"slow {number}", True)) for number in range(2)]
+        await asyncio.sleep(0)
+        await client("while held", False)
+        clients_read.set()
+        await asyncio.gather(*slow_clients)
+        await client("after", False)
+
+    asyncio.run(serve_clients())
+    assert statuses == {"slow 0": 301, "slow 1": 301, "while held": 503, "after": 301}
+
+
+def test_rate_limits_scanners(client):
+    rules = {"foundation.mozilla.org": ("https://www.mozillafoundation.org", ReturnCodes.PERMANENT, (True, True))}
+    test_client = client(
+        rules, RATE_LIMIT_ENABLED=True, RATE_LIMIT_BUDGETS={"redirect": 100, "asset": 2, "unmatched": 1}
+    )
+
+    def get(path, host, address="203.0.113.7"):
+        return test_client.get(path, headers=[("Host", host), ("X-Forwarded-For", f"10.0.0.1, {address}")])
+
+    statuses = [get("/wp-includes/js/jquery.js", "foundation.mozilla.org").status_code for _ in range(3)]
+    assert statuses == [410, 410, 429]
+    assert [get("/wp-admin", "scanner.example").status_code for _ in range(2)] == [400, 429]
+
+    r = get("/wp-admin", "scanner.example")
+    assert r.headers["Retry-After"].isdigit()
+    assert r.headers["Cache-Control"] == "no-store"
+    assert r.headers["Server"] == "MoFo Redirector"
+
+    # robots.txt ends like an asset, but crawlers refused it may stop crawling
+    for _ in range(3):
+        assert_robots(get("/robots.txt", "foundation.mozilla.org"))
+
+    # Redirects have their own budget, and other clients theirs
+    assert get("/about", "foundation.mozilla.org").status_code == 301
+    assert get("/wp-admin", "scanner.example", "198.51.100.2").status_code == 400
+
+
+def test_profiled_stages(client, monkeypatch):
+    monkeypatch.setattr(app.METRICS, "counters", {})
+    monkeypatch.setattr(app.METRICS, "histograms", {})
+    REDIRECT_MAP.clear()
+    rules = {"foundation.mozilla.org": ("https://www.mozillafoundation.org", ReturnCodes.PERMANENT, (True, True))}
+
+    headers = [("Host", "foundation.mozilla.org"), ("X-Forwarded-Proto", "https")]
+
+    test_client = client(rules, force_ssl=True, METRICS_ENABLED=True, PROFILE_SAMPLE_RATE=1.0)
+    r = test_client.get("/about/", headers=headers)
+    assert_redirect(r, 301, "https://www.mozillafoundation.org/about/")
+
+    body = test_client.get("/__metrics", headers=headers).get_data(as_text=True)
+    for stage in ("request", "enforce_ssl", "keyvalue", "rule_build", "response_headers"):
+        assert f'mofo_redirector_stage_duration_seconds_count{{stage="{stage}"}} 1' in body
+
+
+def test_pattern_rules(client):
+    REDIRECT_MAP.clear()
+    REDIRECT_MAP["/fr/campaigns/exception"] = {"redirect_to": "https://example.com/exception/", "is_permanent": False}
+    rules = {"foundation.mozilla.org": ("https://www.mozillafoundation.org", ReturnCodes.PERMANENT, (True, True))}
+    pattern_rules = {
+        "foundation.mozilla.org": {
+            "/{locale}/campaigns/*": (
+                "https://www.mozillafoundation.org/{locale}/initiatives/*",
+                ReturnCodes.PERMANENT,
+                True,
+            ),
+        },
+        "campaigns.example.com": {
+            "/*": ("https://www.mozillafoundation.org/en/campaigns/*", ReturnCodes.TEMPORARY, False),
+        },
+    }
+    test_client = client(rules, PATTERN_RULES=pattern_rules)
+    headers = [("Host", "foundation.mozilla.org")]
+
+    r = test_client.get("/de/campaigns/privacy/", headers=headers, query_string="utm=1")
+    assert_redirect(r, 301, "https://www.mozillafoundation.org/de/initiatives/privacy/?utm=1")
+
+    # Key/value redirects come first, the host rule last
+    r = test_client.get("/fr/campaigns/exception", headers=headers)
+    assert_redirect(r, 302, "https://example.com/exception/")
+    r = test_client.get("/de/about/", headers=headers)
+    assert_redirect(r, 301, "https://www.mozillafoundation.org/de/about/")
+
+    # Hosts can have pattern rules alone
+    r = test_client.get("/privacy", headers=[("Host", "campaigns.example.com")])
+    assert_redirect(r, 307, "https://www.mozillafoundation.org/en/campaigns/privacy")
+    r = test_client.get("/script.js", headers=[("Host", "campaigns.example.com")])
+    assert r.status_code == 410
+
+
+def test_per_host_keyvalue_maps(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "REDIRECT_MAP", app.REDIRECT_MAP)
+    app.KEYVALUE_MAPS.clear()
+    REDIRECT_MAP.clear()
+    REDIRECT_MAP["/projects"] = {"redirect_to": "https://www.mozillafoundation.org/en/projects/", "is_permanent": True}
+
+    export_path = tmp_path / "webmaker.json"
+    export_path.write_text(
+        json.dumps({"/projects": {"redirect_to": "https://example.com/webmaker-projects/", "is_permanent": False}})
+    )
+    webmaker = "https://www.mozillafoundation.org/en/artifacts/webmaker/"
+    rules = {"www.webmaker.org": (webmaker, ReturnCodes.PERMANENT, (False, True))}
+    test_client = client(rules, KEYVALUE_MAPS={"www.webmaker.org": str(export_path)})
+    assert len(app.KEYVALUE_MAPS) == 0
+
+    r = test_client.get("/projects", headers=[("Host", "www.webmaker.org")])
+    assert_redirect(r, 302, "https://example.com/webmaker-projects/")
+    assert len(app.KEYVALUE_MAPS) == 1
+
+    r = test_client.get("/elsewhere", headers=[("Host", "www.webmaker.org")], query_string="a=1")
+    assert_redirect(r, 301, "https://www.mozillafoundation.org/en/artifacts/webmaker/?a=1")
+
+    # The main map still serves its own hosts
+    r = test_client.get("/projects", headers=[("Host", "foundation.mozilla.org")])
+    assert_redirect(r, 301, "https://www.mozillafoundation.org/en/projects/")
+
+    # Reloading drops the maps of the other hosts
+    export_path.write_text(
+        json.dumps({"/projects": {"redirect_to": "https://example.com/moved/", "is_permanent": False}})
+    )
+    main_export_path = tmp_path / "main.json"
+    main_export_path.write_text("{}")
+    assert app.reload_redirect_map(str(main_export_path))
+    r = test_client.get("/projects", headers=[("Host", "www.webmaker.org")])
+    assert_redirect(r, 302, "https://example.com/moved/")
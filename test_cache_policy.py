@@ -0,0 +1,22 @@
+from app import load_config
+from cache_policy import CachePolicy, etag_matches, redirect_etag
+
+
+def test_cache_policy_headers():
+    policy = CachePolicy(
+        load_config({"CACHE_TEMPORARY_MAX_AGE": -1, "CACHE_VARY": "", "CACHE_HOST_MAX_AGES": {"Example.com.": 60}})
+    )
+
+    assert policy.headers(301, "other.example") == (("Cache-Control", "public, max-age=86400"),)
+    assert policy.headers(307, "other.example") == ()
+    assert policy.headers(307, "example.com") == (("Cache-Control", "public, max-age=60"),)
+    assert policy.headers(400, "other.example") == ()
+
+
+def test_etag_matches():
+    etag = redirect_etag(301, "https://example.com/")
+
+    assert etag != redirect_etag(302, "https://example.com/")
+    assert etag_matches(f'W/{etag}, "other"', etag)
+    assert not etag_matches('"other"', etag)
+    assert not etag_matches(None, etag)
@@ -0,0 +1,200 @@
+import json
+import re
+import shutil
+import subprocess
+
+import pytest
+
+from config import Config, ReturnCodes
+
+import app
+from app import load_config
+from export_edge_maps import (
+    FORMATS,
+    build_edge_table,
+    main,
+    nginx_hash_builds,
+    nginx_hash_elements,
+    render_nginx,
+    verify_readback,
+)
+from redirect_map import LocaleIndex
+
+RULES = {
+    "static.example.com": ("https://www.example.org/landing/", ReturnCodes.PERMANENT, (False, False)),
+    "path.example.com": ("https://www.example.org", ReturnCodes.TEMPORARY, (True, True)),
+    "query.example.com": ("https://www.example.org/search?from=query", ReturnCodes.PERMANENT, (True, False)),
+    "foundation.mozilla.org": ("https://www.mozillafoundation.org", ReturnCodes.PERMANENT, (True, True)),
+    "donate.mozilla.org": ("https://www.mozillafoundation.org", ReturnCodes.PERMANENT, (True, True)),
+}
+ENTRIES = {
+    "/en/about": {"redirect_to": "https://www.mozillafoundation.org/en/who-we-are/", "is_permanent": True},
+    "/pt-BR/blog/espa%C3%B1ol/": {"redirect_to": "https://www.mozillafoundation.org/es/blog/", "is_permanent": False},
+    "/campaigns/old?utm=a": {"redirect_to": "https://www.mozillafoundation.org/campaigns/a/", "is_permanent": True},
+    "/campaigns/old": {"redirect_to": "https://www.mozillafoundation.org/campaigns/new/?ref=a", "is_permanent": True},
+}
+
+
+# Proxies answering from the exports in front of the redirector, for nginx -t and haproxy -c
+NGINX_CONF = """
+pid nginx.pid;
+events {}
+http {
+    include mofo_redirects.maps.conf;
+    server {
+        listen 127.0.0.1:8080;
+        include mofo_redirects.server.conf;
+        location / {
+            proxy_pass http://127.0.0.1:8000;
+        }
+    }
+}
+"""
+HAPROXY_CFG = """
+defaults
+    mode http
+    timeout connect 1s
+    timeout client 1s
+    timeout server 1s
+
+frontend edge
+    bind 127.0.0.1:8080
+    http-request set-var(txn.mofo_host) req.hdr(host),lower,map_str({directory}/mofo_hosts.map)
+    http-request set-var(txn.mofo_route) base,url_dec,map_reg({directory}/mofo_routes.map)
+    http-request set-var(txn.mofo_keyvalue) base,url_dec,lower,map_str({directory}/mofo_keyvalue.map)
+    default_backend redirector
+
+backend redirector
+    server redirector 127.0.0.1:8000
+"""
+
+
+@pytest.fixture
+def config(monkeypatch):
+    monkeypatch.setattr(app, "REDIRECT_MAP", LocaleIndex(ENTRIES, canonical=True))
+    return load_config({"REDIRECT_RULES": RULES, "FORCE_SSL": False, "DEBUG": False})
+
+
+@pytest.fixture
+def export_config(monkeypatch):
+    """
+    The configuration the app serves, with the whole Wagtail export.
+    """
+    with open("foundation.mozilla.org_wagtail_redirects.json") as f:
+        monkeypatch.setattr(app, "REDIRECT_MAP", LocaleIndex(json.load(f), canonical=True))
+    return load_config({"FORCE_SSL": False, "DEBUG": False})
+
+
+def test_exports_answer_like_create_app(config):
+    table = build_edge_table(config, app.REDIRECT_MAP)
+    files_by_format = {name: render(table) for name, (render, _) in FORMATS.items()}
+
+    reports = verify_readback(config, files_by_format)
+
+    for report in reports.values():
+        assert report["mismatches"] == []
+        assert report["answered"] > report["requests"] // 2
+
+
+def test_edge_table_answers(config):
+    table = build_edge_table(config, app.REDIRECT_MAP)
+
+    assert table.resolve("static.example.com", "/any/path", "a=b") == (301, "https://www.example.org/landing/")
+    assert table.resolve("path.example.com", "/a/b", "c=d") == (307, "https://www.example.org/a/b?c=d")
+    assert table.resolve("query.example.com", "/a", "c=d") == (301, "https://www.example.org/a?from=query")
+    assert table.resolve("static.example.com", "/logo.png", "") == (410, None)
+    assert table.resolve("donate.mozilla.org", "/fr/faq/", "a=b") == (
+        301,
+        "https://www.mozillafoundation.org/donate/faq?a=b",
+    )
+    assert table.resolve("donate.mozilla.org", "/logo.png", "") == (301, "https://www.mozillafoundation.org/donate/")
+    assert table.resolve("foundation.mozilla.org", "/EN//About/", "") == (
+        301,
+        "https://www.mozillafoundation.org/en/who-we-are/",
+    )
+    assert table.resolve("foundation.mozilla.org", "/pt-br/blog/espa%C3%B1ol", "x=1") == (
+        302,
+        "https://www.mozillafoundation.org/es/blog/?x=1",
+    )
+
+
+def test_edge_table_leaves_the_rest_to_the_origin(config):
+    config["PATTERN_RULES"] = {
+        "path.example.com": {"/{locale}/old/*": ("https://www.example.org/{locale}/*", ReturnCodes.PERMANENT, True)}
+    }
+    config["FLATTEN_REDIRECTS"] = True
+    config["REDIRECT_RULES"] = {
+        **RULES,
+        "static.example.com": ("https://path.example.com/", ReturnCodes.PERMANENT, (False, False)),
+    }
+    table = build_edge_table(config, app.REDIRECT_MAP)
+
+    # A key/value miss, a path with a key for a query string, pattern rules, a redirect to be flattened
+    assert table.resolve("foundation.mozilla.org", "/not/a/key", "") is None
+    assert table.resolve("foundation.mozilla.org", "/campaigns/old", "") is None
+    assert table.resolve("path.example.com", "/en/old/page", "") is None
+    assert table.resolve("static.example.com", "/", "") is None
+    assert table.resolve("unknown.example.com", "/", "") is None
+
+
+def test_verify_reports_differences(config):
+    table = build_edge_table(config, app.REDIRECT_MAP)
+    files = FORMATS["haproxy"][0](table)
+    files["mofo_keyvalue.map"] = files["mofo_keyvalue.map"].replace(" 301 ", " 302 ")
+
+    mismatches = verify_readback(config, {"haproxy": files})["haproxy"]["mismatches"]
+
+    assert {mismatch["path"] for mismatch in mismatches} == {"/en/about"}
+
+
+def test_main_finds_export_from_any_directory(monkeypatch, tmp_path, capsys):
+    monkeypatch.setattr(app, "REDIRECT_MAP", app.REDIRECT_MAP)
+    monkeypatch.chdir(tmp_path)
+
+    assert main([str(tmp_path / "edge"), "--format", "cdn"]) == 0
+    assert " 0 key/value paths" not in capsys.readouterr().err
+
+    monkeypatch.setattr(Config, "REDIRECT_MAP_PATH", "missing_redirects.json")
+    assert main([str(tmp_path / "edge"), "--format", "cdn"]) == 1
+    assert "missing_redirects.json is missing or empty" in capsys.readouterr().err
+
+
+def test_nginx_maps_are_sized_for_the_keys(export_config):
+    table = build_edge_table(export_config, app.REDIRECT_MAP)
+    maps = render_nginx(table)["mofo_redirects.maps.conf"]
+    bucket_size = int(re.search(r"^map_hash_bucket_size (\d+);$", maps, re.M).group(1))
+    max_size = int(re.search(r"^map_hash_max_size (\d+);$", maps, re.M).group(1))
+
+    # nginx's defaults can't hash the key/value map
+    elements = nginx_hash_elements(table.keys)
+    assert len(elements) > 7000
+    assert not nginx_hash_builds(elements, 64, 2048)
+    assert nginx_hash_builds(elements, bucket_size, max_size)
+    assert max_size >= len(elements)
+
+
+def write_export(config, name, directory):
+    files = FORMATS[name][0](build_edge_table(config, app.REDIRECT_MAP))
+    for file_name, contents in files.items():
+        (directory / file_name).write_text(contents)
+
+
+@pytest.mark.skipif(shutil.which("nginx") is None, reason="nginx isn't installed")
+def test_nginx_loads_export(export_config, tmp_path):
+    write_export(export_config, "nginx", tmp_path)
+    (tmp_path / "nginx.conf").write_text(NGINX_CONF)
+
+    command = ["nginx", "-t", "-p", str(tmp_path), "-c", str(tmp_path / "nginx.conf"), "-e", "stderr"]
+    result = subprocess.run(command, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    # nginx still loads a map it can't size as asked, with a warning
+    assert "could not build" not in result.stderr
+
+
+@pytest.mark.skipif(shutil.which("haproxy") is None, reason="HAProxy isn't installed")
+def test_haproxy_loads_export(export_config, tmp_path):
+    write_export(export_config, "haproxy", tmp_path)
+    (tmp_path / "haproxy.cfg").write_text(HAPROXY_CFG.format(directory=tmp_path))
+
+    result = subprocess.run(["haproxy", "-c", "-f", str(tmp_path / "haproxy.cfg")], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,28 @@
+from config import ReturnCodes
+
+from app import load_config
+from flatten_redirects import analyze
+
+
+def test_analyze_flattens_chains_and_reports_loops():
+    config = load_config(
+        {
+            "REDIRECT_RULES": {
+                "foundation.mozilla.org": ("https://www.mozillafoundation.org", ReturnCodes.PERMANENT, (True, True)),
+            },
+        }
+    )
+    entries = {
+        "/old": {"redirect_to": "https://foundation.mozilla.org/newer", "is_permanent": False},
+        "/newer": {"redirect_to": "https://foundation.mozilla.org/newest/", "is_permanent": True},
+        "/newest": {"redirect_to": "https://www.mozillafoundation.org/en/newest/", "is_permanent": True},
+        "/ping": {"redirect_to": "https://foundation.mozilla.org/pong", "is_permanent": True},
+        "/pong": {"redirect_to": "https://foundation.mozilla.org/ping", "is_permanent": True},
+    }
+
+    report, flattened = analyze(entries, config)
+
+    assert flattened["/old"] == {"redirect_to": "https://www.mozillafoundation.org/en/newest/", "is_permanent": False}
+    assert flattened["/newer"] == {"redirect_to": "https://www.mozillafoundation.org/en/newest/", "is_permanent": True}
+    assert flattened["/ping"] == entries["/ping"]
+    assert {loop["key"] for loop in report["loops"]} == {"/ping", "/pong"}
@@ -0,0 +1,64 @@
+import json
+
+from key_usage import KeyUsage, key_usage_report
+from redirect_map import LocaleIndex
+
+
+def test_sketch_never_underestimates_and_ranks_hot_keys():
+    key_usage = KeyUsage(width=1024, top_size=10)
+    counts = {f"/page/{number}": 1 + 1000 // (number + 1) for number in range(2000)}
+    for key, count in counts.items():
+        for _ in range(count):
+            key_usage.record(key)
+
+    assert key_usage.hits == sum(counts.values())
+    errors = [key_usage.estimate(key) - count for key, count in counts.items()]
+    assert min(errors) >= 0
+    assert sum(errors) / len(errors) < key_usage.hits * 2.72 / 1024
+
+    assert [key for key, _ in key_usage.hottest(5)] == [f"/page/{number}" for number in range(5)]
+    assert key_usage.estimate("/never/requested") <= max(errors)
+
+
+def test_snapshot_merges_processes(tmp_path):
+    worker = KeyUsage()
+    worker.configure(str(tmp_path))
+    for _ in range(3):
+        worker.record("/en/about")
+    worker.record("/fr/about")
+    worker.flush()
+
+    # Pretend the counts came from other workers
+    (tmp_path / "1.json").write_text(next(tmp_path.glob("*.json")).read_text())
+    other = KeyUsage(width=16)
+    other.record("/en/about")
+    (tmp_path / "2.json").write_text(json.dumps(other._local_snapshot()))
+    (tmp_path / "3.json").write_text("not json")
+
+    merged = worker.snapshot()
+    assert merged.hits == 8
+    assert merged.hottest() == [("/en/about", 6), ("/fr/about", 2)]
+    # The live counts aren't touched
+    assert worker.hits == 4
+
+
+def test_key_usage_report_lists_dead_keys():
+    redirect_map = LocaleIndex(
+        {
+            key: {"redirect_to": f"https://example.com{key}", "is_permanent": True}
+            for key in ("/en/about", "/fr/about", "/old/campaign")
+        },
+        canonical=True,
+    )
+    key_usage = KeyUsage()
+    for _ in range(3):
+        key_usage.record("/en/about")
+    key_usage.record("/fr/about")
+
+    report = key_usage_report(key_usage, redirect_map, limit=1)
+
+    assert report["hits"] == 4
+    assert report["keys"] == 3
+    assert report["top"] == [{"key": "/en/about", "hits": 3}]
+    assert report["top_share"] == 0.75
+    assert report["dead"] == ["/old/campaign"]
@@ -0,0 +1,37 @@
+from metrics import DURATION_BUCKETS, MetricsRegistry, clear_metrics_directory, render_prometheus
+
+
+def test_snapshot_adds_up_processes(tmp_path):
+    worker = MetricsRegistry()
+    worker.configure(str(tmp_path))
+    worker.increment("requests_total", (("branch", "kv"),), 3)
+    worker.observe("request_duration_seconds", (("branch", "kv"),), 0.0002)
+    worker.flush()
+
+    # Pretend the snapshot came from another worker
+    (tmp_path / "1.json").write_text(next(tmp_path.glob("*.json")).read_text())
+    (tmp_path / "2.json").write_text("not json")
+
+    counters, histograms = worker.snapshot()
+    assert counters == {("requests_total", (("branch", "kv"),)): 6}
+    histogram = histograms[("request_duration_seconds", (("branch", "kv"),))]
+    assert sum(histogram[:-1]) == 2
+    assert histogram[DURATION_BUCKETS.index(0.00025)] == 2
+
+    clear_metrics_directory(str(tmp_path))
+    assert list(tmp_path.glob("*.json")) == []
+
+
+def test_render_prometheus():
+    registry = MetricsRegistry()
+    registry.increment("requests_total", (("host", 'we"ird'),))
+    registry.observe("request_duration_seconds", (), 1.0)
+
+    text = render_prometheus(registry.counters, registry.histograms, [("entries", (), 5)], prefix="")
+
+    assert "# TYPE requests_total counter\n" in text
+    assert 'requests_total{host="we\\"ird"} 1\n' in text
+    assert 'request_duration_seconds_bucket{le="0.1"} 0\n' in text
+    assert 'request_duration_seconds_bucket{le="+Inf"} 1\n' in text
+    assert "request_duration_seconds_count 1\n" in text
+    assert "# TYPE entries gauge\nentries 5\n" in text
@@ -0,0 +1,102 @@
+import pytest
+
+from config import ReturnCodes
+from patterns import PatternMatcher, compile_pattern_rule, compile_pattern_rules
+
+
+def build(matcher, path, query_string=""):
+    match = matcher.match(path)
+    if match is None:
+        return None
+    rule, captures = match
+    return rule.build(captures, query_string)
+
+
+def make_matcher(rules):
+    return PatternMatcher([(pattern, compile_pattern_rule(pattern, rule)) for pattern, rule in rules.items()])
+
+
+def test_placeholders_and_trailing_wildcard():
+    matcher = make_matcher(
+        {
+            "/{locale}/campaigns/*": (
+                "https://www.mozillafoundation.org/{locale}/campaigns/*",
+                ReturnCodes.PERMANENT,
+                False,
+            ),
+            "/blog/*/comments": ("https://www.mozillafoundation.org/blog/", ReturnCodes.PERMANENT, False),
+        }
+    )
+
+    assert build(matcher, "/fr/campaigns/old/page") == "https://www.mozillafoundation.org/fr/campaigns/old/page"
+    assert build(matcher, "/fr/campaigns/") == "https://www.mozillafoundation.org/fr/campaigns/"
+    assert build(matcher, "/fr/campaigns") == "https://www.mozillafoundation.org/fr/campaigns/"
+    assert build(matcher, "/blog/a-post/comments") == "https://www.mozillafoundation.org/blog/"
+    assert build(matcher, "/fr/campaignsx") is None
+    assert build(matcher, "/blog/a/b/comments") is None
+
+
+def test_prefix_trie_prefers_longest_prefix():
+    matcher = make_matcher(
+        {
+            "/*": ("https://example.com/*", ReturnCodes.TEMPORARY, False),
+            "/docs/*": ("https://docs.example.com/*", ReturnCodes.PERMANENT, False),
+            "/docs/old/*": ("https://docs.example.com/archive/*", ReturnCodes.PERMANENT, False),
+            "/docs/old": ("https://docs.example.com/archive.html", ReturnCodes.PERMANENT, False),
+        }
+    )
+
+    assert matcher.regex_rules == {}
+    assert build(matcher, "/docs/old/intro") == "https://docs.example.com/archive/intro"
+    assert build(matcher, "/docs/old") == "https://docs.example.com/archive.html"
+    assert build(matcher, "/docs/new/") == "https://docs.example.com/new/"
+    assert build(matcher, "/about") == "https://example.com/about"
+    assert matcher.match("/docs/old/intro")[0].status_code == 301
+    assert matcher.match("/about")[0].status_code == 307
+
+
+def test_regex_patterns_are_tried_first_in_order():
+    matcher = make_matcher(
+        {
+            r"re:/(?P<locale>[a-z]{2}(-[A-Z]{2})?)/(?P<slug>[a-z-]+)-2019/?": (
+                "https://www.mozillafoundation.org/{locale}/archive/{slug}/",
+                ReturnCodes.PERMANENT,
+                True,
+            ),
+            "/{locale}/{slug}": ("https://www.mozillafoundation.org/{locale}/{slug}/", ReturnCodes.PERMANENT, False),
+            "/en/*": ("https://www.mozillafoundation.org/en/", ReturnCodes.PERMANENT, False),
+        }
+    )
+
+    assert build(matcher, "/pt-BR/report-2019", "a=1&a=2") == (
+        "https://www.mozillafoundation.org/pt-BR/archive/report/?a=1"
+    )
+    assert build(matcher, "/en/report") == "https://www.mozillafoundation.org/en/report/"
+    assert build(matcher, "/en/report/more") == "https://www.mozillafoundation.org/en/"
+
+
+def test_compile_pattern_rules():
+    matchers = compile_pattern_rules(
+        {"example.com": {"/old/*": ("https://example.com/new/*", ReturnCodes.PERMANENT, True)}}
+    )
+
+    assert build(matchers["example.com"], "/old/a", "q=1") == "https://example.com/new/a?q=1"
+
+    with pytest.raises(ValueError):
+        compile_pattern_rule("old/*", ("https://example.com/new/*", ReturnCodes.PERMANENT, False))
+
+
+def test_regex_patterns_are_indexed_by_literal_segment():
+    rules = {
+        f"/{{locale}}/campaign-{index}/*": ("https://example.com/{locale}/*", ReturnCodes.PERMANENT, False)
+        for index in range(50)
+    }
+    rules["/{locale}/campaign-7/{slug}"] = ("https://example.com/shadowed/", ReturnCodes.PERMANENT, False)
+    rules["re:/(?P<any>.+)/campaign-7/x"] = ("https://example.com/later/", ReturnCodes.PERMANENT, False)
+    rules["re:/short"] = ("https://example.com/short/", ReturnCodes.PERMANENT, False)
+    matcher = make_matcher(rules)
+
+    assert len(matcher.regexes) == 50
+    assert build(matcher, "/fr/campaign-7/x") == "https://example.com/fr/x"
+    assert build(matcher, "/short") == "https://example.com/short/"
+    assert build(matcher, "/fr") is None
@@ -0,0 +1,55 @@
+import sys
+
+from metrics import METRICS
+from profiler import Profiler, StackSampler, fold_stack, timed
+
+
+def test_timed():
+    timings = {}
+    assert timed(timings, "add", lambda a, b: a + b, 1, 2) == 3
+    assert timed(timings, "add", lambda a, b: a + b, 3, 4) == 7
+    assert list(timings) == ["add"] and timings["add"] >= 0
+
+    assert timed(None, "add", lambda a, b: a + b, 1, 2) == 3
+
+
+def test_profiler_samples_requests(monkeypatch):
+    monkeypatch.setattr(METRICS, "histograms", {})
+    profiler = Profiler(0.5)
+
+    @profiler.stage("double")
+    def double(value):
+        return value * 2
+
+    monkeypatch.setattr("random.random", lambda: 0.9)
+    assert profiler.request(double, 2) == 4
+    assert METRICS.histograms == {}
+
+    monkeypatch.setattr("random.random", lambda: 0.1)
+    assert profiler.request(double, 2) == 4
+    assert set(METRICS.histograms) == {
+        ("stage_duration_seconds", (("stage", "double"),)),
+        ("stage_duration_seconds", (("stage", "request"),)),
+    }
+    assert profiler.current() is None
+
+    # Disabled profilers leave functions alone
+    assert Profiler(0).stage("double")(double.__wrapped__) is double.__wrapped__
+
+
+def test_stack_sampler_writes_folded_stacks(tmp_path):
+    sampler = StackSampler(str(tmp_path / "stacks"), flush_interval=0)
+    frame = sys._getframe()
+    sampler._sample(None, frame)
+    sampler._sample(None, frame)
+    # The signal handler only keeps the samples, they are written by flush()
+    assert list(tmp_path.iterdir()) == []
+    sampler.flush()
+
+    (stacks_file,) = tmp_path.glob("stacks.*")
+    stack, count = stacks_file.read_text().rsplit(" ", 1)
+    assert stack == fold_stack(frame)
+    assert stack.endswith("test_stack_sampler_writes_folded_stacks (test_profiler.py:{})".format(
+        test_stack_sampler_writes_folded_stacks.__code__.co_firstlineno
+    ))
+    assert count == "2\n"
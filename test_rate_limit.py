@@ -0,0 +1,132 @@
+import asyncio
+import threading
+
+import pytest
+
+from rate_limit import LIMITED_STATUS, REDIRECT, RateLimiter, RedisBackend, client_address
+from rate_limit_backend import Counters, serve
+from rules import ASSET, UNMATCHED
+
+CONFIG = {
+    "RATE_LIMIT_ENABLED": True,
+    "RATE_LIMIT_WINDOW": 60,
+    "RATE_LIMIT_BUDGETS": {REDIRECT: 4, ASSET: 2, UNMATCHED: 0},
+    "RATE_LIMIT_MAX_KEYS": 100,
+    "RATE_LIMIT_TRUSTED_PROXIES": 1,
+    "RATE_LIMIT_BACKEND": None,
+    "RATE_LIMIT_SYNC_INTERVAL": 1,
+}
+
+
+@pytest.mark.parametrize(
+    "forwarded_for, trusted_proxies, address",
+    [
+        ("203.0.113.7", 1, "203.0.113.7"),
+        ("10.0.0.1, 203.0.113.7", 1, "203.0.113.7"),
+        ("10.0.0.1, 203.0.113.7, 198.51.100.2", 2, "203.0.113.7"),
+        ("203.0.113.7", 2, "203.0.113.7"),
+        ("10.0.0.1", 0, "192.0.2.1"),
+        (None, 1, "192.0.2.1"),
+    ],
+)
+def test_client_address(forwarded_for, trusted_proxies, address):
+    environ = {"REMOTE_ADDR": "192.0.2.1"}
+    if forwarded_for is not None:
+        environ["HTTP_X_FORWARDED_FOR"] = forwarded_for
+    assert client_address(environ, trusted_proxies) == address
+
+
+def test_sliding_window_budgets():
+    limiter = RateLimiter(CONFIG, lambda environ: None)
+    start = 6000.0
+
+    assert [limiter.hit("a", REDIRECT, start + second) for second in range(5)] == [0, 0, 0, 0, 56]
+    assert [limiter.hit("a", ASSET, start) for _ in range(3)] == [0, 0, 60]
+    # Other clients and budgets without a limit aren't affected
+    assert limiter.hit("b", REDIRECT, start) == 0
+    assert all(limiter.hit("a", UNMATCHED, start) == 0 for _ in range(10))
+
+    # Half way through the next window, half of the previous one still counts
+    assert [limiter.hit("a", REDIRECT, start + 90) for _ in range(3)] == [0, 0, 30]
+    # A window later only the requests of the previous window count
+    assert limiter.hit("a", REDIRECT, start + 150) == 0
+
+
+def test_least_recently_seen_clients_are_forgotten():
+    limiter = RateLimiter({**CONFIG, "RATE_LIMIT_MAX_KEYS": 2}, lambda environ: None)
+    for client in ("a", "b", "a", "c"):
+        limiter.hit(client, REDIRECT, 0.0)
+
+    assert list(limiter._counts) == [("a", REDIRECT), ("c", REDIRECT)]
+
+
+def test_wsgi_answers_429_with_retry_after():
+    limiter = RateLimiter(CONFIG, lambda environ: ASSET if environ["PATH_INFO"].endswith(".php") else None)
+    responses = []
+
+    def application(environ, start_response):
+        start_response("410 GONE", [])
+        return [b""]
+
+    limited_application = limiter.wsgi(application)
+    environ = {"PATH_INFO": "/wp-login.php", "REQUEST_METHOD": "GET", "HTTP_X_FORWARDED_FOR": "203.0.113.7"}
+    for _ in range(3):
+        limited_application(environ, lambda status, headers: responses.append((status, dict(headers))))
+
+    assert [status for status, _ in responses] == ["410 GONE", "410 GONE", LIMITED_STATUS]
+    assert 0 < int(responses[-1][1]["Retry-After"]) <= 60
+    assert limiter.wsgi(application) is not application
+    assert RateLimiter({**CONFIG, "RATE_LIMIT_ENABLED": False}, None).wsgi(application) is application
+
+
+@pytest.fixture
+def backend_url():
+    started = threading.Event()
+    running = {}
+
+    def on_start(server):
+        running["server"] = server
+        started.set()
+
+    async def run():
+        running["loop"], running["stop"] = asyncio.get_running_loop(), asyncio.Event()
+        server = asyncio.create_task(serve("127.0.0.1", 0, Counters(), on_start))
+        await running["stop"].wait()
+        server.cancel()
+
+    thread = threading.Thread(target=asyncio.run, args=(run(),), daemon=True)
+    thread.start()
+    started.wait(5)
+    yield "redis://127.0.0.1:%d" % running["server"].sockets[0].getsockname()[1]
+    running["loop"].call_soon_threadsafe(running["stop"].set)
+    thread.join(5)
+
+
+def test_workers_add_up_their_counts_in_the_backend(backend_url):
+    workers = [RateLimiter({**CONFIG, "RATE_LIMIT_BACKEND": backend_url}, lambda environ: None) for _ in range(2)]
+
+    assert workers[0].hit("a", REDIRECT, 6000.0) == 0
+    assert workers[0].hit("a", REDIRECT, 6000.0) == 0
+    workers[0].sync()
+    assert workers[1].hit("a", REDIRECT, 6001.0) == 0
+    workers[1].sync()
+
+    # The second worker now knows of the 3 requests, the first one catches up on its next sync
+    assert workers[1].hit("a", REDIRECT, 6001.0) == 0
+    assert workers[1].hit("a", REDIRECT, 6001.0) > 0
+    workers[1].sync()
+    workers[0].hit("a", REDIRECT, 6002.0)
+    workers[0].sync()
+    assert workers[0].hit("a", REDIRECT, 6002.0) > 0
+
+    backend = RedisBackend(backend_url)
+    assert backend.execute([("PING",), ("GET", "rate_limit:redirect:100:a")]) == ["PONG", "5"]
+
+    for backend in (backend, *(worker.backend for worker in workers)):
+        backend.close()
+
+
+def test_backend_errors_are_raised():
+    backend = RedisBackend("redis://127.0.0.1:1", timeout=0.1)
+    with pytest.raises(OSError):
+        backend.execute([("PING",)])
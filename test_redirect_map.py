@@ -0,0 +1,335 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import app
+from redirect_map import (
+    KeyFilter,
+    LocaleIndex,
+    MappedRedirectMap,
+    RedirectMapStore,
+    canonical_key,
+    canonical_path,
+    compile_redirect_map,
+    delta_path_for,
+    diff_redirect_maps,
+    redirect_map_checksum,
+)
+
+
+@pytest.fixture(autouse=True)
+def restore_redirect_map():
+    redirect_map = app.REDIRECT_MAP
+    yield
+    app.REDIRECT_MAP = redirect_map
+
+
+def test_locale_index_matches_export():
+    with open("foundation.mozilla.org_wagtail_redirects.json") as f:
+        export = json.load(f)
+
+    index = LocaleIndex(export)
+
+    assert len(index) == len(export)
+    assert {key: index[key] for key in index} == export
+
+
+def test_locale_index_shares_slug_across_locales():
+    index = LocaleIndex()
+    for locale in ("en", "fr", "pt-BR"):
+        index[f"/{locale}/campaigns/old"] = {
+            "redirect_to": f"https://www.mozillafoundation.org/{locale}/campaigns/new/",
+            "is_permanent": True,
+        }
+
+    assert index._slugs.keys() == {"/campaigns/old"}
+    assert len(index._templates) == 1
+    assert index.get("/pt-BR/campaigns/old") == {
+        "redirect_to": "https://www.mozillafoundation.org/pt-BR/campaigns/new/",
+        "is_permanent": True,
+    }
+    assert index.get("/de/campaigns/old") is None
+
+
+def test_locale_index_keeps_exceptions_exact():
+    index = LocaleIndex()
+    index["/en/about"] = {"redirect_to": "https://www.mozillafoundation.org/en/who-we-are/", "is_permanent": True}
+    index["/fr/about"] = {"redirect_to": "https://www.mozillafoundation.org/fr/qui/", "is_permanent": False}
+    index["/about"] = {"redirect_to": "https://www.mozillafoundation.org/en/who-we-are/", "is_permanent": True}
+
+    assert index["/fr/about"] == {"redirect_to": "https://www.mozillafoundation.org/fr/qui/", "is_permanent": False}
+    assert index["/about"]["redirect_to"] == "https://www.mozillafoundation.org/en/who-we-are/"
+    assert len(index) == 3
+
+    del index["/en/about"]
+    del index["/fr/about"]
+
+    assert "/en/about" not in index
+    assert set(index) == {"/about"}
+
+
+def test_locale_index_keeps_looked_up_entries_built():
+    index = LocaleIndex()
+    index["/en/about"] = {"redirect_to": "https://www.mozillafoundation.org/en/who-we-are/", "is_permanent": True}
+    index["/fr/about"] = {"redirect_to": "https://www.mozillafoundation.org/fr/who-we-are/", "is_permanent": True}
+
+    entry = index.get("/fr/about")
+    assert index.get("/fr/about") is entry
+
+    # A write drops the built entries, they may be stale
+    changed = {"redirect_to": "https://www.mozillafoundation.org/fr/qui/", "is_permanent": False}
+    index["/fr/about"] = changed
+    assert index.get("/fr/about") == changed
+    del index["/fr/about"]
+    assert index.get("/fr/about") is None
+
+
+def test_canonical_key():
+    assert canonical_key("/About/Trademarks/") == "/about/trademarks"
+    assert canonical_key("/about//trademarks") == "/about/trademarks"
+    assert canonical_key("/en/blog/espa%C3%B1ol") == "/en/blog/español"
+    assert canonical_key("/PT-br/Campaigns") == "/pt-BR/campaigns"
+    assert canonical_key("/about/?utf=a_campaign&q=test") == "/about?q=test&utf=a_campaign"
+    assert canonical_key("/") == "/"
+    assert canonical_key("//") == "/"
+
+
+def test_canonical_locale_index_canonicalizes_keys():
+    index = LocaleIndex(canonical=True)
+    index["/en/About/"] = {"redirect_to": "https://www.mozillafoundation.org/en/who-we-are/", "is_permanent": True}
+
+    assert index.get("/en/about") == {
+        "redirect_to": "https://www.mozillafoundation.org/en/who-we-are/",
+        "is_permanent": True,
+    }
+    assert "/en/about" in index.key_filter
+
+    del index["/EN/about//"]
+    assert len(index) == 0
+
+
+def test_mapped_redirect_map_matches_export(tmp_path):
+    with open("foundation.mozilla.org_wagtail_redirects.json") as f:
+        export = json.load(f)
+
+    compiled_path = tmp_path / "redirects.bin"
+    compile_redirect_map(export, compiled_path)
+    mapped = MappedRedirectMap(compiled_path)
+
+    canonical_export = {canonical_key(key): entry for key, entry in export.items()}
+    assert len(mapped) == len(canonical_export)
+    assert {key: mapped[key] for key in mapped} == canonical_export
+    assert mapped.get("/not/a/redirect") is None
+    assert mapped.get("") is None
+
+
+def test_mapped_redirect_map_clears_in_place(tmp_path):
+    compiled = {"/about": {"redirect_to": "https://example.com/about/", "is_permanent": True}}
+    compile_redirect_map(compiled, tmp_path / "redirects.bin")
+    mapped = MappedRedirectMap(tmp_path / "redirects.bin")
+    mapped["/new"] = {"redirect_to": "https://example.com/new/"}
+    assert canonical_path("/about") in mapped.key_filter
+
+    mapped.clear()
+    assert len(mapped) == 0
+    assert list(mapped) == []
+    assert mapped.get("/about") is None
+    assert "/new" not in mapped
+    assert canonical_path("/about") not in mapped.key_filter
+    # Nothing removed went through the overlay
+    assert mapped._overlay == {}
+
+    mapped["/about"] = {"redirect_to": "https://example.com/again/", "is_permanent": True}
+    assert dict(mapped) == {"/about": {"redirect_to": "https://example.com/again/", "is_permanent": True}}
+
+
+def test_load_redirect_map_prefers_compiled_file(tmp_path):
+    export_path = tmp_path / "redirects.json"
+    export_path.write_text(json.dumps({"/about": {"redirect_to": "https://example.com/json/", "is_permanent": True}}))
+
+    app.load_redirect_map(str(export_path))
+    assert isinstance(app.REDIRECT_MAP, LocaleIndex)
+
+    compiled = {"/about": {"redirect_to": "https://example.com/bin/", "is_permanent": True}}
+    compile_redirect_map(compiled, tmp_path / "redirects.bin")
+    app.load_redirect_map(str(export_path))
+    assert isinstance(app.REDIRECT_MAP, MappedRedirectMap)
+    assert app.REDIRECT_MAP["/about"]["redirect_to"] == "https://example.com/bin/"
+
+    # An export newer than its compiled file wins
+    os.utime(export_path, (time.time() + 10, time.time() + 10))
+    app.load_redirect_map(str(export_path))
+    assert app.REDIRECT_MAP["/about"]["redirect_to"] == "https://example.com/json/"
+
+
+def test_redirect_map_store_loads_lazily_within_budget(tmp_path):
+    paths = []
+    for name in ("a", "b", "c"):
+        path = tmp_path / f"{name}.json"
+        entries = {f"/{name}": {"redirect_to": f"https://example.com/{name}/", "is_permanent": True}}
+        path.write_text(json.dumps(entries))
+        paths.append(str(path))
+    size = os.path.getsize(paths[0])
+
+    loaded = []
+
+    def load(path):
+        loaded.append(path)
+        return app.build_redirect_map(path)
+
+    store = RedirectMapStore(load, budget=size * 2)
+    assert len(store) == 0
+
+    assert store.get(paths[0])["/a"]["redirect_to"] == "https://example.com/a/"
+    store.get(paths[1])
+    store.get(paths[0])
+    assert loaded == paths[:2]
+
+    # b is the least recently used
+    store.get(paths[2])
+    assert len(store) == 2
+    assert store.evictions == 1
+    store.get(paths[0])
+    store.get(paths[1])
+    assert loaded == [*paths, paths[1]]
+
+    # A single map over budget is still served
+    store.budget = 1
+    assert store.get(paths[2])["/c"]["redirect_to"] == "https://example.com/c/"
+    assert len(store) == 1
+
+
+def test_key_filter_has_every_path():
+    with open("foundation.mozilla.org_wagtail_redirects.json") as f:
+        export = json.load(f)
+
+    key_filter = KeyFilter(export)
+    for key in export:
+        path = canonical_path(key)
+        assert path in key_filter
+        assert canonical_path(path + "/?utm_source=x") in key_filter
+
+    assert not any(f"/not/a/redirect/{number}" in key_filter for number in range(10000))
+
+
+def test_key_filter_follows_map_changes():
+    index = LocaleIndex({"/about": {"redirect_to": "https://example.com/about/", "is_permanent": True}})
+    assert "/about" in index.key_filter
+    assert app.lookup_keyvalue_redirect("new/", "", index) is None
+
+    index["/new"] = {"redirect_to": "https://example.com/new/", "is_permanent": False}
+    assert app.lookup_keyvalue_redirect("new/", "", index) == ("https://example.com/new/", 302, "/new")
+
+
+def edited_export(export):
+    """
+    The export with a few redirects removed, changed and added.
+    """
+    edited = dict(list(export.items())[10:])
+    for key in list(edited)[:5]:
+        edited[key] = {"redirect_to": "https://example.com/changed/", "is_permanent": False}
+    edited["/fr/brand-new-page/"] = {"redirect_to": "https://example.com/fr/new/", "is_permanent": True}
+    edited["/campaigns/new?utm_source=x"] = {"redirect_to": "https://example.com/campaign/", "is_permanent": False}
+    return edited
+
+
+@pytest.mark.parametrize("kind", ["index", "mapped"])
+def test_apply_delta_matches_new_export(kind, tmp_path):
+    with open("foundation.mozilla.org_wagtail_redirects.json") as f:
+        export = json.load(f)
+    edited = edited_export(export)
+
+    if kind == "index":
+        redirect_map = LocaleIndex(export, canonical=True)
+    else:
+        compile_redirect_map(export, tmp_path / "redirects.bin")
+        redirect_map = MappedRedirectMap(tmp_path / "redirects.bin")
+    assert redirect_map.checksum == redirect_map_checksum(export)
+    assert app.lookup_keyvalue_redirect("FR/brand-new-page", "", redirect_map) is None
+
+    delta = diff_redirect_maps(export, edited)
+    assert len(delta["set"]) == 7
+    assert len(delta["remove"]) == 10
+    redirect_map.apply_delta(delta)
+
+    assert redirect_map.checksum == delta["checksum"] == redirect_map_checksum(edited)
+    assert dict(redirect_map) == {canonical_key(key): entry for key, entry in edited.items()}
+    assert app.lookup_keyvalue_redirect("FR/brand-new-page", "", redirect_map)[0] == "https://example.com/fr/new/"
+    assert app.lookup_keyvalue_redirect("campaigns/new", "utm_source=x", redirect_map)[0] == (
+        "https://example.com/campaign/"
+    )
+
+
+def test_apply_delta_during_lookups_keeps_added_keys():
+    export = {f"/page-{number}": {"redirect_to": "https://example.com/", "is_permanent": True} for number in range(10)}
+    edited = {**export, **{f"/new-{number}": {"redirect_to": "https://example.com/new/"} for number in range(10)}}
+    lookups = []
+
+    class LookedUpIndex(LocaleIndex):
+        def __setitem__(self, key, value):
+            super().__setitem__(key, value)
+            if key.startswith("/new-") and not lookups:
+                # A request on another thread looks up the map halfway through the delta
+                lookup = threading.Thread(target=lambda: "/new-0" in self.key_filter)
+                lookups.append(lookup)
+                lookup.start()
+                lookup.join(0.1)
+
+    index = LookedUpIndex(export, canonical=True)
+    index.key_filter
+    index.apply_delta(diff_redirect_maps(export, edited))
+    lookups[0].join()
+
+    for key in edited:
+        assert key in index.key_filter
+
+
+def test_apply_delta_rejects_drift():
+    export = {"/about": {"redirect_to": "https://example.com/about/", "is_permanent": True}}
+    edited = {"/new": {"redirect_to": "https://example.com/new/", "is_permanent": True}}
+    delta = diff_redirect_maps(export, edited)
+
+    # Made from another map
+    index = LocaleIndex(edited, canonical=True)
+    with pytest.raises(ValueError):
+        index.apply_delta(delta)
+
+    # Doesn't add up to its checksum
+    index = LocaleIndex(export, canonical=True)
+    version = index.version
+    with pytest.raises(ValueError):
+        index.apply_delta({**delta, "checksum": redirect_map_checksum(export)})
+    assert index.version == version
+    assert dict(index) == export
+
+
+def test_watcher_applies_delta_in_place(tmp_path):
+    export = {"/about": {"redirect_to": "https://example.com/about/", "is_permanent": True}}
+    edited = {**export, "/new": {"redirect_to": "https://example.com/new/", "is_permanent": False}}
+    export_path = tmp_path / "redirects.json"
+    export_path.write_text(json.dumps(export))
+
+    config = app.load_config({"REDIRECT_MAP_PATH": str(export_path), "REDIRECT_MAP_POLL_INTERVAL": 0})
+    app.load_redirect_map(str(export_path))
+    redirect_map = app.REDIRECT_MAP
+    watcher = app.watch_redirect_map(config)
+    deltas = app.RELOAD_STATS["deltas"]
+
+    with open(delta_path_for(str(export_path)), "w") as f:
+        json.dump(diff_redirect_maps(export, edited), f)
+    watcher.poll()
+
+    assert app.REDIRECT_MAP is redirect_map
+    assert app.RELOAD_STATS["deltas"] == deltas + 1
+    assert app.lookup_keyvalue_redirect("new", "", app.REDIRECT_MAP) == ("https://example.com/new/", 302, "/new")
+
+    # A new export is loaded with its delta
+    export_path.write_text(json.dumps(export))
+    os.utime(export_path, (time.time() + 10, time.time() + 10))
+    watcher.poll()
+
+    assert app.REDIRECT_MAP is not redirect_map
+    assert dict(app.REDIRECT_MAP) == edited
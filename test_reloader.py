@@ -0,0 +1,23 @@
+import os
+
+from reloader import FileWatcher
+
+
+def test_file_watcher_polls_mtimes(tmp_path):
+    watched = tmp_path / "redirects.json"
+    watched.write_text("{}")
+    changes = []
+
+    watcher = FileWatcher([str(watched), str(tmp_path / "missing.bin")], 0, changes.append)
+
+    watcher.poll()
+    assert changes == []
+
+    os.utime(watched, ns=(0, 0))
+    watcher.poll()
+    watcher.poll()
+    assert changes == [[str(watched)]]
+
+    # Polling is disabled with an interval of 0
+    watcher.ensure_running()
+    assert watcher._thread is None
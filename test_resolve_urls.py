@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+import app
+import resolve_urls
+from redirect_map import LocaleIndex
+from resolve_urls import main
+
+URLS = [
+    "https://foundation.mozilla.org/about/",
+    "donate.mozilla.org/fr/faq",
+    "http://give.mozilla.org/a?b=1",
+    "https://unknown.example/page",
+    "ftp://foundation.mozilla.org/about",
+]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_resolve_urls(tmp_path, monkeypatch, workers):
+    entries = {"/about": {"redirect_to": "https://www.mozillafoundation.org/en/who-we-are/", "is_permanent": True}}
+    monkeypatch.setattr(app, "REDIRECT_MAP", LocaleIndex(entries, canonical=True))
+    input_path = tmp_path / "urls.txt"
+    input_path.write_text("\n".join(URLS) + "\n\n")
+    output_path = tmp_path / "results.jsonl"
+
+    assert main([str(input_path), "--output", str(output_path), "--workers", str(workers)]) == 0
+
+    records = [json.loads(line) for line in output_path.read_text().splitlines()]
+    assert [record["url"] for record in records] == URLS
+    assert records[0] == {
+        "url": "https://foundation.mozilla.org/about/",
+        "host": "foundation.mozilla.org",
+        "status": 301,
+        "location": "https://www.mozillafoundation.org/en/who-we-are/",
+        "branch": "kv",
+        "matched": "/about",
+    }
+    assert records[1]["location"] == "https://www.mozillafoundation.org/donate/faq"
+    assert records[1]["branch"] == "donate"
+    assert records[2]["location"] == "https://donate.mozilla.org/a?b=1"
+    assert records[3]["status"] == 400
+    assert records[4] == {"url": "ftp://foundation.mozilla.org/about", "error": "not an http(s) URL"}
+
+
+def test_resolve_urls_reads_input_in_batches(monkeypatch):
+    monkeypatch.setattr(resolve_urls, "BATCH_SIZE", 10)
+    read = []
+
+    def urls():
+        for number in range(100):
+            read.append(number)
+            yield f"https://foundation.mozilla.org/page-{number}"
+
+    results = resolve_urls.resolve_urls(urls(), app.load_config(), 2)
+    next(results)
+    # The first batch, and the next one handed to the pool while the first is written
+    assert len(read) == 20
+
+    assert len(list(results)) == 99
+    assert len(read) == 100
@@ -0,0 +1,44 @@
+from urllib.parse import ParseResult, urlencode, urlparse, urlunparse
+
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+from config import Config
+from rules import compile_rules
+
+
+def build_with_urlunparse(rule, path, query_string):
+    """
+    The per-request URL building that compiled rules replace.
+    """
+    args = Request(EnvironBuilder(query_string=query_string).get_environ()).args
+    redirect_target, _, (preserve_path, preserve_query) = rule
+    target_url = urlparse(redirect_target)
+
+    return urlunparse(
+        ParseResult(
+            scheme=target_url.scheme,
+            netloc=target_url.netloc,
+            path=path if preserve_path else target_url.path,
+            query=urlencode(args, doseq=True) if preserve_query else target_url.query,
+            params="",
+            fragment="",
+        )
+    )
+
+
+def test_compiled_rules_match_urlunparse():
+    host_rules = compile_rules(Config.REDIRECT_RULES)
+    requests = [
+        ("", ""),
+        ("path/", ""),
+        ("deep/path/index.html", "q=1&utm_source=a+b&q=2"),
+        ("/leading-slash", "empty&encoded=%E2%9C%93"),
+    ]
+
+    for host, rule in Config.REDIRECT_RULES.items():
+        compiled = host_rules[host]
+        assert compiled.status_code == rule[1].value
+
+        for path, query_string in requests:
+            assert compiled.build(path, query_string) == build_with_urlunparse(rule, path, query_string)